@@ -0,0 +1,136 @@
+# answer_cache.py  (semantic cache of LLM answers: sqlite + TTL + LRU)
+from __future__ import annotations
+import os, json, time, sqlite3, hashlib, threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+ANSWER_CACHE          = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_PATH     = Path(os.getenv("ANSWER_CACHE_PATH", "cache/answers.sqlite3"))
+ANSWER_CACHE_SIM      = float(os.getenv("ANSWER_CACHE_SIM", 0.92))     # cosine ขั้นต่ำของคำถาม
+ANSWER_CACHE_TTL_S    = float(os.getenv("ANSWER_CACHE_TTL_S", 86400))
+ANSWER_CACHE_MAX_ROWS = int(os.getenv("ANSWER_CACHE_MAX_ROWS", 5000))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    ctx_hash  TEXT NOT NULL,
+    version   TEXT NOT NULL,
+    qnorm     TEXT NOT NULL,
+    qvec      BLOB,
+    response  TEXT NOT NULL,
+    tokens    INTEGER NOT NULL DEFAULT 0,
+    created   REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_ctx ON answers (ctx_hash, version);
+CREATE INDEX IF NOT EXISTS answers_lru ON answers (last_used);
+"""
+
+
+def ctx_hash(ctx: str) -> str:
+    return hashlib.sha1(ctx.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    key = (hash ของ context ที่ pack แล้ว, index version) + คำถามที่ใกล้กันพอ (cosine ≥ sim)
+    context เดียวกันแปลว่า retrieval ได้ชุดเอกสารเดียวกัน → คำตอบเดิมยังใช้ได้
+    """
+
+    def __init__(self, path: Path = ANSWER_CACHE_PATH, sim: float = ANSWER_CACHE_SIM,
+                 ttl_s: float = ANSWER_CACHE_TTL_S, max_rows: int = ANSWER_CACHE_MAX_ROWS):
+        self.path = Path(path)
+        self.sim = sim
+        self.ttl_s = ttl_s
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self._local = threading.local()
+        self._puts = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite connection ใช้ข้าม thread ไม่ได้ → 1 connection ต่อ thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, qnorm: str, qvec: Optional[np.ndarray], chash: str, version: str) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        now = time.time()
+        rows = conn.execute(
+            "SELECT id, qnorm, qvec, response, tokens FROM answers "
+            "WHERE ctx_hash = ? AND version = ? AND created >= ?",
+            (chash, version, now - self.ttl_s),
+        ).fetchall()
+
+        best, best_sim = None, -1.0
+        for row in rows:
+            if row[1] == qnorm:
+                best, best_sim = row, 1.0
+                break
+            if qvec is None or row[2] is None:
+                continue
+            v = np.frombuffer(row[2], dtype=np.float32)
+            if v.shape != qvec.shape:
+                continue
+            s = float(v @ qvec / ((np.linalg.norm(v) * np.linalg.norm(qvec)) or 1.0))
+            if s > best_sim:
+                best, best_sim = row, s
+
+        if best is None or best_sim < self.sim:
+            self.misses += 1
+            return None
+
+        with conn:
+            conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (now, best[0]))
+        self.hits += 1
+        self.saved_tokens += int(best[4])
+        out = json.loads(best[3])
+        out["cache_similarity"] = round(best_sim, 4)
+        out["saved_tokens"] = int(best[4])
+        return out
+
+    def put(self, qnorm: str, qvec: Optional[np.ndarray], chash: str, version: str,
+            response: Dict[str, Any]) -> None:
+        conn = self._conn()
+        now = time.time()
+        blob = np.asarray(qvec, dtype=np.float32).tobytes() if qvec is not None else None
+        tokens = int((response.get("usage") or {}).get("total_tokens", 0))
+        with conn:
+            conn.execute(
+                "INSERT INTO answers (ctx_hash, version, qnorm, qvec, response, tokens, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (chash, version, qnorm, blob, json.dumps(response, ensure_ascii=False), tokens, now, now),
+            )
+        self._puts += 1
+        if self._puts % 50 == 1:
+            self.prune(version)
+
+    def prune(self, version: str) -> None:
+        """ลบของที่ index version ไม่ตรง / หมดอายุ แล้วตัด LRU ให้เหลือ max_rows"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM answers WHERE version != ? OR created < ?",
+                         (version, time.time() - self.ttl_s))
+            conn.execute(
+                "DELETE FROM answers WHERE id IN ("
+                "SELECT id FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "saved_tokens": self.saved_tokens,
+        }
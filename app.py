@@ -1,12 +1,26 @@
 import streamlit as st
-import pandas as pd
 import os
+import time
 from pathlib import Path
 
+import catalog
+import faq_search
+from extractive import norm_question
+from index_store import active_dir
+
+try:
+    from st_keyup import st_keyup   # optional: pip install streamlit-keyup → rerun ทุก keystroke
+except ImportError:
+    st_keyup = None
+
 # --- Config & Path ---
 BASE_DIR = Path(__file__).parent
 DATA_PATH = BASE_DIR / "data" / "faq_decision_tree.csv"
+INDEX_PATH = BASE_DIR / os.getenv("INDEX_PATH", "index")    # catalog.json จาก build_index / catalog.py
 ASSETS_PATH = BASE_DIR / "assets" / "pumpui.png"
+SEARCH_LIMIT = 8
+APP_VECTOR_SEARCH = os.getenv("APP_VECTOR_SEARCH", "0") == "1"   # เติมผลด้วย retrieval.retrieve (โหลด embedder)
+ASK_TOP_K = int(os.getenv("ASK_TOP_K", 5))
 
 st.set_page_config(
     page_title="FIT Assistant",
@@ -172,41 +186,82 @@ def inject_theme():
     st.markdown(css, unsafe_allow_html=True)
 
 # --- Data Loading ---
+EMPTY_CATALOG = {"version": "", "tree": {}, "items": {}}
+
 @st.cache_data
-def load_faq_data():
-    if not DATA_PATH.exists(): return {}
+def load_faq_data(version):
+    # version = content hash ของ catalog → build ใหม่ที่เนื้อหาเปลี่ยนเท่านั้นที่ทำให้ cache หมดอายุ
+    if version and not version.startswith("csv:"):
+        try:
+            return catalog.load_catalog(active_dir(INDEX_PATH))
+        except (OSError, ValueError) as e:
+            st.warning(f"Could not read FAQ catalog ({e}); falling back to the CSV.")
+    if not DATA_PATH.exists(): return EMPTY_CATALOG
     try:
-        df = pd.read_csv(DATA_PATH)
-        df.columns = [c.strip() for c in df.columns]
-        tree = {}
-        for _, row in df.iterrows():
-            cat = str(row["Category"]).strip()
-            sub = str(row["Subcategory"]).strip()
-            qst = str(row["Question"]).strip()
-            ans = str(row["Answer"]).strip()
-            if not cat or not sub or not qst: continue
-            
-            if cat not in tree: tree[cat] = {}
-            if sub not in tree[cat]: tree[cat][sub] = []
-            tree[cat][sub].append({"q": qst, "a": ans})
-        return tree
-    except: return {}
+        return catalog.compile_csv(DATA_PATH)
+    except (OSError, ValueError) as e:
+        st.error(f"Could not load FAQ data: {e}")
+        return EMPTY_CATALOG
+
+def faq_version():
+    """cache key ของ load_faq_data: hash ของ catalog.json หรือ stat ของ CSV ถ้ายังไม่ได้ build"""
+    version = catalog.catalog_hash(active_dir(INDEX_PATH))
+    if version:
+        return version
+    try:
+        stat = DATA_PATH.stat()
+        return f"csv:{stat.st_mtime_ns}:{stat.st_size}"
+    except OSError:
+        return ""
+
+@st.cache_resource
+def get_search_index(version, _data):
+    # 1 index ต่อ process ต่อ catalog version (_data ไม่ถูก hash)
+    return faq_search.QuestionIndex(_data)
+
+def vector_hits(index, query):
+    # query สั้น ๆ ระหว่างพิมพ์ lexical แม่นกว่าอยู่แล้ว; ประโยคยาวค่อยเติมด้วย semantic search
+    if not APP_VECTOR_SEARCH or len(query.split()) < 3:
+        return []
+    try:
+        import retrieval
+        return index.ids_for_results(retrieval.retrieve(query, k=SEARCH_LIMIT))
+    except Exception:
+        return []   # Chroma / model ยังไม่พร้อม → lexical อย่างเดียว
+
+@st.cache_resource(show_spinner="Loading the assistant…")
+def load_rag():
+    # embedder + Chroma collection + Mistral client: ครั้งเดียวต่อ process ทุก session ใช้ร่วมกัน
+    # (raise = ไม่ถูก cache → rerun หน้าถัดไปลองใหม่ได้)
+    import retrieval, llm
+    retrieval.get_embedder()
+    retrieval.get_collection()
+    llm.get_client()
+    return retrieval, llm
 
 # --- State Management ---
 if "view" not in st.session_state:
     st.session_state.view = "home" # home, subcategory, question_list, article
 if "context" not in st.session_state:
-    st.session_state.context = {} # stores 'cat', 'sub', 'q_item'
+    st.session_state.context = {} # stores 'cat', 'sub', 'qid', 'origin'
+if "chat" not in st.session_state:
+    st.session_state.chat = [] # Ask view: [{'q', 'text', 'sources', 'debug'}]
 
 def navigate(view_name, **kwargs):
     st.session_state.view = view_name
+    if view_name != "article":
+        st.session_state.context.pop("origin", None)   # Back จาก article กลับ Ask เฉพาะที่มาจาก citation
     for k, v in kwargs.items():
         st.session_state.context[k] = v
 
 def go_back():
     current = st.session_state.view
-    if current == "article":
+    if current == "article" and st.session_state.context.get("origin") == "ask":
+        navigate("ask")
+    elif current == "article":
         navigate("question_list")
+    elif current == "ask":
+        navigate("home")
     elif current == "question_list":
         navigate("subcategory")
     elif current == "subcategory":
@@ -231,7 +286,34 @@ def render_header(title, subtitle=None, show_back=False):
 def icon(label):
     return f"🔹 {label}"
 
-def render_home(data_tree):
+def render_search(data):
+    """search box; คืน True ถ้ากำลังแสดงผลค้นหา (ซ่อนรายการหมวด)"""
+    kwargs = dict(key="faq_search", placeholder="🔍 Search questions…", label_visibility="collapsed")
+    if st_keyup is not None:
+        query = st_keyup("Search questions", debounce=150, **kwargs)
+    else:
+        query = st.text_input("Search questions", **kwargs)
+    if not (query or "").strip():
+        return False
+
+    t0 = time.perf_counter()
+    index = get_search_index(data["version"], data)
+    hits = index.search(query, SEARCH_LIMIT)
+    if len(hits) < SEARCH_LIMIT:
+        hits = faq_search.merge_hits(hits, vector_hits(index, query), SEARCH_LIMIT)
+    took_ms = (time.perf_counter() - t0) * 1000
+
+    if not hits:
+        st.caption("No matching questions.")
+    for i, (qid, _) in enumerate(hits):
+        item = data["items"][qid]
+        if st.button(f"📄 {item['q']}", key=f"search_{i}"):
+            navigate("article", cat=item["cat"], sub=item["sub"], qid=qid)
+            st.rerun()
+    st.caption(f"{len(hits)} results · {took_ms:.1f} ms")
+    return True
+
+def render_home(data):
     # Header
     # Header (No Logo)
     st.markdown("<h3 style='margin-bottom: 0px;'>FIT Support</h3>", unsafe_allow_html=True)
@@ -239,59 +321,48 @@ def render_home(data_tree):
 
     # st.write("---")  <-- Replaced with tighter HTML hr
     st.markdown("<hr style='margin: 0.5rem 0 1.5rem 0; border: none; border-top: 1px solid #E6E8EB;'>", unsafe_allow_html=True)
+
+    if st.button("💬 Ask a question", key="home_ask"):
+        navigate("ask")
+        st.rerun()
+
+    if render_search(data):
+        return
     
-    # Categories ensuring specific order and renaming
-    # Format: (CSV Key, Display Name)
-    CUSTOM_ORDER = [
-        ("💻 How to use FIT web app", "💻 How to use FIT web app"),
-        ("📦 General Information", "📦 General Information"),
-        ("📊 Methodology", "📊 Methodology"),
-        ("📱 FIT mobile app", "📱 FIT mobile app"),
-        ("🆘 Support", "🆘 Support")
-    ]
-    
-    # 1. Render specific categories in order
-    displayed_keys = set()
-    for i, (key, label) in enumerate(CUSTOM_ORDER):
-        if key in data_tree:
-            if st.button(label, key=f"home_cat_{i}"):
-                navigate("subcategory", cat=key)
-                st.rerun()
-            displayed_keys.add(key)
-            
-    # 2. Render any remaining categories (fallback)
-    other_cats = sorted([k for k in data_tree.keys() if k not in displayed_keys])
-    for i, cat in enumerate(other_cats):
-        # Offset key index to avoid duplicates
-        if st.button(cat, key=f"home_cat_other_{i}"):
+    # Categories are pre-ordered in the catalog (catalog.CATEGORY_ORDER, then the rest alphabetically)
+    for i, cat in enumerate(data["tree"]):
+        if st.button(cat, key=f"home_cat_{i}"):
             navigate("subcategory", cat=cat)
             st.rerun()
 
-def render_subcategory(data_tree):
+def render_subcategory(data):
     cat = st.session_state.context.get("cat")
     render_header(title=cat, subtitle="Select a topic", show_back=True)
     
-    subcats = data_tree.get(cat, {})
-    for i, sub in enumerate(sorted(subcats.keys())):
+    subcats = data["tree"].get(cat, {})
+    for i, sub in enumerate(subcats):
         if st.button(f"🔹 {sub}", key=f"sub_{i}"):
             navigate("question_list", sub=sub)
             st.rerun()
 
-def render_question_list(data_tree):
+def render_question_list(data):
     cat = st.session_state.context.get("cat")
     sub = st.session_state.context.get("sub")
     render_header(title=sub, subtitle=f"In {cat}", show_back=True)
     
-    questions = data_tree.get(cat, {}).get(sub, [])
-    for i, item in enumerate(questions):
-        if st.button(f"📄 {item['q']}", key=f"q_{i}"):
-            navigate("article", q_item=item)
+    questions = data["tree"].get(cat, {}).get(sub, [])
+    for i, qid in enumerate(questions):
+        if st.button(f"📄 {data['items'][qid]['q']}", key=f"q_{i}"):
+            navigate("article", qid=qid)
             st.rerun()
 
-def render_article(data_tree):
-    cat = st.session_state.context.get("cat")
-    sub = st.session_state.context.get("sub")
-    item = st.session_state.context.get("q_item")
+def render_article(data):
+    item = data["items"].get(st.session_state.context.get("qid"))
+    if item is None:
+        # catalog ถูก build ใหม่แล้วคำถามนี้หายไป → กลับหน้าแรก
+        navigate("home")
+        st.rerun()
+    cat, sub = item["cat"], item["sub"]
     
     render_header(title=item['q'], show_back=True)
     
@@ -301,16 +372,22 @@ def render_article(data_tree):
     
     # Related Questions
     st.markdown("#### Related Questions")
-    questions = data_tree.get(cat, {}).get(sub, [])
-    related = [q for q in questions if q['q'] != item['q']]
+    qid_here = st.session_state.context.get("qid")
+    # neighbour graph จาก build_index (related.py): dict lookup, ข้ามหมวดได้
+    related = data.get("related", {}).get(qid_here, [])
+    if not related:
+        # ไม่มี graph หรือไม่มี neighbour ที่ผ่าน RELATED_MIN_SIM → ใช้คำถามในหมวดย่อยเดียวกันแทน
+        questions = data["tree"].get(cat, {}).get(sub, [])
+        related = [qid for qid in questions if qid != qid_here]
     
     if not related:
         st.caption("No related questions found.")
         
-    for i, r_item in enumerate(related):
+    for i, qid in enumerate(related):
+        r_item = data["items"][qid]
         # type="primary" triggers our custom text-only CSS
         if st.button(f"➤ {r_item['q']}", key=f"rel_{i}", type="primary"):
-            navigate("article", q_item=r_item)
+            navigate("article", cat=r_item["cat"], sub=r_item["sub"], qid=qid)
             st.rerun()
             
     st.write("---")
@@ -318,21 +395,106 @@ def render_article(data_tree):
         navigate("home")
         st.rerun()
 
+def render_sources(data, msg, m):
+    # citation [Q#] → ปุ่มไปหน้า article ของคำถามนั้น (เฉพาะที่ถูกอ้างในคำตอบจริง)
+    index = get_search_index(data["version"], data)
+    cited = []
+    for n, question in enumerate(msg["sources"], 1):
+        qid = index.by_question.get(norm_question(question))
+        if qid is not None and f"[Q{n}]" in msg["text"]:
+            cited.append((n, qid))
+    if cited:
+        st.caption("Sources")
+    for n, qid in cited:
+        item = data["items"][qid]
+        if st.button(f"[Q{n}] {item['q']}", key=f"cite_{m}_{n}", type="primary"):
+            navigate("article", cat=item["cat"], sub=item["sub"], qid=qid, origin="ask")
+            st.rerun()
+
+def render_debug(msg):
+    with st.expander("Debug", expanded=False):
+        st.json(msg["debug"])
+
+def ask(rag, question):
+    """retrieve → stream คำตอบลง placeholder ทีละ token; คืน message dict สำหรับ history"""
+    retrieval, llm = rag
+    placeholder = st.empty()
+    state = {"text": "", "model": None, "ttft": None}
+    t0 = time.perf_counter()
+
+    def on_token(piece, model):
+        if state["ttft"] is None:
+            state["ttft"] = time.perf_counter() - t0
+        if model != state["model"]:
+            # escalate ไป smart model → เริ่มข้อความใหม่
+            state["text"], state["model"] = "", model
+        state["text"] += piece
+        placeholder.markdown(state["text"] + "▌")
+
+    chunks = retrieval.retrieve(question, k=ASK_TOP_K)
+    t_retrieve = time.perf_counter() - t0
+    out = llm.answer_stream(question, chunks, on_token)
+    placeholder.markdown(out["text"])
+
+    ms = lambda x: round(x * 1000, 1) if x is not None else None
+    debug = {
+        "ttft_ms": ms(state["ttft"]),
+        "retrieve_ms": ms(t_retrieve),
+        "total_ms": ms(time.perf_counter() - t0),
+        "model": out.get("model_used"),
+        "escalated_from": out.get("escalated_from"),
+        "extractive": out.get("extractive"),
+        "cache_hit": out.get("cache_hit"),
+        "usage": out.get("usage"),
+        "top_score": round(chunks[0]["score"], 3) if chunks else None,
+        "error": out.get("error"),
+    }
+    return {"q": question, "text": out["text"], "sources": out.get("sources") or [], "debug": debug}
+
+def render_ask(data):
+    render_header(title="Ask FIT Assistant", subtitle="Answers are generated from the FAQ", show_back=True)
+    try:
+        rag = load_rag()
+    except Exception as e:   # ไม่มี API key / index ยังไม่ได้ build
+        st.error(f"The assistant is not available right now: {e}")
+        return
+
+    for m, msg in enumerate(st.session_state.chat):
+        with st.chat_message("user"):
+            st.markdown(msg["q"])
+        with st.chat_message("assistant"):
+            st.markdown(msg["text"])
+            render_sources(data, msg, m)
+            render_debug(msg)
+
+    question = st.chat_input("Ask about FIT…")
+    if not question:
+        return
+    with st.chat_message("user"):
+        st.markdown(question)
+    with st.chat_message("assistant"):
+        msg = ask(rag, question)
+        st.session_state.chat.append(msg)
+        render_sources(data, msg, len(st.session_state.chat) - 1)
+        render_debug(msg)
+
 # --- Main App ---
 def main():
     inject_theme()
-    data_tree = load_faq_data()
+    data = load_faq_data(faq_version())
     
     view = st.session_state.view
     
     if view == "home":
-        render_home(data_tree)
+        render_home(data)
     elif view == "subcategory":
-        render_subcategory(data_tree)
+        render_subcategory(data)
     elif view == "question_list":
-        render_question_list(data_tree)
+        render_question_list(data)
     elif view == "article":
-        render_article(data_tree)
+        render_article(data)
+    elif view == "ask":
+        render_ask(data)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
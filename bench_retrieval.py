@@ -0,0 +1,298 @@
+# bench_retrieval.py  (offline retrieval benchmark: speed + quality, saved as JSON)
+#   python bench_retrieval.py [--k 5] [--repeat 3] [--quant] [--out bench/x.json] [--compare bench/old.json]
+import os, re, csv, sys, json, math, time, argparse
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import retrieval
+import np_index
+from bm25 import tokenize
+
+CSV_PATH = Path(os.getenv("BENCH_CSV", "data/faq_decision_tree.csv"))
+
+
+def load_questions(path: Path) -> List[str]:
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        rows = csv.DictReader(f)
+        return [(r.get("Question") or "").strip() for r in rows if (r.get("Question") or "").strip()]
+
+
+# ---- labelled query set ----
+def _paraphrases(q: str) -> List[str]:
+    """rule-based paraphrase: ตัดเครื่องหมาย/lowercase + เปลี่ยนรูปประโยคคำถามที่พบบ่อย"""
+    base = " ".join(re.sub(r"[^\w\s']", " ", q.lower()).split())
+    out = [base]
+    rules = [
+        (r"^how do i (.+)$", r"how to \1"),
+        (r"^how can i (.+)$", r"way to \1"),
+        (r"^what is (.+)$", r"explain \1"),
+        (r"^what does (.+) do$", r"purpose of \1"),
+        (r"^can i (.+)$", r"is it possible to \1"),
+        (r"^where (?:can|do) i (.+)$", r"location to \1"),
+    ]
+    for pat, rep in rules:
+        if re.match(pat, base):
+            out.append(re.sub(pat, rep, base))
+            break
+    return out
+
+
+def build_queryset(path: Path) -> List[Dict]:
+    """
+    query ที่มี label จาก CSV: ตัวคำถามเอง, paraphrase, และ keyword (3 term ที่ idf สูงสุด)
+    label = ข้อความคำถาม (meta['question'] ของ document ที่ถูกต้อง)
+    """
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        rows = [r for r in csv.DictReader(f) if (r.get("Question") or "").strip()]
+    docs_tokens = [set(tokenize(f"{r['Question']} {r.get('Answer') or ''}")) for r in rows]
+    df = Counter(t for toks in docs_tokens for t in toks)
+    n = len(rows)
+
+    queries: List[Dict] = []
+    for r in rows:
+        q = " ".join(r["Question"].split())
+        queries.append({"query": q, "label": q, "kind": "question"})
+        for p in _paraphrases(q):
+            queries.append({"query": p, "label": q, "kind": "paraphrase"})
+        terms = sorted(set(tokenize(q)), key=lambda t: (-math.log(n / df.get(t, 1)), t))[:3]
+        if terms:
+            queries.append({"query": " ".join(terms), "label": q, "kind": "keyword"})
+    return queries
+
+
+def pct(xs: List[float], p: float) -> float:
+    return float(np.percentile(xs, p)) if xs else 0.0
+
+
+def bench_backend(name: str, qv: np.ndarray, k: int, repeat: int) -> dict:
+    retrieval.set_backend(name)
+    backend = retrieval._backend
+    if backend.count() <= 0:
+        return {"backend": name, "error": "empty index (run build_index.py first)"}
+
+    backend.search(qv[:1], k)   # warm-up (mmap / sqlite page cache)
+    lat: List[float] = []
+    tops: List[str] = []
+    for _ in range(repeat):
+        tops = []
+        for i in range(qv.shape[0]):
+            t0 = time.perf_counter()
+            docs, _, _ = backend.search(qv[i:i+1], k)
+            lat.append((time.perf_counter() - t0) * 1000)
+            tops.append(docs[0][0] if docs and docs[0] else "")
+
+    return {
+        "backend": name,
+        "queries": len(lat),
+        "mean_ms": float(np.mean(lat)),
+        "p50_ms": pct(lat, 50),
+        "p95_ms": pct(lat, 95),
+        "p99_ms": pct(lat, 99),
+        "top1": tops,
+    }
+
+
+def bench_quant(qv: np.ndarray, k: int, repeat: int, pca_dims=(0, 128, 64)) -> List[dict]:
+    """
+    quantize matrix จาก vectors.npy ใน memory (ไม่ต้อง build ใหม่) แล้วเทียบกับ float32 exact:
+    memory footprint, latency ต่อ query, recall@k (overlap ของ top-k กับ exact)
+    """
+    idx = np_index.NumpyIndex(str(retrieval.index_dir()), quant_search=False)
+    idx.ensure("bench")
+    mat = np.asarray(idx._mat, dtype=np.float32)
+    if mat.shape[0] == 0:
+        return [{"config": "float32", "error": "no vectors.npy (run build_index.py first)"}]
+
+    q = np_index._l2_normalize(qv.astype(np.float32))
+    exact = np_index._topk(q @ mat.T, k)
+
+    def timed(fn) -> List[float]:
+        lat = []
+        for _ in range(repeat):
+            for i in range(q.shape[0]):
+                t0 = time.perf_counter()
+                fn(q[i:i+1])
+                lat.append((time.perf_counter() - t0) * 1000)
+        return lat
+
+    def recall(top: np.ndarray) -> float:
+        return float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(top, exact)]))
+
+    rows = []
+    lat = timed(lambda x: np_index._topk(x @ mat.T, k))
+    rows.append({"config": "float32", "bytes": mat.nbytes, "p50_ms": pct(lat, 50),
+                 "p95_ms": pct(lat, 95), "recall": 1.0})
+
+    for d in pca_dims:
+        if d >= mat.shape[1]:
+            continue
+        quant = np_index.Int8Quant.fit(mat, d)
+        name = "int8" + (f"+pca{d}" if d else "")
+        lat = timed(lambda x: np_index._topk(quant.scores(x), k))
+        rows.append({"config": name, "bytes": quant.nbytes, "p50_ms": pct(lat, 50),
+                     "p95_ms": pct(lat, 95), "recall": recall(np_index._topk(quant.scores(q), k))})
+
+        kc = k * max(1, np_index.RESCORE_FACTOR)
+        def rescored(x):
+            cand = np_index._topk(quant.scores(x), kc)
+            ex = np.einsum("qd,qcd->qc", x, mat[cand])
+            return np.take_along_axis(cand, np_index._topk(ex, k), axis=1)
+        lat = timed(rescored)
+        rows.append({"config": name + "+rescore", "bytes": quant.nbytes, "p50_ms": pct(lat, 50),
+                     "p95_ms": pct(lat, 95), "recall": recall(rescored(q))})
+    return rows
+
+
+def bench_encode(queries: List[str], repeat: int) -> Dict:
+    """เวลา encode ต่อ query แบบไม่ผ่าน embedding cache"""
+    embedder = retrieval.get_embedder()
+    embedder.encode(["warm up"], normalize_embeddings=retrieval.NORMALIZE)
+    lat = []
+    for _ in range(repeat):
+        for q in queries:
+            t0 = time.perf_counter()
+            embedder.encode([q], normalize_embeddings=retrieval.NORMALIZE, show_progress_bar=False)
+            lat.append((time.perf_counter() - t0) * 1000)
+    return {"queries": len(lat), "mean_ms": float(np.mean(lat)), "p50_ms": pct(lat, 50),
+            "p95_ms": pct(lat, 95), "p99_ms": pct(lat, 99)}
+
+
+def bench_e2e(qs: List[Dict], backend: str, mode: str, k: int) -> Dict:
+    """
+    retrieve() ทั้งเส้น (query cache ปิด, embedding cache ตามที่ตั้งไว้) → latency + recall@k / MRR
+    """
+    retrieval.set_backend(backend)
+    retrieval.RETRIEVAL_MODE = mode
+    retrieval._qcache.maxsize = 0
+    if retrieval._count() <= 0:
+        return {"backend": backend, "mode": mode, "error": "empty index (run build_index.py first)"}
+
+    before = dict(retrieval._stats)
+    lat, rr, hit = [], [], []
+    by_kind: Dict[str, List[Tuple[float, float]]] = {}
+    t_all = time.perf_counter()
+    for item in qs:
+        t0 = time.perf_counter()
+        res = retrieval.retrieve(item["query"], k=k, min_sim=0.0)
+        lat.append((time.perf_counter() - t0) * 1000)
+        qs_ = [" ".join((r["meta"].get("question") or "").split()) for r in res]
+        rank = next((i + 1 for i, q in enumerate(qs_) if q == item["label"]), 0)
+        rr.append(1.0 / rank if rank else 0.0)
+        hit.append(1.0 if rank else 0.0)
+        by_kind.setdefault(item["kind"], []).append((hit[-1], rr[-1]))
+    wall = time.perf_counter() - t_all
+
+    encoded = retrieval._stats["encoded"] - before["encoded"]
+    return {
+        "backend": backend,
+        "mode": mode,
+        "queries": len(qs),
+        "qps": len(qs) / wall if wall else 0.0,
+        "mean_ms": float(np.mean(lat)),
+        "p50_ms": pct(lat, 50),
+        "p95_ms": pct(lat, 95),
+        "p99_ms": pct(lat, 99),
+        f"recall@{k}": float(np.mean(hit)),
+        "mrr": float(np.mean(rr)),
+        "encoder_calls": encoded,
+        "by_kind": {kind: {f"recall@{k}": float(np.mean([h for h, _ in v])),
+                           "mrr": float(np.mean([r for _, r in v]))} for kind, v in by_kind.items()},
+    }
+
+
+def _compare(old: Dict, new: Dict) -> None:
+    """พิมพ์ diff ของตัวเลขหลัก ๆ เทียบกับผลรอบก่อน"""
+    def rows(d):
+        return {f"{r['backend']}/{r['mode']}": r for r in d.get("e2e", []) if "error" not in r}
+    o, n = rows(old), rows(new)
+    print(f"🔁 Compare with {old.get('timestamp', '?')}")
+    for key in sorted(set(o) & set(n)):
+        parts = []
+        for m, v in n[key].items():
+            if isinstance(v, float) and isinstance(o[key].get(m), float):
+                d = v - o[key][m]
+                parts.append(f"{m} {v:.4g} ({'+' if d >= 0 else ''}{d:.3g})")
+        print(f"  {key:>14}: " + " | ".join(parts))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline retrieval benchmark (speed + quality)")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--quant", action="store_true", help="also compare int8 / PCA vs float32")
+    ap.add_argument("--backends", default="chroma,numpy")
+    ap.add_argument("--modes", default="vector,hybrid")
+    ap.add_argument("--out", default="", help="JSON output (default: bench/retrieval-<timestamp>.json)")
+    ap.add_argument("--compare", default="", help="previous JSON result to diff against")
+    args = ap.parse_args()
+
+    qs = build_queryset(CSV_PATH)
+    if not qs:
+        sys.exit(f"No questions in {CSV_PATH}")
+    questions = [x["query"] for x in qs if x["kind"] == "question"]
+    backends = [b for b in args.backends.split(",") if b]
+    modes = [m for m in args.modes.split(",") if m]
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "index_version": retrieval.index_version(),
+        "emb_model": retrieval.EMB_MODEL,
+        "k": args.k,
+        "queryset": dict(Counter(x["kind"] for x in qs)),
+    }
+
+    print(f"📊 {len(qs)} labelled queries {report['queryset']}, k={args.k}")
+    report["encode"] = bench_encode(questions, 1)
+    e = report["encode"]
+    print(f"  encode: mean {e['mean_ms']:.2f} ms | p50 {e['p50_ms']:.2f} | p95 {e['p95_ms']:.2f} | p99 {e['p99_ms']:.2f}")
+
+    # encode ครั้งเดียว → วัดเฉพาะเวลา search ของแต่ละ backend
+    qv = retrieval.embed_queries(questions)
+    report["search"] = [bench_backend(name, qv, args.k, args.repeat) for name in backends]
+    for r in report["search"]:
+        if "error" in r:
+            print(f"  search {r['backend']:>7}: {r['error']}")
+            continue
+        print(f"  search {r['backend']:>7}: mean {r['mean_ms']:.3f} ms | p50 {r['p50_ms']:.3f} | "
+              f"p95 {r['p95_ms']:.3f} | p99 {r['p99_ms']:.3f}")
+    ok = [r for r in report["search"] if "error" not in r]
+    if len(ok) == 2:
+        agree = sum(a == b for a, b in zip(ok[0]["top1"], ok[1]["top1"])) / len(questions)
+        print(f"  top-1 agreement: {agree:.1%}")
+        report["top1_agreement"] = agree
+    for r in report["search"]:
+        r.pop("top1", None)
+
+    report["e2e"] = [bench_e2e(qs, b, m, args.k) for b in backends for m in modes]
+    for r in report["e2e"]:
+        if "error" in r:
+            print(f"  e2e {r['backend']}/{r['mode']}: {r['error']}")
+            continue
+        print(f"  e2e {r['backend']:>7}/{r['mode']:<6}: {r['qps']:.1f} QPS | p50 {r['p50_ms']:.2f} ms | "
+              f"p95 {r['p95_ms']:.2f} | p99 {r['p99_ms']:.2f} | recall@{args.k} {r[f'recall@{args.k}']:.3f} | "
+              f"MRR {r['mrr']:.3f} | encoder calls {r['encoder_calls']}")
+
+    if args.quant:
+        report["quant"] = bench_quant(qv, args.k, args.repeat)
+        print(f"🗜️  Quantization (recall@{args.k} vs float32 exact)")
+        for r in report["quant"]:
+            if "error" in r:
+                print(f"  {r['config']:>20}: {r['error']}")
+                continue
+            print(f"  {r['config']:>20}: {r['bytes'] / 1024:8.1f} KiB | p50 {r['p50_ms']:.3f} ms | "
+                  f"p95 {r['p95_ms']:.3f} | recall {r['recall']:.3f}")
+
+    out = Path(args.out or f"bench/retrieval-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"💾 Saved {out}")
+
+    if args.compare:
+        _compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# bm25.py  (prebuilt inverted index for the lexical first stage)
+from __future__ import annotations
+import os, re, json, math, threading
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Any, Tuple
+
+BM25_FILE = "bm25.json"
+BM25_K1   = float(os.getenv("BM25_K1", 1.2))
+BM25_B    = float(os.getenv("BM25_B", 0.75))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOP = set("""
+a an and are as at be by can do does for from how i if in is it its me my of on or our
+should so that the their them there this to use using we what when where which who why
+will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """lowercase + ตัด stopword + ตัด s ท้ายคำแบบง่าย ๆ (covers -> cover); acronym อย่าง FWCV คงไว้"""
+    out = []
+    for t in _TOKEN_RE.findall((text or "").lower()):
+        if t in _STOP:
+            continue
+        if len(t) > 3 and t.endswith("s") and not t.endswith("ss"):
+            t = t[:-1]
+        out.append(t)
+    return out
+
+
+def write_index(ids: List[str], docs: List[str], metas: List[Dict], index_path: str,
+                version: str = "") -> int:
+    """สร้าง postings {term: [[doc, tf], ...]} + idf แล้วเขียนเป็น json (atomic)"""
+    postings: Dict[str, List[List[int]]] = {}
+    lengths: List[int] = []
+    for d, text in enumerate(docs):
+        toks = tokenize(text)
+        lengths.append(len(toks))
+        for term, tf in Counter(toks).items():
+            postings.setdefault(term, []).append([d, tf])
+
+    n = len(docs)
+    idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in postings.items()}
+    data = {
+        "version": version,
+        "ids": ids,
+        "documents": docs,
+        "metadatas": metas,
+        "lengths": lengths,
+        "avgdl": (sum(lengths) / n) if n else 0.0,
+        "idf": idf,
+        "postings": postings,
+    }
+
+    out = Path(index_path) / BM25_FILE
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(out.name + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, out)
+    return len(postings)
+
+
+class Bm25Index:
+    """โหลด bm25.json ครั้งเดียวต่อ index version; search ไม่ต้องใช้ encoder เลย"""
+
+    def __init__(self, index_path: str):
+        self.path = Path(index_path) / BM25_FILE
+        self._lock = threading.Lock()
+        self._version = None
+        self._data: Dict[str, Any] = {}
+
+    def ensure(self, version: str) -> None:
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            try:
+                self._data = json.loads(self.path.read_text(encoding="utf-8")) if self.path.exists() else {}
+                self._version = version
+            except Exception:
+                pass
+
+    def count(self) -> int:
+        return len(self._data.get("documents") or [])
+
+    def search(self, query: str, k: int) -> Tuple[List[Tuple[int, float, float]], int]:
+        """
+        คืน ([(doc_index, bm25_score, coverage), ...] เรียงมาก -> น้อย, จำนวน query term)
+        coverage = สัดส่วน query term (unique) ที่เจอใน doc นั้น
+        """
+        data = self._data
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not data or not terms:
+            return [], len(terms)
+
+        postings, idf, lengths = data["postings"], data["idf"], data["lengths"]
+        avgdl = data["avgdl"] or 1.0
+        scores: Dict[int, float] = {}
+        hits: Dict[int, int] = {}
+        for t in terms:
+            for d, tf in postings.get(t, ()):
+                denom = tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths[d] / avgdl)
+                scores[d] = scores.get(d, 0.0) + idf[t] * tf * (BM25_K1 + 1) / denom
+                hits[d] = hits.get(d, 0) + 1
+
+        top = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:max(1, k)]
+        return [(d, s, hits[d] / len(terms)) for d, s in top], len(terms)
+
+    def doc_id(self, d: int) -> str:
+        return self._data["ids"][d]
+
+    def doc(self, d: int) -> Tuple[str, Dict[str, Any]]:
+        return self._data["documents"][d], self._data["metadatas"][d] or {}
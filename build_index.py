@@ -1,24 +1,58 @@
-# build_index.py  (CSV only, cosine, batch-encode)
-import os, csv, re
+# build_index.py  (CSV only, cosine, streaming batch-encode, incremental)
+import os, csv, re, sys, time, hashlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-import chromadb
-from sentence_transformers import SentenceTransformer
+import numpy as np
+
+from emb_cache import open_cache
+from lazy import Lazy, startup_report
+from np_index import export_collection, QUANTIZE, PCA_DIM
+import bm25
+from extractive import write_exact_index
+from catalog import write_catalog, catalog_hash
+from related import write_related
+import index_store
 
 # ---- paths / constants ----
 DATA_DIR    = Path("data")
-CSV_PATH    = DATA_DIR / "faq.csv"                 # ต้องมีคอลัมน์: Question, Answer
+CSV_PATH    = DATA_DIR / "faq_decision_tree.csv"   # ต้องมีคอลัมน์: Question, Answer (+ Category, Subcategory)
+# หลาย source: CSV_PATHS="data/a.csv:data/b.csv" (คั่นด้วย os.pathsep) → id / catalog รวมกันทุกไฟล์ตามลำดับ
+CSV_PATHS   = [Path(p) for p in os.getenv("CSV_PATHS", "").split(os.pathsep) if p] or [CSV_PATH]
 INDEX_PATH  = os.getenv("INDEX_PATH", "index")
 COLL_NAME   = os.getenv("COLL_NAME", "fit_faq")
+VERSION_NAME = "VERSION"                             # retrieval ใช้ล้าง query cache
 
 EMB_MODEL      = os.getenv("EMB_MODEL", "all-MiniLM-L6-v2")
 EMBED_BATCH    = int(os.getenv("EMBED_BATCH", 64))         # ลดเป็น 32 ถ้า RAM น้อย
 NORMALIZE_EMB  = os.getenv("NORMALIZE_EMB", "1") == "1"    # ใช้ normalization
+BUILD_MODE     = os.getenv("BUILD_MODE", "incremental")    # incremental | full
+
+# ---- streaming pipeline (RAM คงที่ตามขนาด chunk ไม่ใช่ขนาด corpus) ----
+READ_CHUNK     = int(os.getenv("READ_CHUNK", 512))         # แถวต่อ chunk: อ่าน → diff → encode → upsert
+ADD_BATCH      = int(os.getenv("ADD_BATCH", 1000))         # แถวต่อ coll.upsert (clamp ด้วย max batch ของ Chroma)
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", 0))       # >1 → multi-process encode pool บน CPU
+PIPELINE_DEPTH = int(os.getenv("PIPELINE_DEPTH", 2))       # chunk ที่ encode ค้างอยู่ได้พร้อมกัน
+PROGRESS_EVERY = float(os.getenv("PROGRESS_EVERY", 5))     # วินาทีระหว่างบรรทัด progress
+
+# ---- init (lazy: import build_index เพื่อใช้ load_csv_faq / clean_text ไม่ต้องโหลด model) ----
+# ทุก build เขียนลง directory ใหม่ (index_store.new_build_dir) แล้วค่อย publish → ไม่แตะ index ที่ live อยู่
+_build_dir = Path(INDEX_PATH)
 
-# ---- init ----
-client   = chromadb.PersistentClient(path=INDEX_PATH)
-embedder = SentenceTransformer(EMB_MODEL)
+def _make_client():
+    import chromadb
+    return chromadb.PersistentClient(path=str(_build_dir))
+
+def _make_embedder():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMB_MODEL)
+
+client    = Lazy("build_index.chroma_client", _make_client)
+embedder  = Lazy("build_index.embedder", _make_embedder)
+# build: ไม่ flush ระหว่าง encode (เขียนทั้งไฟล์ทุกรอบ = O(N²)) → save ครั้งเดียวตอน Encoder.close()
+emb_cache = Lazy("build_index.emb_cache", lambda: open_cache(EMB_MODEL, NORMALIZE_EMB, flush_s=None))
 
 
 def clean_text(s: str) -> str:
@@ -28,17 +62,15 @@ def clean_text(s: str) -> str:
     return s.strip()
 
 
-def load_csv_faq(path: Path) -> List[Tuple[str, Dict]]:
+def iter_csv_faq(path: Path) -> Iterator[Tuple[str, Dict]]:
     """
-    คืนค่า list ของ (document_text, meta)
+    yield (document_text, meta) ทีละแถว (ไม่อ่านทั้งไฟล์เข้า memory)
     document_text = Question + 2 newlines + Answer   <-- ช่วยให้ retrieval แม่นขึ้น
     meta['question'] เก็บไว้ใช้อ้างอิง [Q#] ตอนตอบ
     """
     if not path.exists():
         raise FileNotFoundError(f"CSV not found: {path}")
 
-    rows: List[Tuple[str, Dict]] = []
-
     # อ่าน header ด้วย csv.reader ก่อน เพื่อ control ชื่อคอลัมน์เอง
     with path.open("r", encoding="utf-8-sig", newline="") as f:
         raw_reader = csv.reader(f)
@@ -80,60 +112,356 @@ def load_csv_faq(path: Path) -> List[Tuple[str, Dict]]:
                 "source": path.name,
                 "question": q,
                 "type": "faq",
+                "row_hash": row_hash(q, a),
             }
-            rows.append((doc, meta))
+            # CSV แบบ decision tree มีหมวด → ใช้สร้าง catalog ของ app
+            cat = (r.get("Category") or "").strip()
+            sub = (r.get("Subcategory") or "").strip()
+            if cat and sub:
+                meta["category"], meta["subcategory"] = cat, sub
+            meta["meta_hash"] = meta_hash(meta)
+            yield doc, meta
+
+
+def load_csv_faq(path: Path) -> List[Tuple[str, Dict]]:
+    """คืนค่า list ของ (document_text, meta) ทั้งไฟล์ (catalog.py / ไฟล์เล็ก)"""
+    return list(iter_csv_faq(path))
+
 
-    return rows
+def iter_sources(paths: Iterable[Path]) -> Iterator[Tuple[str, Dict]]:
+    """ต่อหลาย CSV เป็น stream เดียว; เช็คว่ามีไฟล์ครบก่อนเริ่ม (ไม่ล้มกลางทาง)"""
+    paths = list(paths)
+    for p in paths:
+        if not p.exists():
+            raise FileNotFoundError(f"CSV not found: {p}")
+    for p in paths:
+        yield from iter_csv_faq(p)
+
+
+def chunked(it: Iterable, size: int) -> Iterator[list]:
+    buf = []
+    for x in it:
+        buf.append(x)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+def row_hash(question: str, answer: str) -> str:
+    """
+    hash ของเนื้อหาแถว + ค่าที่มีผลต่อ embedding (model, normalize)
+    ถ้าเปลี่ยน model หรือ flag -> hash เปลี่ยน -> re-embed ทุกแถวเอง
+    """
+    key = "\x1f".join([EMB_MODEL, "1" if NORMALIZE_EMB else "0", question, answer])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def meta_hash(meta: Dict) -> str:
+    """
+    hash ของ metadata ที่ไม่มีผลต่อ embedding (source / category / subcategory / ...)
+    เปลี่ยนอย่างเดียว → upsert metadata ใหม่ด้วย embedding เดิม ไม่ต้อง encode
+    """
+    items = sorted((k, str(v)) for k, v in meta.items() if k not in ("row_hash", "meta_hash"))
+    return hashlib.sha1(repr(items).encode("utf-8")).hexdigest()
 
 
-def main():
-    print(f"🧹 Recreating collection at '{INDEX_PATH}' …")
+class IdAssigner:
+    """
+    id อิงจากคำถาม (ไม่ใช่ตำแหน่งแถว) → แก้ Answer แล้ว id เดิม, แทรกแถวแล้ว id อื่นไม่ขยับ
+    คำถามซ้ำ (ข้าม chunk / ข้ามไฟล์ก็นับ) จะได้ suffix -2, -3, ...
+    """
+
+    def __init__(self):
+        self._seen: Dict[str, int] = {}
+
+    def __call__(self, metas: List[Dict]) -> List[str]:
+        ids: List[str] = []
+        for m in metas:
+            base = "faq-" + hashlib.sha1(m["question"].encode("utf-8")).hexdigest()[:16]
+            self._seen[base] = self._seen.get(base, 0) + 1
+            ids.append(base if self._seen[base] == 1 else f"{base}-{self._seen[base]}")
+        return ids
+
+
+def stable_ids(metas: List[Dict]) -> List[str]:
+    return IdAssigner()(metas)
+
+
+def existing_hashes(coll, page: int = 5000) -> Dict[str, Tuple[str, str]]:
+    """
+    id -> (row_hash, meta_hash) ของที่อยู่ใน collection แล้ว (อ่านทีละหน้า ไม่ดึง document / embedding)
+    index เก่าที่ยังไม่มี meta_hash → "" = ถือว่า metadata เปลี่ยน (upsert metadata รอบเดียว)
+    """
+    existing: Dict[str, Tuple[str, str]] = {}
+    offset = 0
+    while True:
+        got = coll.get(include=["metadatas"], limit=page, offset=offset)
+        got_ids = got.get("ids") or []
+        for _id, meta in zip(got_ids, got.get("metadatas") or []):
+            meta = meta or {}
+            existing[_id] = (meta.get("row_hash", ""), meta.get("meta_hash", ""))
+        if len(got_ids) < page:
+            return existing
+        offset += page
+
+
+class _PoolModel:
+    """ให้ multi-process pool ของ SentenceTransformer หน้าตาเหมือน model.encode (EmbeddingCache เรียกได้ตรง ๆ)"""
+
+    def __init__(self, model, workers: int):
+        self.model = model
+        self.pool = model.start_multi_process_pool(["cpu"] * workers)
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False, show_progress_bar=False):
+        return self.model.encode_multi_process(texts, self.pool, batch_size=batch_size,
+                                               normalize_embeddings=normalize_embeddings)
+
+    def close(self) -> None:
+        self.model.stop_multi_process_pool(self.pool)
+
+
+class Encoder:
+    """
+    encode ทีละ chunk ใน background thread → main thread อ่าน CSV / upsert chunk ก่อนหน้าไปพร้อมกัน
+    workers > 1 → encode กระจายหลาย process (CPU); cache ยังเช็ค/เขียนที่ process หลักที่เดียว
+    """
+
+    def __init__(self, workers: int = ENCODE_WORKERS):
+        self._pool = _PoolModel(embedder.get(), workers) if workers > 1 else None
+        self._model = self._pool or embedder.get()
+        self._exec = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
+
+    def submit(self, docs: List[str]) -> "Future[np.ndarray]":
+        return self._exec.submit(emb_cache.get().encode, self._model, docs, EMBED_BATCH)
+
+    def close(self) -> None:
+        self._exec.shutdown(wait=True)
+        if self._pool is not None:
+            self._pool.close()
+        emb_cache.get().save()
+
+    def __enter__(self) -> "Encoder":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _max_add_batch() -> int:
+    """Chroma มี max batch ต่อ add/upsert (ขึ้นกับ SQLite) → ไม่ส่งเกินนั้น"""
     try:
-        client.delete_collection(name=COLL_NAME)
+        return max(1, min(ADD_BATCH, int(client.get().get_max_batch_size())))
     except Exception:
-        # ถ้าไม่มี collection เดิมอยู่ ก็ปล่อยผ่าน
-        pass
+        return max(1, ADD_BATCH)
+
+
+def upsert_batches(coll, ids: List[str], docs: List[str], metas: List[Dict], embs: np.ndarray,
+                   batch: int) -> None:
+    """embedding ส่งเป็น numpy (ไม่ .tolist()) ทีละไม่เกิน batch แถว"""
+    for i in range(0, len(ids), batch):
+        coll.upsert(ids=ids[i:i + batch], documents=docs[i:i + batch],
+                    metadatas=metas[i:i + batch], embeddings=embs[i:i + batch])
+
+
+def relabel_rows(coll, ids: List[str], docs: List[str], metas: List[Dict], batch: int) -> None:
+    """text เดิมแต่ metadata เปลี่ยน → upsert ด้วย embedding เดิมจาก collection (ไม่ต้อง encode ใหม่)"""
+    for i in range(0, len(ids), batch):
+        b_ids = ids[i:i + batch]
+        got = coll.get(ids=b_ids, include=["embeddings"])
+        pos = {_id: j for j, _id in enumerate(got["ids"])}
+        embs = np.asarray(got["embeddings"], dtype=np.float32)[[pos[_id] for _id in b_ids]]
+        coll.upsert(ids=b_ids, documents=docs[i:i + batch], metadatas=metas[i:i + batch], embeddings=embs)
+
+
+class Progress:
+    """พิมพ์ความคืบหน้าทุก PROGRESS_EVERY วินาที + rows/s ตอนจบ"""
+
+    def __init__(self):
+        self.t0 = self._last = time.perf_counter()
+        self.read = self.embedded = self.relabeled = 0
+
+    def tick(self, force: bool = False) -> None:
+        now = time.perf_counter()
+        if not force and now - self._last < PROGRESS_EVERY:
+            return
+        self._last = now
+        dt = max(now - self.t0, 1e-9)
+        print(f"   {self.read} rows read, {self.embedded} embedded+written "
+              f"({self.read / dt:.0f} rows/s, {self.embedded / dt:.0f} embedded/s, {dt:.1f}s)")
+
+
+def stream_rows(coll, existing: Dict[str, Tuple[str, str]], paths: List[Path],
+                progress: Progress) -> Tuple[List[str], List[str], List[Dict]]:
+    """
+    อ่าน → diff → encode → upsert เป็น pipeline ทีละ chunk:
+    chunk n กำลัง encode ใน Encoder ขณะที่ main thread upsert chunk n-1 และอ่าน chunk n+1
+    embedding ที่ค้างอยู่ไม่เกิน PIPELINE_DEPTH chunk → RAM ไม่โตตาม corpus
+    คืน (ids, docs, metas) ทั้งหมด (artifact อื่น ๆ: bm25 / exact / catalog ต้องใช้ text ครบ)
+    """
+    assign = IdAssigner()
+    ids: List[str] = []
+    docs: List[str] = []
+    metas: List[Dict] = []
+    batch = _max_add_batch()
+    pending: "deque[Tuple[List[str], List[str], List[Dict], Future]]" = deque()
+    encoder: Optional[Encoder] = None
+
+    def drain(block: bool) -> None:
+        while pending and (block or len(pending) > PIPELINE_DEPTH or pending[0][3].done()):
+            c_ids, c_docs, c_metas, fut = pending.popleft()
+            upsert_batches(coll, c_ids, c_docs, c_metas, fut.result(), batch)
+            progress.embedded += len(c_ids)
+            progress.tick()
+
+    try:
+        for chunk in chunked(iter_sources(paths), READ_CHUNK):
+            c_docs = [t for t, _ in chunk]
+            c_metas = [m for _, m in chunk]
+            c_ids = assign(c_metas)
+            ids.extend(c_ids)
+            docs.extend(c_docs)
+            metas.extend(c_metas)
+            progress.read += len(chunk)
+
+            todo, relabel = [], []
+            for i, (_id, m) in enumerate(zip(c_ids, c_metas)):
+                old = existing.get(_id)
+                if old is None or old[0] != m["row_hash"]:
+                    todo.append(i)
+                elif old[1] != m["meta_hash"]:
+                    relabel.append(i)
+            if relabel:
+                relabel_rows(coll, [c_ids[i] for i in relabel], [c_docs[i] for i in relabel],
+                             [c_metas[i] for i in relabel], batch)
+                progress.relabeled += len(relabel)
+            if todo:
+                if encoder is None:
+                    # โหลด model เฉพาะตอนมีแถวต้อง embed จริง (incremental ที่ไม่มีอะไรเปลี่ยน → ไม่โหลด)
+                    print(f"🧠 Embedding with {EMB_MODEL} (batch={EMBED_BATCH}, chunk={READ_CHUNK}, "
+                          f"add batch={batch}, workers={max(1, ENCODE_WORKERS)}) …")
+                    encoder = Encoder()
+                sub_docs = [c_docs[i] for i in todo]
+                pending.append(([c_ids[i] for i in todo], sub_docs, [c_metas[i] for i in todo],
+                                encoder.submit(sub_docs)))
+            drain(block=False)
+            progress.tick()
+        drain(block=True)
+    finally:
+        if encoder is not None:
+            encoder.close()
+            print(f"   cache: {emb_cache.get().stats()}")
+    return ids, docs, metas
+
+
+def new_index_version(ids: List[str], metas: List[Dict]) -> str:
+    h = hashlib.sha1()
+    for _id, m in zip(ids, metas):
+        h.update(f"{_id}:{m['row_hash']}:{m['meta_hash']}\n".encode("utf-8"))
+    return f"{time.time_ns()}-{h.hexdigest()[:12]}"
+
 
+def write_index_version(version: str, out_dir: Path) -> None:
+    """
+    เขียน version stamp ของ build ลงใน directory ของมัน (retrieval อ่านตอนสลับไป version นี้)
+    ใช้ os.replace ให้ atomic (reader ไม่เห็นไฟล์ว่าง)
+    """
+    path = Path(out_dir) / VERSION_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(version, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def build(mode: str, out_dir: Path) -> Optional[str]:
+    """
+    อ่าน CSV → upsert ลง collection ใน out_dir → เขียน artifact ทั้งหมดลง out_dir
+    คืน version ใหม่ (None = ไม่มีอะไรเปลี่ยนจาก version ที่ seed มา ไม่ต้อง publish)
+    """
     # บังคับ cosine เสมอ (ให้เข้าคู่กับ retrieval.py)
-    coll = client.get_or_create_collection(
+    coll = client.get().get_or_create_collection(
         name=COLL_NAME,
         metadata={"hnsw:space": "cosine"},
     )
 
-    items = load_csv_faq(CSV_PATH)
-    if not items:
+    existing = existing_hashes(coll)
+    print(f"📄 Sources: {', '.join(str(p) for p in CSV_PATHS)} ({len(existing)} rows already indexed)")
+
+    progress = Progress()
+    ids, docs, metas = stream_rows(coll, existing, CSV_PATHS, progress)
+    if not ids:
         print("⚠️ No rows found in CSV.")
-        return
-
-    docs  = [t for t, _ in items]
-    metas = [m for _, m in items]
-    ids   = [f"csv-{i+1}" for i in range(len(items))]
-
-    print(f"📄 CSV rows: {len(items)}")
-    print(f"🧠 Embedding with {EMB_MODEL} (batch={EMBED_BATCH}) …")
-
-    # ---- batch embeddings ----
-    embs: List[List[float]] = []
-    for i in range(0, len(docs), EMBED_BATCH):
-        batch = docs[i:i+EMBED_BATCH]
-        vecs = embedder.encode(
-            batch,
-            normalize_embeddings=NORMALIZE_EMB,
-            show_progress_bar=False,
-        )
-        # SentenceTransformer คืนเป็น np.array → แปลงเป็น list
-        embs.extend(vecs.tolist())
-
-    # ---- upsert ----
-    coll.add(documents=docs, metadatas=metas, ids=ids, embeddings=embs)
+        return None
+
+    # ---- delete rows ที่หายไปจาก CSV (หลัง upsert เพื่อไม่ให้ index ว่างระหว่างทาง) ----
+    wanted  = set(ids)
+    removed = [_id for _id in existing if _id not in wanted]
+    batch = _max_add_batch()
+    for i in range(0, len(removed), batch):
+        coll.delete(ids=removed[i:i + batch])
+    changed = progress.embedded + progress.relabeled
+    progress.tick(force=True)
+    print(f"🔍 Diff: {progress.embedded} embedded, {progress.relabeled} metadata-only, "
+          f"{len(removed)} deleted, {len(ids) - changed} unchanged")
+
+    has_tree = any("category" in m for m in metas)
+    if not (changed or removed or mode == "full" or not (out_dir / VERSION_NAME).exists()
+            or (has_tree and not catalog_hash(out_dir))):
+        return None
+
+    version = new_index_version(ids, metas)
+    # artifact ทั้งหมดลง out_dir ก่อน แล้ว VERSION เป็นไฟล์สุดท้าย; reader ยังไม่เห็นจนกว่าจะ publish
+    n_vec = export_collection(coll, out_dir, version)
+    n_terms = bm25.write_index(ids, docs, metas, out_dir, version)
+    n_exact = write_exact_index(ids, docs, metas, out_dir, version)
+    graph = write_related(out_dir, dict(zip(ids, metas)), version) if n_vec else {}
+    if has_tree:
+        cat_version = write_catalog(ids, docs, metas, out_dir, ",".join(p.name for p in CSV_PATHS),
+                                    related=graph)["version"]
+        print(f"📚 Catalog: {cat_version[:12]} ({sum(1 for v in graph.values() if v)} questions with related links)")
+    write_index_version(version, out_dir)
+    print(f"🏷️  Index version: {version} (exported {n_vec} vectors, {n_terms} BM25 terms, "
+          f"{n_exact} exact questions)")
+    if QUANTIZE:
+        print(f"🗜️  Quantized vectors: {QUANTIZE}" + (f", PCA dim {PCA_DIM}" if PCA_DIM else ""))
 
     # ตรวจนับรายการจริง
     try:
-        n = coll.count()
-        print(f"✅ Index built at ./{INDEX_PATH} with {n} items")
+        print(f"✅ Built {coll.count()} items in ./{out_dir}")
     except Exception:
-        print(f"✅ Index built at ./{INDEX_PATH} with {len(docs)} items")
+        print(f"✅ Built {len(docs)} items in ./{out_dir}")
+    return version
+
+
+def main(mode: str = BUILD_MODE):
+    global _build_dir
+    _build_dir = index_store.new_build_dir(INDEX_PATH)
+    client.reset()
+    if mode == "full":
+        print(f"🧹 Building a fresh collection in '{_build_dir}' …")
+    else:
+        src = index_store.seed_build_dir(INDEX_PATH, _build_dir)
+        print(f"🔁 Incremental update of '{COLL_NAME}' from '{src or '(empty)'}' into '{_build_dir}' …")
+
+    try:
+        version = build(mode, _build_dir)
+    except BaseException:
+        index_store.discard(_build_dir)
+        raise
+    finally:
+        client.reset()
+
+    if version is None:
+        index_store.discard(_build_dir)
+        print(f"✅ Nothing changed; keeping {index_store.active_dir(INDEX_PATH)}")
+    else:
+        # publish = os.replace ของ MANIFEST ครั้งเดียว → process ที่รัน retrieval สลับไปเองโดยไม่ต้อง restart
+        index_store.publish(INDEX_PATH, _build_dir, version)
+        removed = index_store.gc(INDEX_PATH)
+        print(f"🚀 Published {_build_dir}" + (f" (removed {len(removed)} old versions)" if removed else ""))
+    print(f"⏱️  Startup (ms): {startup_report()}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main("full" if "--full" in sys.argv[1:] else BUILD_MODE)
\ No newline at end of file
@@ -0,0 +1,108 @@
+# catalog.py  (precompiled FAQ tree for the Streamlit app: ordering + per-question ids + content hash)
+#   python catalog.py [data/faq_decision_tree.csv]   → index/catalog.json (ไม่ต้อง embed / ไม่ต้องเปิด Chroma)
+from __future__ import annotations
+import os, sys, json, hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from extractive import split_doc
+
+CATALOG_FILE = "catalog.json"
+HASH_FILE    = "catalog.sha1"          # content hash อย่างเดียว (อ่านถูกมาก ใช้เป็น cache key)
+CATALOG_CSV  = Path(os.getenv("CATALOG_CSV", "data/faq_decision_tree.csv"))
+
+# ลำดับหมวดบนหน้า home; หมวดที่ไม่อยู่ในนี้ต่อท้ายเรียงตามตัวอักษร
+CATEGORY_ORDER = [
+    "💻 How to use FIT web app",
+    "📦 General Information",
+    "📊 Methodology",
+    "📱 FIT mobile app",
+    "🆘 Support",
+]
+
+
+def compile_catalog(ids: List[str], docs: List[str], metas: List[Dict], source: str = "",
+                    related: Optional[Dict[str, List]] = None) -> Dict[str, Any]:
+    """
+    tree: category -> subcategory -> [question id] (เรียงไว้แล้ว: หมวดตาม CATEGORY_ORDER, subcategory ตามตัวอักษร,
+    คำถามตามลำดับใน CSV) + items: id -> {q, a, cat, sub}
+    + related: id -> [question id] จาก neighbour graph (related.py) ถ้ามี
+    id เดียวกับใน Chroma (build_index.stable_ids) → app อ้างถึง document ใน index ได้ตรง ๆ
+    """
+    tree: Dict[str, Dict[str, List[str]]] = {}
+    items: Dict[str, Dict[str, str]] = {}
+    for _id, doc, meta in zip(ids, docs, metas):
+        cat, sub = meta.get("category", ""), meta.get("subcategory", "")
+        if not cat or not sub:
+            continue
+        tree.setdefault(cat, {}).setdefault(sub, []).append(_id)
+        items[_id] = {"q": meta.get("question", ""), "a": split_doc(doc), "cat": cat, "sub": sub}
+
+    rank = {c: i for i, c in enumerate(CATEGORY_ORDER)}
+    cats = sorted(tree, key=lambda c: (rank.get(c, len(rank)), c))
+    body = {
+        "tree": {c: {s: tree[c][s] for s in sorted(tree[c])} for c in cats},
+        "items": items,
+    }
+    if related:
+        body["related"] = {i: [j for j, _ in related[i] if j in items] for i in items if i in related}
+    digest = hashlib.sha1(json.dumps(body, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+    return {"version": digest, "source": source, **body}
+
+
+def write_catalog(ids: List[str], docs: List[str], metas: List[Dict], index_path: str, source: str = "",
+                  related: Optional[Dict[str, List]] = None) -> Dict[str, Any]:
+    """เขียน catalog.json แล้วค่อย catalog.sha1 (atomic ทั้งคู่) → hash ใหม่ไม่มีทางมาก่อนเนื้อหาใหม่"""
+    data = compile_catalog(ids, docs, metas, source, related)
+    out = Path(index_path) / CATALOG_FILE
+    out.parent.mkdir(parents=True, exist_ok=True)
+    for path, text in ((out, json.dumps(data, ensure_ascii=False, separators=(",", ":"))),
+                       (out.with_name(HASH_FILE), data["version"])):
+        tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, path)
+    return data
+
+
+def catalog_hash(index_path: str) -> Optional[str]:
+    """content hash ของ catalog ปัจจุบัน (None = ยังไม่เคย build)"""
+    try:
+        return (Path(index_path) / HASH_FILE).read_text(encoding="utf-8").strip() or None
+    except OSError:
+        return None
+
+
+def load_catalog(index_path: str) -> Dict[str, Any]:
+    with (Path(index_path) / CATALOG_FILE).open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_csv(path: Path = CATALOG_CSV):
+    """CSV → (ids, docs, metas) ด้วย loader ของ build_index (csv module ไม่ใช่ pandas)"""
+    from build_index import load_csv_faq, stable_ids
+    items = load_csv_faq(path)
+    metas = [m for _, m in items]
+    return stable_ids(metas), [t for t, _ in items], metas
+
+
+def compile_csv(path: Path = CATALOG_CSV) -> Dict[str, Any]:
+    """catalog ใน memory ตรงจาก CSV (ใช้ตอนยังไม่มี catalog.json)"""
+    return compile_catalog(*read_csv(path), source=path.name)
+
+
+def main():
+    from build_index import INDEX_PATH
+    from index_store import active_dir
+    from related import load_related
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else CATALOG_CSV
+    out_dir = active_dir(INDEX_PATH)   # version ที่ publish อยู่ (app อ่านจากที่เดียวกัน)
+    # neighbour graph ต้องมี vector → ใช้ related.json ที่ build_index เขียนไว้ (ถ้ามี)
+    data = write_catalog(*read_csv(path), out_dir, source=path.name, related=load_related(out_dir))
+    n_sub = sum(len(s) for s in data["tree"].values())
+    print(f"📚 Catalog {data['version'][:12]}: {len(data['tree'])} categories, {n_sub} subcategories, "
+          f"{len(data['items'])} questions, {len(data.get('related', {}))} with related → "
+          f"{out_dir / CATALOG_FILE}")
+
+
+if __name__ == "__main__":
+    main()
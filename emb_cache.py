@@ -0,0 +1,236 @@
+# emb_cache.py  (content-addressed embedding cache, shared by build_index + retrieval)
+from __future__ import annotations
+import os, re, atexit, hashlib, tempfile, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+try:
+    import fcntl   # POSIX: lock ข้าม process ระหว่าง merge + replace
+except ImportError:
+    fcntl = None
+
+EMB_CACHE        = os.getenv("EMB_CACHE", "1") == "1"
+EMB_CACHE_DIR    = Path(os.getenv("EMB_CACHE_DIR", "cache"))
+EMB_CACHE_MAX_MB = float(os.getenv("EMB_CACHE_MAX_MB", 64))
+EMB_CACHE_FLUSH_S = float(os.getenv("EMB_CACHE_FLUSH_S", 30))  # background save ทุก ๆ N วินาที (ถ้ามี vector ใหม่)
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    เก็บ vector float32 แยกไฟล์ต่อ (model, normalize) → key ภายในไฟล์คือ sha1(text)
+    ไฟล์เป็น .npz: keys (N x 20 bytes) + vecs (N x dim float32) เรียงจากเก่า -> ใหม่ (LRU)
+    เกิน max_bytes จะตัดตัวที่ใช้ล่าสุดนานที่สุดทิ้ง
+    put() แค่ mark dirty; เขียนไฟล์ด้วย background thread ทุก flush_s วินาที (ไม่อยู่บน query path)
+    หรือเรียก save() เอง (build_index: ครั้งเดียวตอนจบ)
+    """
+
+    def __init__(self, model: str, normalize: bool, cache_dir: Path = EMB_CACHE_DIR,
+                 max_mb: float = EMB_CACHE_MAX_MB, flush_s: Optional[float] = EMB_CACHE_FLUSH_S):
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model)
+        self.path = Path(cache_dir) / f"emb-{slug}-n{1 if normalize else 0}.npz"
+        self.normalize = normalize
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.flush_s = flush_s   # None / 0 = ไม่มี background flush
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()        # _data
+        self._save_lock = threading.Lock()   # เขียนไฟล์ทีละครั้ง (snapshot → tmp → os.replace)
+        self._data: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._dirty = 0
+        self._disk_stamp = None
+        self._flusher: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        self._load()
+
+    # ---- persistence ----
+    def _stamp(self):
+        try:
+            st = self.path.stat()
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def _read_file(self):
+        with np.load(self.path) as z:
+            return z["keys"], z["vecs"]
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            stamp = self._stamp()
+            keys, vecs = self._read_file()
+            for k, v in zip(keys, vecs):
+                self._data[bytes(k)] = v
+            self._disk_stamp = stamp
+        except Exception:
+            # ไฟล์เสีย/format เก่า → เริ่มใหม่
+            self._data.clear()
+
+    def _merge_disk(self) -> None:
+        """
+        process อื่น (build / worker อื่น) เขียนไฟล์ไปแล้วหลังจากเราโหลด → เติม entry ที่เรายังไม่มี
+        ไว้ฝั่งเก่าของ LRU ก่อนเขียนทับ (ไม่ทำของกันและกันหาย)
+        """
+        stamp = self._stamp()
+        if stamp is None or stamp == self._disk_stamp:
+            return
+        try:
+            keys, vecs = self._read_file()
+        except Exception:
+            return
+        with self._lock:
+            for k, v in zip(keys, vecs):
+                k = bytes(k)
+                if k not in self._data:
+                    self._data[k] = v
+                    self._data.move_to_end(k, last=False)
+
+    def _file_lock(self):
+        """advisory lock (.lock ข้างไฟล์) ให้ merge → replace ของแต่ละ process ไม่แทรกกัน; ไม่มี fcntl → no-op"""
+        if fcntl is None:
+            return None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(self.path.with_name(self.path.name + ".lock"), "a")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def save(self) -> None:
+        with self._save_lock:
+            if not self._dirty:
+                return
+            lock = self._file_lock()
+            try:
+                self._save_locked()
+            finally:
+                if lock is not None:
+                    lock.close()   # close = ปลด flock
+
+    def _save_locked(self) -> None:
+        self._merge_disk()
+        with self._lock:
+            if not self._data:
+                return
+            self._evict()
+            keys = np.array(list(self._data.keys()), dtype="S20")
+            vecs = np.stack(list(self._data.values())).astype(np.float32, copy=False)
+            self._dirty = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # temp ไม่ซ้ำกันต่อการเขียน → หลาย process / thread ไม่ชนไฟล์เดียวกัน
+        with tempfile.NamedTemporaryFile(dir=self.path.parent, prefix=self.path.name + ".",
+                                         suffix=".tmp", delete=False) as f:
+            tmp = f.name
+            try:
+                np.savez(f, keys=keys, vecs=vecs)
+            except BaseException:
+                f.close()
+                os.unlink(tmp)
+                raise
+        os.replace(tmp, self.path)  # atomic: reader ไม่เห็นไฟล์ครึ่ง ๆ
+        self._disk_stamp = self._stamp()
+
+    def _flush_loop(self) -> None:
+        while not self._closed.wait(self.flush_s):
+            try:
+                self.save()
+            except Exception:
+                pass   # เขียน cache ไม่ได้ (disk เต็ม ฯลฯ) ไม่ควรล้ม process; รอบหน้าลองใหม่
+
+    def close(self) -> None:
+        self._closed.set()
+        self.save()
+
+    def _evict(self) -> None:
+        if not self._data:
+            return
+        per_item = next(iter(self._data.values())).nbytes + 20
+        while self._data and len(self._data) * per_item > self.max_bytes:
+            self._data.popitem(last=False)
+
+    # ---- lookup ----
+    def get(self, text: str) -> Optional[np.ndarray]:
+        k = text_key(text)
+        with self._lock:
+            v = self._data.get(k)
+            if v is not None:
+                self._data.move_to_end(k)
+            return v
+
+    def put(self, text: str, vec: np.ndarray) -> None:
+        k = text_key(text)
+        with self._lock:
+            self._data[k] = np.asarray(vec, dtype=np.float32)
+            self._data.move_to_end(k)
+            self._dirty += 1
+            start = self.flush_s and self._flusher is None
+            if start:
+                self._flusher = threading.Thread(target=self._flush_loop, name="emb-cache-flush", daemon=True)
+        if start:
+            self._flusher.start()
+
+    def encode(self, embedder, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        เหมือน embedder.encode(texts) แต่เช็ค cache ก่อน; encode เฉพาะตัวที่ไม่เคยเห็น (1 forward pass)
+        คืน np.ndarray float32 shape (len(texts), dim)
+        """
+        out: List[Optional[np.ndarray]] = [self.get(t) for t in texts]
+        miss = [i for i, v in enumerate(out) if v is None]
+        self.hits += len(texts) - len(miss)
+        self.misses += len(miss)
+
+        if miss:
+            vecs = embedder.encode(
+                [texts[i] for i in miss],
+                batch_size=batch_size,
+                normalize_embeddings=self.normalize,
+                show_progress_bar=False,
+            )
+            vecs = np.asarray(vecs, dtype=np.float32)
+            for i, v in zip(miss, vecs):
+                out[i] = v
+                self.put(texts[i], v)
+
+        if not out:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(out).astype(np.float32, copy=False)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+class _NoCache(EmbeddingCache):
+    """ใช้ตอน EMB_CACHE=0 → encode ตรง ๆ ไม่อ่าน/เขียนไฟล์"""
+
+    def __init__(self, model: str, normalize: bool):
+        self.normalize = normalize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        return None
+
+    def put(self, text: str, vec: np.ndarray) -> None:
+        pass
+
+    def save(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def open_cache(model: str, normalize: bool, flush_s: Optional[float] = EMB_CACHE_FLUSH_S) -> EmbeddingCache:
+    """flush_s=None → ไม่ flush เองระหว่างทาง (ผู้เรียก save() เอง); ทุกแบบ save อีกครั้งตอน exit"""
+    if not EMB_CACHE:
+        return _NoCache(model, normalize)
+    cache = EmbeddingCache(model, normalize, flush_s=flush_s)
+    atexit.register(cache.close)
+    return cache
@@ -0,0 +1,78 @@
+# extractive.py  (exact-question index for answering without the LLM)
+from __future__ import annotations
+import os, re, json, hashlib, threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+EXACT_FILE = "exact.json"
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+def norm_question(s: str) -> str:
+    """lowercase + ตัดเครื่องหมาย + ยุบ space → "How do I add covers?" == "how do i add covers" """
+    return " ".join(_PUNCT_RE.sub(" ", (s or "").lower()).split())
+
+
+def question_key(s: str) -> str:
+    return hashlib.sha1(norm_question(s).encode("utf-8")).hexdigest()
+
+
+def split_doc(doc: str) -> str:
+    """document = "Question\\n\\nAnswer" → คืนเฉพาะ Answer"""
+    parts = (doc or "").split("\n\n", 1)
+    return parts[1].strip() if len(parts) == 2 else (doc or "").strip()
+
+
+def write_exact_index(ids: List[str], docs: List[str], metas: List[Dict], index_path: str,
+                      version: str = "") -> int:
+    """
+    hash(normalized question) -> {id, question, answer}
+    คำถามที่ซ้ำกันแต่คำตอบต่างกัน → ไม่ใส่ (ตอบแบบ exact ไม่ได้ ต้องให้ LLM รวมเอง)
+    """
+    entries: Dict[str, Optional[Dict[str, str]]] = {}
+    for _id, doc, meta in zip(ids, docs, metas):
+        q = meta.get("question", "")
+        key = question_key(q)
+        item = {"id": _id, "question": q, "answer": split_doc(doc)}
+        if key in entries and (entries[key] is None or entries[key]["answer"] != item["answer"]):
+            entries[key] = None
+            continue
+        entries[key] = item
+    data = {"version": version, "entries": {k: v for k, v in entries.items() if v is not None}}
+
+    out = Path(index_path) / EXACT_FILE
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(out.name + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, out)
+    return len(data["entries"])
+
+
+class ExactIndex:
+    """โหลด exact.json ครั้งเดียวต่อ index version; lookup = dict get (ไม่ต้อง encode / ไม่ต้องค้น Chroma)"""
+
+    def __init__(self, index_path: str):
+        self.path = Path(index_path) / EXACT_FILE
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries: Dict[str, Dict[str, Any]] = {}
+
+    def ensure(self, version: str, index_path: Optional[str] = None) -> None:
+        """index_path: directory ของ version นั้น (index แบบ versioned ย้าย directory ทุก build)"""
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            if index_path is not None:
+                self.path = Path(index_path) / EXACT_FILE
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8")) if self.path.exists() else {}
+                self._entries = data.get("entries") or {}
+                self._version = version
+            except Exception:
+                pass
+
+    def lookup(self, question: str) -> Optional[Dict[str, Any]]:
+        return self._entries.get(question_key(question))
@@ -0,0 +1,162 @@
+# fake_mistral.py  (local stand-in for the Mistral chat API: latency / errors / tokens)
+#   python fake_mistral.py --port 8765 --latency-ms 400 --error-rate 0.1
+#   MISTRAL_SERVER_URL=http://127.0.0.1:8765 MISTRAL_API_KEY=fake python ...
+from __future__ import annotations
+import json, math, time, uuid, random, argparse, threading
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+
+@dataclass
+class FakeConfig:
+    latency_ms: float = 400.0        # ค่าเฉลี่ยของ latency (lognormal)
+    latency_sigma: float = 0.5       # ความกว้างของหาง (0 = คงที่)
+    error_rate: float = 0.0          # สัดส่วน request ที่ตอบ error
+    error_status: int = 503
+    timeout_rate: float = 0.0        # สัดส่วน request ที่ค้างนาน (จำลอง upstream แขวน)
+    hang_s: float = 60.0
+    completion_tokens: int = 60
+    refusal_rate: float = 0.0        # small model ตอบ "not sure" (ใช้ทดสอบ escalation)
+    smart_model_hint: str = "large"  # model ที่มีคำนี้ในชื่อไม่ refuse
+    ttft_share: float = 0.3          # stream: สัดส่วน latency ก่อน token แรก
+
+
+def _sample_latency(cfg: FakeConfig) -> float:
+    mean = max(0.0, cfg.latency_ms) / 1000.0
+    if mean == 0 or cfg.latency_sigma <= 0:
+        return mean
+    mu = math.log(mean) - cfg.latency_sigma ** 2 / 2   # ให้ค่าเฉลี่ยออกมาเท่ากับ mean
+    return random.lognormvariate(mu, cfg.latency_sigma)
+
+
+def _answer_words(cfg: FakeConfig, model: str) -> Tuple[list, bool]:
+    refuse = cfg.smart_model_hint not in model and random.random() < cfg.refusal_rate
+    if refuse:
+        return "I’m not sure from the current docs.".split(" "), True
+    words = ["FIT"] + ["answer"] * max(0, cfg.completion_tokens - 2) + ["[Q1]"]
+    return words, False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeMistral/1.0"
+    cfg: FakeConfig = FakeConfig()
+    counts: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def log_message(self, fmt, *args):   # เงียบ ไม่ spam stdout ตอน load test
+        pass
+
+    def _count(self, key: str) -> None:
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _json(self, status: int, obj) -> None:
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/health", "/v1/health"):
+            return self._json(200, {"ok": True, "config": asdict(self.cfg), "counts": dict(self.counts)})
+        self._json(404, {"message": "not found"})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"message": "not found"})
+        n = int(self.headers.get("Content-Length") or 0)
+        req = json.loads(self.rfile.read(n) or b"{}")
+        cfg = self.cfg
+        self._count("requests")
+
+        if random.random() < cfg.timeout_rate:
+            self._count("hangs")
+            time.sleep(cfg.hang_s)
+        latency = _sample_latency(cfg)
+        if random.random() < cfg.error_rate:
+            self._count("errors")
+            time.sleep(latency * cfg.ttft_share)
+            return self._json(cfg.error_status, {"object": "error", "message": "injected failure",
+                                                 "type": "service_unavailable", "code": cfg.error_status})
+
+        model = req.get("model", "fake")
+        prompt_chars = sum(len(m.get("content") or "") for m in req.get("messages") or [])
+        words, refused = _answer_words(cfg, model)
+        words = words[: max(1, int(req.get("max_tokens") or len(words)))]
+        usage = {"prompt_tokens": max(1, prompt_chars // 4), "completion_tokens": len(words)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if refused:
+            self._count("refusals")
+        base = {"id": uuid.uuid4().hex, "created": int(time.time()), "model": model}
+
+        if req.get("stream"):
+            return self._stream(base, words, usage, latency)
+
+        time.sleep(latency)
+        self._json(200, {
+            **base,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": " ".join(words)}}],
+            "usage": usage,
+        })
+
+    def _stream(self, base: Dict, words: list, usage: Dict, latency: float) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        time.sleep(latency * self.cfg.ttft_share)
+        per_token = latency * (1 - self.cfg.ttft_share) / max(1, len(words))
+        try:
+            for i, w in enumerate(words):
+                last = i == len(words) - 1
+                chunk = {
+                    **base,
+                    "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "finish_reason": "stop" if last else None,
+                                 "delta": {"role": "assistant", "content": w + ("" if last else " ")}}],
+                }
+                if last:
+                    chunk["usage"] = usage
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(per_token)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self._count("client_aborts")   # client ตัด stream (early-abort escalation)
+
+
+def start_server(cfg: FakeConfig, host: str = "127.0.0.1", port: int = 0):
+    """เปิด server ใน background thread → คืน (server, url); ปิดด้วย server.shutdown()"""
+    handler = type("Handler", (_Handler,), {"cfg": cfg, "counts": {}, "lock": threading.Lock()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-mistral", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake Mistral chat API for local testing")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    for field, default in asdict(FakeConfig()).items():
+        ap.add_argument("--" + field.replace("_", "-"), type=type(default), default=default)
+    args = vars(ap.parse_args())
+    host, port = args.pop("host"), args.pop("port")
+
+    server, url = start_server(FakeConfig(**args), host, port)
+    print(f"🧪 Fake Mistral listening on {url}  (MISTRAL_SERVER_URL={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
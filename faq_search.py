@@ -0,0 +1,134 @@
+# faq_search.py  (in-memory search-as-you-type over catalog questions: prefix terms + trigram fuzziness)
+from __future__ import annotations
+import math, heapq
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+from bm25 import tokenize
+from extractive import norm_question
+
+PHRASE_BONUS = 0.2  # คำถามที่ขึ้นต้นด้วยสิ่งที่พิมพ์มาทั้งก้อน
+FUZZY_MIN    = 0.4  # trigram Dice ขั้นต่ำของคำที่พิมพ์ผิด ("covr" ~ "cover")
+W_CONTEXT    = 0.5  # คำที่อยู่แค่ในชื่อหมวด/หัวข้อ (เช่น "mobile") นับครึ่งเดียว
+MIN_SCORE    = 0.3
+
+
+def _trigrams(s: str) -> set:
+    s = f" {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class QuestionIndex:
+    """
+    สร้างครั้งเดียวต่อ catalog version (app ถือไว้ด้วย st.cache_resource)
+    - term postings + vocab เรียงไว้ → คำสุดท้ายที่ยังพิมพ์ไม่จบ match แบบ prefix ด้วย bisect
+    - trigram ของคำใน vocab → คำที่ไม่เจอเลย (พิมพ์ผิด) จับคู่กับคำที่ใกล้ที่สุดแทน
+    score = coverage ของ query term ถ่วงด้วย idf (0..1) + bonus ถ้าคำถามขึ้นต้นด้วย query
+    """
+
+    def __init__(self, catalog: Dict[str, Any]):
+        items = catalog.get("items") or {}
+        self.ids: List[str] = list(items)
+        self.norm: List[str] = [norm_question(items[i]["q"]) for i in self.ids]
+        self.by_question: Dict[str, str] = {q: i for q, i in zip(self.norm, self.ids)}
+
+        self._terms: Dict[str, Dict[int, float]] = {}
+        for d, (q, qid) in enumerate(zip(self.norm, self.ids)):
+            for t in set(tokenize(f"{items[qid].get('cat', '')} {items[qid].get('sub', '')}")):
+                self._terms.setdefault(t, {})[d] = W_CONTEXT
+            for t in set(tokenize(q)):
+                self._terms.setdefault(t, {})[d] = 1.0
+        self._vocab = sorted(self._terms)
+        self._vocab_grams = {t: _trigrams(t) for t in self._vocab}
+        self._gram_terms: Dict[str, List[str]] = {}
+        for t, grams in self._vocab_grams.items():
+            for g in grams:
+                self._gram_terms.setdefault(g, []).append(t)
+        n = max(1, len(self.ids))
+        self._idf = {t: math.log(1 + n / len(ds)) for t, ds in self._terms.items()}
+        self._idf_missing = math.log(1 + n)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _prefix(self, prefix: str) -> List[Tuple[str, float]]:
+        i = bisect_left(self._vocab, prefix)
+        out = []
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            out.append((self._vocab[i], 1.0))
+            i += 1
+        return out
+
+    def _fuzzy(self, term: str) -> List[Tuple[str, float]]:
+        grams = _trigrams(term)
+        shared = Counter(t for g in grams for t in self._gram_terms.get(g, ()))
+        out = []
+        for t, n in shared.items():
+            sim = 2 * n / (len(grams) + len(self._vocab_grams[t]))
+            if sim >= FUZZY_MIN:
+                out.append((t, sim))
+        return out
+
+    def _matches(self, term: str, partial: bool) -> List[Tuple[str, float]]:
+        """[(คำใน vocab, น้ำหนัก 0..1)]: ตรงตัว → prefix (คำที่ยังพิมพ์อยู่) → fuzzy"""
+        if term in self._terms and not partial:
+            return [(term, 1.0)]
+        return (self._prefix(term) if partial else []) or self._fuzzy(term)
+
+    def search(self, query: str, limit: int = 8, min_score: float = MIN_SCORE) -> List[Tuple[str, float]]:
+        """คืน [(question id, score)] เรียงจากมากไปน้อย; เสมอกัน → คำถามสั้นกว่าก่อน"""
+        nq = norm_question(query)
+        if not nq:
+            return []
+        terms = tokenize(nq)
+        if not terms:
+            # มีแต่ stopword ("how do i") → ใช้ต้นประโยคอย่างเดียว
+            hits = [d for d, q in enumerate(self.norm) if q.startswith(nq)]
+            hits.sort(key=lambda d: len(self.norm[d]))
+            return [(self.ids[d], 1.0) for d in hits[:limit]]
+        # ช่องว่างท้าย query = พิมพ์คำสุดท้ายจบแล้ว → ไม่ต้องขยายเป็น prefix
+        last_partial = not query.endswith(" ")
+
+        coverage: Dict[int, float] = {}
+        total = 0.0
+        for j, t in enumerate(terms):
+            matches = self._matches(t, last_partial and j == len(terms) - 1)
+            w = max((self._idf[x] for x, _ in matches), default=self._idf_missing)
+            total += w
+            best: Dict[int, float] = {}
+            for x, sim in matches:
+                for d, weight in self._terms[x].items():
+                    best[d] = max(best.get(d, 0.0), sim * weight)
+            for d, sim in best.items():
+                coverage[d] = coverage.get(d, 0.0) + w * sim
+
+        scored = []
+        for d, c in coverage.items():
+            s = c / total if total else 0.0
+            if self.norm[d].startswith(nq):
+                s += PHRASE_BONUS
+            if s >= min_score:
+                scored.append((s, -len(self.norm[d]), d))
+        return [(self.ids[d], round(s, 4)) for s, _, d in heapq.nlargest(limit, scored)]
+
+    def ids_for_results(self, results: List[Dict[str, Any]]) -> List[Tuple[str, float]]:
+        """ผลจาก retrieval.retrieve() → (question id, score) ผ่าน meta['question']"""
+        out = []
+        for r in results:
+            qid = self.by_question.get(norm_question((r.get("meta") or {}).get("question", "")))
+            if qid is not None:
+                out.append((qid, float(r.get("score", 0.0))))
+        return out
+
+
+def merge_hits(lexical: List[Tuple[str, float]], vector: List[Tuple[str, float]],
+               limit: int) -> List[Tuple[str, float]]:
+    """lexical ก่อน (ตรงกับที่พิมพ์) แล้วเติมด้วย vector hit ที่ยังไม่มี"""
+    seen = {qid for qid, _ in lexical}
+    out = list(lexical)
+    for qid, s in vector:
+        if qid not in seen:
+            seen.add(qid)
+            out.append((qid, s))
+    return out[:limit]
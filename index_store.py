@@ -0,0 +1,157 @@
+# index_store.py  (versioned index directories published through an atomic MANIFEST swap)
+#   index/
+#     MANIFEST.json            {"version", "dir", "published", "history"}  ← os.replace ครั้งเดียว = publish
+#     versions/<build>/        chroma.sqlite3 + vectors.npy + bm25.json + exact.json + catalog.json + ... + VERSION
+#   ยังไม่มี MANIFEST (index ที่ build ด้วยเวอร์ชันเก่า) → ใช้ INDEX_PATH ตรง ๆ เหมือนเดิม
+#   python index_store.py [--gc]   → แสดง version ปัจจุบัน / ลบ version เก่า
+from __future__ import annotations
+import os, sys, json, time, shutil, threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+MANIFEST_FILE = "MANIFEST.json"
+VERSIONS_DIR  = "versions"
+KEEP_VERSIONS = max(2, int(os.getenv("KEEP_VERSIONS", 3)))   # รวมตัวปัจจุบัน; ตัวก่อนหน้าต้องอยู่ให้ process ที่ยังไม่สลับ
+HISTORY_MAX   = 20
+
+
+def _manifest_path(index_path) -> Path:
+    return Path(index_path) / MANIFEST_FILE
+
+
+def manifest_stamp(index_path) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) ของ MANIFEST; stat อย่างเดียว ถูกพอจะเช็คทุก query"""
+    try:
+        st = _manifest_path(index_path).stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def read_manifest(index_path) -> Optional[Dict[str, Any]]:
+    try:
+        data = json.loads(_manifest_path(index_path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) and data.get("dir") else None
+
+
+_active_lock = threading.Lock()
+_active: Dict[str, Tuple[Optional[Tuple[int, int]], Path]] = {}
+
+def active_dir(index_path) -> Path:
+    """directory ของ version ที่ publish ล่าสุด (cache ตาม stamp ของ MANIFEST → ไม่ต้อง parse JSON ทุกครั้ง)"""
+    root = Path(index_path)
+    stamp = manifest_stamp(root)
+    cached = _active.get(str(root))
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    manifest = read_manifest(root) if stamp else None
+    path = root / manifest["dir"] if manifest else root
+    with _active_lock:
+        _active[str(root)] = (stamp, path)
+    return path
+
+
+def new_build_dir(index_path) -> Path:
+    """versions/<time_ns>-<pid>: ยังไม่มีใครเห็นจนกว่าจะ publish()"""
+    path = Path(index_path) / VERSIONS_DIR / f"{time.time_ns()}-{os.getpid()}"
+    path.mkdir(parents=True, exist_ok=False)
+    return path
+
+
+def seed_build_dir(index_path, build_dir: Path) -> Optional[Path]:
+    """
+    copy version ปัจจุบันเป็นจุดเริ่มของ build แบบ incremental (copy-on-write: ตัวที่ live ไม่ถูกแก้)
+    คืน directory ต้นทาง (None = ยังไม่มีอะไรให้ copy)
+    """
+    root = Path(index_path)
+    src = active_dir(root)
+    if not src.is_dir():
+        return None
+    skip = {VERSIONS_DIR, MANIFEST_FILE} if src == root else set()
+    copied = False
+    for entry in src.iterdir():
+        if entry.name in skip or entry.name.endswith(".tmp"):
+            continue
+        if entry.is_dir():
+            shutil.copytree(entry, build_dir / entry.name)
+        else:
+            shutil.copy2(entry, build_dir / entry.name)
+        copied = True
+    return src if copied else None
+
+
+def publish(index_path, build_dir: Path, version: str) -> Dict[str, Any]:
+    """
+    สลับ MANIFEST ไปที่ build_dir ด้วย os.replace (atomic): reader เห็นตัวเก่าหรือตัวใหม่ครบ ๆ เท่านั้น
+    ต้องเขียน artifact ทุกไฟล์ใน build_dir ให้เสร็จก่อนเรียก
+    """
+    root = Path(index_path)
+    rel = build_dir.relative_to(root).as_posix()
+    prev = read_manifest(root)
+    history = [h for h in (prev or {}).get("history", []) if h != rel]
+    manifest = {"version": version, "dir": rel, "published": time.time(),
+                "history": ([rel] + history)[:HISTORY_MAX]}
+    path = _manifest_path(root)
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+    return manifest
+
+
+def discard(build_dir: Path) -> None:
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+
+def gc(index_path, keep: int = KEEP_VERSIONS) -> List[str]:
+    """
+    ลบ version เก่าใน versions/ ให้เหลือ keep ตัวล่าสุดที่เคย publish (รวมตัวปัจจุบัน)
+    directory ที่ใหม่กว่าตัวปัจจุบันแต่ยังไม่ publish = build อื่นที่กำลังรันอยู่ → ไม่แตะ
+    """
+    root = Path(index_path)
+    manifest = read_manifest(root)
+    vdir = root / VERSIONS_DIR
+    if manifest is None or not vdir.is_dir():
+        return []
+    history = manifest.get("history") or [manifest["dir"]]
+    protected = set(history[:max(2, keep)]) | {manifest["dir"]}
+    current = root / manifest["dir"]
+    try:
+        current_mtime = current.stat().st_mtime
+    except OSError:
+        return []
+
+    removed = []
+    for entry in vdir.iterdir():
+        rel = entry.relative_to(root).as_posix()
+        if not entry.is_dir() or rel in protected:
+            continue
+        try:
+            if rel not in history and entry.stat().st_mtime >= current_mtime:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        removed.append(rel)
+    return removed
+
+
+def main():
+    from build_index import INDEX_PATH
+    manifest = read_manifest(INDEX_PATH)
+    if manifest is None:
+        print(f"📦 {INDEX_PATH}: no {MANIFEST_FILE} (unversioned index)")
+        return
+    print(f"📦 {INDEX_PATH}: version {manifest['version']} at {manifest['dir']} "
+          f"(published {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['published']))})")
+    vdir = Path(INDEX_PATH) / VERSIONS_DIR
+    for entry in sorted(vdir.iterdir()) if vdir.is_dir() else []:
+        print(f"   {'*' if entry.name == Path(manifest['dir']).name else ' '} {entry.name}")
+    if "--gc" in sys.argv[1:]:
+        removed = gc(INDEX_PATH)
+        print(f"🧹 Removed {len(removed)} old versions" + (f": {', '.join(removed)}" if removed else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# lazy.py  (thread-safe lazy singletons + startup timing)
+from __future__ import annotations
+import time, threading
+from typing import Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+_timings: Dict[str, float] = {}     # name -> วินาทีที่ใช้ (import / init)
+_timings_lock = threading.Lock()
+
+
+def record(name: str, seconds: float) -> None:
+    with _timings_lock:
+        _timings[name] = seconds
+
+
+def startup_report() -> Dict[str, float]:
+    """เวลา import ของแต่ละ module + เวลาสร้าง resource หนัก ๆ (ms) เท่าที่ถูกสร้างไปแล้ว"""
+    with _timings_lock:
+        return {k: round(v * 1000, 2) for k, v in _timings.items()}
+
+
+class Lazy(Generic[T]):
+    """
+    สร้าง object ครั้งแรกที่เรียก get() เท่านั้น (double-checked lock → สร้างครั้งเดียวแม้หลาย thread)
+    ถ้า factory raise → ไม่ cache error, รอบหน้าลองใหม่
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self._factory = factory
+        self._value: Optional[T] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        v = self._value
+        if v is not None:
+            return v
+        with self._lock:
+            if self._value is None:
+                t0 = time.perf_counter()
+                self._value = self._factory()
+                record(self.name, time.perf_counter() - t0)
+            return self._value
+
+    def loaded(self) -> bool:
+        return self._value is not None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._value = None
+
+
+if __name__ == "__main__":
+    # python lazy.py  → วัดเวลา import (ควรเล็ก) แล้วค่อย warmup ของจริง
+    # ใช้ module "lazy" ตัวจริง (ไม่ใช่ __main__) เพื่อให้เห็น timing ที่ module อื่น record ไว้
+    import json, importlib
+    import lazy
+
+    for mod in ("build_index", "retrieval", "llm"):
+        t0 = time.perf_counter()
+        importlib.import_module(mod)
+        lazy.record(f"import_total:{mod}", time.perf_counter() - t0)
+
+    import retrieval, llm
+    retrieval.warmup()
+    try:
+        llm.warmup()
+    except Exception as e:
+        print(f"⚠️ llm warmup skipped: {e}")
+    print(json.dumps(lazy.startup_report(), indent=2))
@@ -1,27 +1,38 @@
 # llm.py  — Mistral version (no ChatMessage import)
 
-import os, time
-from typing import List, Dict, Tuple
+import time
+_T_IMPORT = time.perf_counter()
+
+import os, re, asyncio, contextlib, weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Dict, Optional, Tuple
 from dotenv import load_dotenv
 
-# ใช้ client แบบใหม่ของ Mistral
-from mistralai import Mistral
+from lazy import Lazy, record, startup_report
+from answer_cache import ANSWER_CACHE, AnswerCache, ctx_hash
+from extractive import ExactIndex, split_doc
+from singleflight import SingleFlight, AsyncSingleFlight
+from resilience import Resilient
+import tracing
 
 load_dotenv()
 
 # ---- API key & model ----
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY", "")
 
-# ลองอ่านจาก Streamlit secrets ด้วย (กรณี deploy ข้างหน้า)
-if not MISTRAL_API_KEY:
-    try:
-        import streamlit as st
-        MISTRAL_API_KEY = st.secrets.get("MISTRAL_API_KEY", MISTRAL_API_KEY)
-    except Exception:
-        pass
 
-if not MISTRAL_API_KEY:
-    raise RuntimeError("MISTRAL_API_KEY not found. Put it in .env OR Streamlit secrets.")
+def _api_key() -> str:
+    key = MISTRAL_API_KEY
+    # ลองอ่านจาก Streamlit secrets ด้วย (กรณี deploy ข้างหน้า)
+    if not key:
+        try:
+            import streamlit as st
+            key = st.secrets.get("MISTRAL_API_KEY", key)
+        except Exception:
+            pass
+    if not key:
+        raise RuntimeError("MISTRAL_API_KEY not found. Put it in .env OR Streamlit secrets.")
+    return key
 
 # ตั้งชื่อ model จาก env (ถ้าไม่ตั้งจะใช้ mistral-small-latest เป็น default)
 MODEL       = os.getenv("MISTRAL_MODEL") or os.getenv("MODEL", "mistral-small-latest")
@@ -29,12 +40,51 @@ SMART_MODEL = os.getenv("MISTRAL_SMART_MODEL") or os.getenv("SMART_MODEL", "mist
 
 MAX_ANSWER_TOKENS = int(os.getenv("MAX_ANSWER_TOKENS", 320))
 MAX_CTX_CHARS     = int(os.getenv("MAX_CTX_CHARS", 4000))
+MAX_CTX_TOKENS    = int(os.getenv("MAX_CTX_TOKENS", MAX_CTX_CHARS // 4))   # budget จริงของ context
+DEDUP_JACCARD     = float(os.getenv("DEDUP_JACCARD", 0.85))   # chunk ที่ซ้ำกันเกินนี้ตัดทิ้ง
+
+# extractive bypass: ตอบด้วย Answer ใน FAQ ตรง ๆ (ไม่เรียก LLM) เมื่อคำถามตรง/เกือบตรง
+EXTRACTIVE          = os.getenv("EXTRACTIVE", "1") == "1"
+EXTRACTIVE_MIN_SIM  = float(os.getenv("EXTRACTIVE_MIN_SIM", 0.90))   # score ของ chunk อันดับ 1
+EXTRACTIVE_MARGIN   = float(os.getenv("EXTRACTIVE_MARGIN", 0.05))    # ห่างจากอันดับ 2 อย่างน้อย
+INDEX_PATH          = os.getenv("INDEX_PATH", "index")
 ALLOW_ESCALATE    = os.getenv("ALLOW_ESCALATE", "1") == "1"
 REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", 30))
+LLM_CONCURRENCY   = int(os.getenv("LLM_CONCURRENCY", 8))      # in-flight สูงสุดต่อ event loop (async)
+
+# escalation: stream คำตอบ small model แล้วตัดทิ้งทันทีถ้าเริ่มด้วย "not sure"
+STREAM_ESCALATE      = os.getenv("STREAM_ESCALATE", "1") == "1"
+ESCALATE_PROBE_CHARS = int(os.getenv("ESCALATE_PROBE_CHARS", 80))   # ดูเฉพาะช่วงต้นของคำตอบ
+ESCALATE_MIN_SCORE   = float(os.getenv("ESCALATE_MIN_SCORE", 0.45))
+# speculative: top score อยู่ช่วง [ESCALATE_MIN_SCORE, SPECULATE_BELOW) → ยิง smart model คู่ขนานเลย
+SPECULATIVE_ESCALATE = os.getenv("SPECULATIVE_ESCALATE", "0") == "1"
+SPECULATE_BELOW      = float(os.getenv("SPECULATE_BELOW", 0.55))
 USER_TAG          = os.getenv("USER_TAG", "fit-assistant")
+MISTRAL_SERVER_URL = os.getenv("MISTRAL_SERVER_URL", "")    # เช่น fake_mistral.py ตอน test / load test
+
+# สร้าง client ของ Mistral ตอนเรียกใช้ครั้งแรก (import llm ได้แม้ยังไม่มี key)
+def _make_client():
+    # ใช้ client แบบใหม่ของ Mistral
+    from mistralai import Mistral
+    kwargs = {"server_url": MISTRAL_SERVER_URL} if MISTRAL_SERVER_URL else {}
+    return Mistral(api_key=_api_key(), timeout_ms=int(REQUEST_TIMEOUT_S * 1000), **kwargs)
+
+# retry / hedge / circuit breaker รอบทุก request ไป Mistral (client ตัวเดียว → reuse connection pool)
+_upstream = Resilient("mistral")
+
+def upstream_stats() -> Dict:
+    return _upstream.stats()
 
-# สร้าง client ของ Mistral
-client = Mistral(api_key=MISTRAL_API_KEY)
+_client = Lazy("llm.client", _make_client)
+
+def get_client():
+    return _client.get()
+
+
+def warmup() -> Dict[str, float]:
+    """สร้าง Mistral client ล่วงหน้า (เช็ค key ด้วย) → คืน startup_report() (ms)"""
+    _client.get()
+    return startup_report()
 
 SYSTEM = (
   "You are FIT Assistant. Answer ONLY about FIT topics (FWCV, covers, waste logging, "
@@ -46,18 +96,80 @@ SYSTEM = (
 def _clean(s: str) -> str:
     return " ".join((s or "").split())
 
-def _clamp_context(chunks: List[Dict]) -> Tuple[str, int]:
+_TOK_RE = re.compile(r"\w+|[^\w\s]")
+
+def _estimate_tokens(s: str) -> int:
+    """
+    ประมาณจำนวน token แบบไม่ต้องมี tokenizer: คำ + เครื่องหมาย (คำยาว ๆ นับเพิ่ม)
+    ใกล้เคียง BPE ของ Mistral สำหรับภาษาอังกฤษ และไม่ต่ำกว่า chars/4
+    """
+    if not s:
+        return 0
+    n = sum(1 + len(t) // 8 for t in _TOK_RE.findall(s))
+    return max(n, len(s) // 4)
+
+def _strip_question(text: str, q: str) -> str:
+    """build_index เก็บ document เป็น "Question\n\nAnswer" → ตัดคำถามออก เพราะมีใน [Q#] header แล้ว"""
+    t = (text or "").strip()
+    if q and _clean(t[:len(q) + 8]).startswith(q):
+        parts = t.split("\n\n", 1)
+        if len(parts) == 2 and _clean(parts[0]) == q:
+            return parts[1].strip()
+    return t
+
+def _shingles(s: str) -> set:
+    return set(_TOK_RE.findall(s.lower()))
+
+def _pack_context(chunks: List[Dict]) -> Tuple[str, int, Dict[str, Any]]:
+    """
+    pack context ตาม token budget (MAX_CTX_TOKENS):
+    - ไม่ใส่คำถามซ้ำสองรอบ (header + ต้น text)
+    - ตัด chunk ที่เกือบซ้ำกัน (Jaccard ≥ DEDUP_JACCARD)
+    - chunk อันดับ 1 ใส่เสมอ (gate escalate / extractive ตัดสินจาก chunk นี้) แล้วเติมตามลำดับ score
+      chunk ที่ไม่พอดี budget ข้ามไปดูตัวถัดไป แทนการหยุดที่ chunk แรกที่ไม่พอดี
+    คืน (ctx, จำนวน chunk ที่ใช้, stats)
+    """
+    stats = {"ctx_tokens": 0, "ctx_tokens_saved": 0, "dropped_duplicates": 0}
     if not chunks:
-        return "NO_CONTEXT", 0
-    acc, total, used = [], 0, 0
-    for i, ch in enumerate(sorted(chunks, key=lambda x: x.get("score", 0), reverse=True), 1):
+        return "NO_CONTEXT", 0, stats
+
+    budget = max(0, MAX_CTX_TOKENS)
+    ranked = sorted(chunks, key=lambda x: x.get("score", 0), reverse=True)
+    blocks: List[str] = []
+    seen: List[set] = []
+    used_tokens = 0
+    naive, naive_full = 0, False   # สิ่งที่ packer แบบเดิม (คำถามซ้ำ + หยุดที่ chunk แรกที่เกิน) จะส่งไปใน budget เดียวกัน
+    for i, ch in enumerate(ranked, 1):
         q = _clean(ch.get("meta", {}).get("question", ""))
-        body = ch.get("text", "")
-        block = f"[Q{i}] {q}\n{body}\n\n"
-        if total + len(block) > MAX_CTX_CHARS:
-            break
-        acc.append(block); total += len(block); used += 1
-    return ("".join(acc) if acc else "NO_CONTEXT"), used
+        text = ch.get("text", "")
+        if not naive_full:
+            old_cost = _estimate_tokens(f"[Q{i}] {q}\n{text}\n\n")
+            if i == 1 or naive + old_cost <= budget:
+                naive += old_cost
+            else:
+                naive_full = True
+
+        body = _strip_question(text, q)
+        sh = _shingles(f"{q} {body}")
+        if any(len(sh & o) / (len(sh | o) or 1) >= DEDUP_JACCARD for o in seen):
+            stats["dropped_duplicates"] += 1
+            continue
+        block = f"[Q{len(blocks) + 1}] {q}\n{body}\n\n"
+        cost = _estimate_tokens(block)
+        if blocks and used_tokens + cost > budget:
+            continue
+        seen.append(sh)
+        blocks.append(block)
+        used_tokens += cost
+
+    ctx = "".join(blocks)
+    stats["ctx_tokens"] = _estimate_tokens(ctx)
+    stats["ctx_tokens_saved"] = max(0, naive - stats["ctx_tokens"])
+    return (ctx if blocks else "NO_CONTEXT"), len(blocks), stats
+
+def _clamp_context(chunks: List[Dict]) -> Tuple[str, int]:
+    ctx, used, _ = _pack_context(chunks)
+    return ctx, used
 
 def _usage_to_dict(u) -> Dict[str, int]:
     """
@@ -82,9 +194,9 @@ def _usage_to_dict(u) -> Dict[str, int]:
     except Exception:
         return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
 
-def _call(model: str, user_q: str, ctx: str) -> Dict:
+def _messages(user_q: str, ctx: str) -> List[Dict]:
     # ใช้ message เป็น dict แบบใน docs ของ mistral
-    messages = [
+    return [
         {"role": "system", "content": SYSTEM},
         {
             "role": "user",
@@ -97,58 +209,605 @@ def _call(model: str, user_q: str, ctx: str) -> Dict:
         },
     ]
 
+def _complete_kwargs(model: str, user_q: str, ctx: str, timeout_s: Optional[float] = None) -> Dict:
+    """timeout_s = เวลาที่เหลือของ deadline (จาก Resilient) → attempt ที่ retry ไม่ได้เวลาเต็มซ้ำ"""
+    timeout_s = REQUEST_TIMEOUT_S if timeout_s is None else min(timeout_s, REQUEST_TIMEOUT_S)
+    return dict(
+        model=model,
+        messages=_messages(user_q, ctx),
+        temperature=0.2,
+        max_tokens=MAX_ANSWER_TOKENS,
+        timeout_ms=max(1, int(timeout_s * 1000)),
+        # SDK ปัจจุบันไม่มี metadata / user parameter แบบ OpenAI
+    )
+
+def _ok(resp, model: str, t0: float) -> Dict:
+    # resp.choices[0].message.content เป็นสตริงใน mistralai
+    text = (resp.choices[0].message.content or "").strip()
+    usage = _usage_to_dict(getattr(resp, "usage", None))
+    return {
+        "text": text,
+        "usage": usage,
+        "latency": time.time() - t0,
+        "model_used": model,
+    }
+
+def _err(e: BaseException, model: str, t0: float) -> Dict:
+    return {
+        "text": "I’m not sure from the current docs (temporary error). Please try again.",
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        "latency": time.time() - t0,
+        "model_used": model,
+        "error": str(e) or type(e).__name__,
+    }
+
+def _llm_attrs(out: Dict) -> Dict[str, Any]:
+    attrs = {"model": out.get("model_used"), "tokens": out.get("usage", {}).get("total_tokens", 0)}
+    for key in ("error", "aborted", "escalated_from", "cache_hit", "coalesced", "extractive"):
+        if out.get(key):
+            attrs[key] = out[key]
+    return attrs
+
+@tracing.traced("llm", _llm_attrs)
+def _call(model: str, user_q: str, ctx: str) -> Dict:
     t0 = time.time()
     try:
-        resp = client.chat.complete(
-            model=model,
-            messages=messages,
-            temperature=0.2,
-            max_tokens=MAX_ANSWER_TOKENS,
-            # SDK ปัจจุบันไม่มี metadata / user parameter แบบ OpenAI
-        )
-        t1 = time.time()
-
-        # resp.choices[0].message.content เป็นสตริงใน mistralai
-        text = (resp.choices[0].message.content or "").strip()
-        usage = _usage_to_dict(getattr(resp, "usage", None))
-
-        return {
+        resp = _upstream.call(lambda left: get_client().chat.complete(**_complete_kwargs(model, user_q, ctx, left)),
+                              deadline_s=REQUEST_TIMEOUT_S)
+        return _ok(resp, model, t0)
+    except Exception as e:
+        return _err(e, model, t0)
+
+
+def _delta_text(chunk) -> str:
+    try:
+        c = chunk.data.choices[0].delta.content
+    except (AttributeError, IndexError):
+        return ""
+    if isinstance(c, list):   # content chunks แบบใหม่ของ SDK
+        return "".join(getattr(p, "text", "") or "" for p in c)
+    return c or ""
+
+class _StreamState:
+    """
+    สะสม text/usage จาก stream + ตัดสินใจ abort ระหว่างทาง
+    on_token(piece, model): ส่งต่อ text ระหว่างทาง; ช่วงที่ยัง probe อยู่จะ buffer ไว้ก่อน (refusal ไม่หลุดไปถึงผู้ใช้)
+    """
+
+    def __init__(self, model: str, user_q: str, ctx: str, probe: bool,
+                 on_token: Optional[Callable[[str, str], None]] = None):
+        self.model, self.user_q, self.ctx = model, user_q, ctx
+        self.probe = probe
+        self.on_token = on_token
+        self.parts: List[str] = []
+        self.n_chunks = 0
+        self.n_emitted = 0
+        self.usage = None
+        self.aborted = False
+        self.ttft: Optional[float] = None
+        self.t0 = time.time()
+
+    def _emit(self) -> None:
+        if self.on_token is None or self.probe or self.n_emitted == len(self.parts):
+            return
+        piece = "".join(self.parts[self.n_emitted:])
+        self.n_emitted = len(self.parts)
+        self.on_token(piece, self.model)
+
+    def done(self) -> None:
+        """stream จบ (ไม่ได้ถูกตัด) → ส่งส่วนที่ยัง buffer อยู่ (คำตอบสั้นกว่า probe window)"""
+        if not self.aborted:
+            self.probe = False
+            self._emit()
+
+    def feed(self, chunk) -> bool:
+        """คืน True ถ้าควรหยุด stream (เจอ refusal ช่วงต้น)"""
+        u = getattr(getattr(chunk, "data", None), "usage", None)
+        if u is not None:
+            self.usage = u
+        piece = _delta_text(chunk)
+        if not piece:
+            return False
+        self.parts.append(piece)
+        self.n_chunks += 1
+        if self.ttft is None:
+            self.ttft = time.time() - self.t0
+        if self.probe:
+            head = "".join(self.parts)
+            if "not sure" in head.lower():
+                self.aborted = True
+                return True
+            if len(head) > ESCALATE_PROBE_CHARS:
+                self.probe = False
+        self._emit()
+        return False
+
+    def result(self) -> Dict:
+        text = "".join(self.parts).strip()
+        out = {
             "text": text,
-            "usage": usage,
-            "latency": t1 - t0,
-            "model_used": model,
+            "usage": _usage_to_dict(self.usage),
+            "latency": time.time() - self.t0,
+            "model_used": self.model,
         }
+        if self.ttft is not None:
+            out["ttft"] = self.ttft
+        if self.aborted:
+            out["aborted"] = True
+        if self.usage is None:
+            # stream ถูกตัดก่อน event สุดท้าย → server ไม่ส่ง usage มา ใช้ค่าประมาณแทน
+            pt = _estimate_tokens(SYSTEM) + _estimate_tokens(self.user_q) + _estimate_tokens(self.ctx)
+            out["usage"] = {"prompt_tokens": pt, "completion_tokens": self.n_chunks,
+                            "total_tokens": pt + self.n_chunks}
+            out["usage_estimated"] = True
+        return out
+
+def _open_stream(model: str, user_q: str, ctx: str, timeout_s: Optional[float]):
+    """เปิด stream แล้วรอ chunk แรก → (stream, iterator, chunk แรกหรือ None); พังตรงนี้ยังไม่มีอะไรถึงผู้ใช้"""
+    with contextlib.ExitStack() as stack:
+        stream = stack.enter_context(get_client().chat.stream(**_complete_kwargs(model, user_q, ctx, timeout_s)))
+        it = iter(stream)
+        first = next(it, None)
+        stack.pop_all()
+    return stream, it, first
 
+def _feed_first(st: "_StreamState", first) -> bool:
+    """คืน True ถ้ายังต้องอ่าน stream ต่อ"""
+    return first is not None and not st.feed(first)
+
+@tracing.traced("llm_stream", _llm_attrs)
+def _stream_call(model: str, user_q: str, ctx: str, probe: bool = True,
+                 on_token: Optional[Callable[[str, str], None]] = None) -> Dict:
+    """
+    เรียกแบบ stream; probe=True → ถ้า "not sure" โผล่ใน ESCALATE_PROBE_CHARS ตัวแรก
+    ปิด stream ทันที (ไม่ต้องรอให้ small model ตอบจบ) แล้วคืน out["aborted"] = True
+    ช่วงเปิด stream จนได้ chunk แรกผ่าน Resilient (retry + deadline, ไม่ hedge = ไม่เปิด stream ซ้อน)
+    หลังจากนั้น token เริ่มออกไปแล้ว → พังกลางทางไม่ retry แค่แจ้ง circuit breaker
+    """
+    st = _StreamState(model, user_q, ctx, probe, on_token)
+    opened = False
+    try:
+        stream, it, first = _upstream.call(lambda left: _open_stream(model, user_q, ctx, left),
+                                           deadline_s=REQUEST_TIMEOUT_S, hedge=False)
+        opened = True
+        with stream:
+            if _feed_first(st, first):
+                for chunk in it:
+                    if st.feed(chunk):
+                        break
+        st.done()
+        return st.result()
     except Exception as e:
-        t1 = time.time()
-        return {
-            "text": "I’m not sure from the current docs (temporary error). Please try again.",
-            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
-            "latency": t1 - t0,
-            "model_used": model,
-            "error": str(e),
-        }
+        if opened:
+            _upstream.record_failure(e)   # ช่วงเปิด stream Resilient นับให้แล้ว
+        return _err(e, model, st.t0)
 
-def answer_with_llm(user_q: str, chunks: List[Dict]) -> Dict:
-    ctx, used = _clamp_context(chunks)
-    out = _call(MODEL, user_q, ctx)
-
-    top_score = (chunks[0].get("score", 0.0) if chunks else 0.0)
-    need_escalate = ALLOW_ESCALATE and ("not sure" in out["text"].lower()) and top_score >= 0.45
-
-    if need_escalate and SMART_MODEL and SMART_MODEL != MODEL:
-        out2 = _call(SMART_MODEL, user_q, ctx)
-        if len(out2["text"]) > len(out["text"]):
-            u1, u2 = out["usage"], out2["usage"]
-            out2["usage"] = {
-                "prompt_tokens": u1["prompt_tokens"] + u2["prompt_tokens"],
-                "completion_tokens": u1["completion_tokens"] + u2["completion_tokens"],
-                "total_tokens": u1["total_tokens"] + u2["total_tokens"],
-            }
-            out2["ctx_used"] = used
-            out2["chunks_used"] = used
-            return out2
 
+# ---- async path: semaphore ต่อ event loop (asyncio.Semaphore ผูกกับ loop) ----
+_async_sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _async_sem() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _async_sems.get(loop)
+    if sem is None:
+        sem = _async_sems[loop] = asyncio.Semaphore(max(1, LLM_CONCURRENCY))
+    return sem
+
+async def _open_stream_async(model: str, user_q: str, ctx: str, timeout_s: Optional[float]):
+    """async version ของ _open_stream"""
+    async with contextlib.AsyncExitStack() as stack:
+        stream = await get_client().chat.stream_async(**_complete_kwargs(model, user_q, ctx, timeout_s))
+        await stack.enter_async_context(stream)
+        it = stream.__aiter__()
+        try:
+            first = await it.__anext__()
+        except StopAsyncIteration:
+            first = None
+        stack.pop_all()
+    return stream, it, first
+
+@tracing.traced("llm_stream", _llm_attrs)
+async def _stream_call_async(model: str, user_q: str, ctx: str, probe: bool = True) -> Dict:
+    """async version ของ _stream_call (timeout / semaphore เหมือน _call_async)"""
+    st = _StreamState(model, user_q, ctx, probe)
+    opened = False
+    try:
+        async def _go():
+            nonlocal opened
+            async with _async_sem():
+                left = REQUEST_TIMEOUT_S - (time.time() - st.t0)
+                stream, it, first = await _upstream.call_async(
+                    lambda t: _open_stream_async(model, user_q, ctx, t),
+                    deadline_s=max(left, 1e-3), hedge=False)
+                opened = True
+                async with stream:
+                    if _feed_first(st, first):
+                        async for chunk in it:
+                            if st.feed(chunk):
+                                break
+                st.done()
+        await asyncio.wait_for(_go(), timeout=REQUEST_TIMEOUT_S)
+        return st.result()
+    except asyncio.TimeoutError:
+        e = TimeoutError(f"Mistral request timed out after {REQUEST_TIMEOUT_S}s")
+        if opened:
+            _upstream.record_failure(e)
+        return _err(e, model, st.t0)
+    except Exception as e:
+        if opened:
+            _upstream.record_failure(e)
+        return _err(e, model, st.t0)
+
+@tracing.traced("llm", _llm_attrs)
+async def _call_async(model: str, user_q: str, ctx: str) -> Dict:
+    """
+    เหมือน _call แต่ใช้ chat.complete_async: ไม่กิน thread ระหว่างรอ Mistral
+    - จำกัด in-flight ด้วย LLM_CONCURRENCY
+    - REQUEST_TIMEOUT_S นับรวมเวลารอ semaphore: ที่เหลือหลังได้ slot เป็น deadline ของ Resilient
+      (แต่ละ attempt ถูก cancel เมื่อครบ) + asyncio.wait_for ครอบช่วงรอ semaphore
+    - cancel task ได้: CancelledError ไม่ถูกกลืน
+    """
+    t0 = time.time()
+    try:
+        async def _go():
+            async with _async_sem():
+                left = REQUEST_TIMEOUT_S - (time.time() - t0)
+                return await _upstream.call_async(
+                    lambda t: get_client().chat.complete_async(**_complete_kwargs(model, user_q, ctx, t)),
+                    deadline_s=max(left, 1e-3))
+        resp = await asyncio.wait_for(_go(), timeout=REQUEST_TIMEOUT_S)
+        return _ok(resp, model, t0)
+    except asyncio.TimeoutError:
+        return _err(TimeoutError(f"Mistral request timed out after {REQUEST_TIMEOUT_S}s"), model, t0)
+    except Exception as e:
+        return _err(e, model, t0)
+
+
+def _cosine(chunk: Dict) -> Optional[float]:
+    """cosine similarity ของ chunk; hit จาก lexical fast path (ไม่ได้ encode query) → None"""
+    return None if chunk.get("match") == "fastpath" else chunk.get("score", 0.0)
+
+def _top_score(chunks: List[Dict]) -> float:
+    return chunks[0].get("score", 0.0) if chunks else 0.0
+
+def _relevant(chunks: List[Dict]) -> bool:
+    """context เกี่ยวข้องพอให้คุ้ม escalate: cosine อันดับ 1 ผ่านเกณฑ์ หรือ BM25 ชนะขาด (fast path)"""
+    if not chunks:
+        return False
+    sim = _cosine(chunks[0])
+    return sim is None or sim >= ESCALATE_MIN_SCORE
+
+def _can_escalate(chunks: List[Dict]) -> bool:
+    return ALLOW_ESCALATE and _relevant(chunks) and bool(SMART_MODEL) and SMART_MODEL != MODEL
+
+def _need_escalate(out: Dict, chunks: List[Dict]) -> bool:
+    return _can_escalate(chunks) and (out.get("aborted") or "not sure" in out["text"].lower())
+
+def _predict_escalate(chunks: List[Dict]) -> bool:
+    """retrieval ไม่ค่อยมั่นใจ (แต่ยังผ่านเกณฑ์ escalate) → มีแนวโน้มว่า small model จะตอบ not sure"""
+    sim = _cosine(chunks[0]) if chunks else None
+    return SPECULATIVE_ESCALATE and _can_escalate(chunks) and sim is not None and sim < SPECULATE_BELOW
+
+def _trace_escalate(out: Dict, chunks: List[Dict], escalate: bool, speculative: bool) -> None:
+    tracing.event("escalate", escalate=escalate, speculative=speculative, top_score=round(_top_score(chunks), 4),
+                  aborted=bool(out.get("aborted")), allowed=_can_escalate(chunks))
+
+def _finish(out: Dict, out2: Optional[Dict], used: int, prefer_escalated: bool = False) -> Dict:
+    """
+    เลือกคำตอบ (escalate แล้วยาวกว่า → ใช้ของ smart model + รวม usage)
+    small model ที่ถูก abort กลาง stream / error มีแค่ข้อความครึ่ง ๆ หรือข้อความ error → ใช้ของ smart model เสมอ
+    prefer_escalated → ใช้ของ smart model โดยไม่เทียบความยาว (ผู้ใช้เห็น stream ของมันไปแล้ว)
+    """
+    if out2 is not None and (prefer_escalated or out.get("aborted") or (out.get("error") and not out2.get("error"))
+                             or len(out2["text"]) > len(out["text"])):
+        u1, u2 = out["usage"], out2["usage"]
+        out2["usage"] = {
+            "prompt_tokens": u1["prompt_tokens"] + u2["prompt_tokens"],
+            "completion_tokens": u1["completion_tokens"] + u2["completion_tokens"],
+            "total_tokens": u1["total_tokens"] + u2["total_tokens"],
+        }
+        if out.get("usage_estimated"):
+            out2["usage_estimated"] = True
+        out2["escalated_from"] = out["model_used"]
+        out = out2
     out["ctx_used"] = used
     out["chunks_used"] = used
-    return out
\ No newline at end of file
+    return out
+
+# ---- semantic answer cache ----
+_answers = Lazy("llm.answer_cache", AnswerCache)
+_ZERO_USAGE = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+def _cache_key(user_q: str, ctx: str):
+    """(normalized q, query vector, hash ของ context, index version) — vector มาจาก embedding cache ของ retrieval"""
+    try:
+        import retrieval
+        return (retrieval.normalize_query(user_q), retrieval.embed_queries([user_q])[0],
+                ctx_hash(ctx), retrieval.index_version())
+    except Exception:
+        return " ".join(user_q.lower().split()), None, ctx_hash(ctx), ""
+
+def _cache_get(key, used: int) -> Optional[Dict]:
+    t0 = time.time()
+    try:
+        hit = _answers.get().get(*key)
+    except Exception:
+        return None
+    if hit is None:
+        return None
+    hit.update(usage=dict(_ZERO_USAGE), latency=time.time() - t0, cache_hit=True,
+               ctx_used=used, chunks_used=used)
+    return hit
+
+def _cache_put(key, out: Dict) -> None:
+    # ไม่ cache error / คำตอบที่ถูกตัดกลางทาง
+    if out.get("error") or out.get("aborted"):
+        return
+    keep = {k: v for k, v in out.items() if k not in ("latency", "ttft", "cache_hit", "speculative_discarded")}
+    try:
+        _answers.get().put(key[0], key[1], key[2], key[3], keep)
+    except Exception:
+        pass
+
+def cache_stats() -> Dict:
+    out = _answers.get().stats() if _answers.loaded() else {}
+    return {**out, "coalesced": _sf.stats()["coalesced"] + _asf.stats()["coalesced"]}
+
+_spec_pool = Lazy("llm.spec_pool", lambda: ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm-spec"))
+
+def _first_call(user_q: str, ctx: str, chunks: List[Dict]) -> Dict:
+    # stream เฉพาะกรณีที่ escalate ได้จริง (ไม่งั้นตัดทิ้งไปก็ไม่มีอะไรมาแทน)
+    if STREAM_ESCALATE and _can_escalate(chunks):
+        return _stream_call(MODEL, user_q, ctx)
+    return _call(MODEL, user_q, ctx)
+
+# คำถามเดียวกัน + context เดียวกันที่เข้ามาพร้อมกัน → เรียก Mistral ครั้งเดียว
+_sf = SingleFlight("answer")
+_asf = AsyncSingleFlight("answer_async")
+
+def _flight_key(user_q: str, ctx: str) -> tuple:
+    return (" ".join(user_q.lower().split()), ctx_hash(ctx))
+
+def _coalesced(out: Dict) -> Dict:
+    return dict(out, usage=dict(_ZERO_USAGE), coalesced=True)   # token จ่ายไปแล้วโดย leader
+
+def _pack_traced(chunks: List[Dict]) -> Tuple[str, int, Dict[str, Any]]:
+    with tracing.span("pack", chunks=len(chunks)) as sp:
+        ctx, used, pack = _pack_context(chunks)
+        sp.set(used=used, **pack)
+    return ctx, used, pack
+
+@tracing.traced("answer_with_llm", _llm_attrs)
+def answer_with_llm(user_q: str, chunks: List[Dict]) -> Dict:
+    ctx, used, pack = _pack_traced(chunks)
+    out, shared = _sf.do(_flight_key(user_q, ctx), lambda: _answer_cached(user_q, ctx, used, pack, chunks))
+    return _coalesced(out) if shared else out
+
+def _answer_cached(user_q: str, ctx: str, used: int, pack: Dict, chunks: List[Dict]) -> Dict:
+    key = _cache_key(user_q, ctx) if ANSWER_CACHE and used else None
+    if key is not None:
+        with tracing.span("answer_cache") as sp:
+            hit = _cache_get(key, used)
+            sp.set(hit=hit is not None)
+        if hit is not None:
+            return hit
+
+    out = _answer(user_q, ctx, used, chunks)
+    out["cache_hit"] = False
+    out.update(pack)
+    if key is not None:
+        _cache_put(key, out)
+    return out
+
+def _answer(user_q: str, ctx: str, used: int, chunks: List[Dict]) -> Dict:
+    spec = _spec_pool.get().submit(tracing.bind(_call), SMART_MODEL, user_q, ctx) if _predict_escalate(chunks) else None
+
+    out = _first_call(user_q, ctx, chunks)
+    out2 = None
+    escalate = _need_escalate(out, chunks)
+    _trace_escalate(out, chunks, escalate, spec is not None)
+    if escalate:
+        out2 = spec.result() if spec is not None else _call(SMART_MODEL, user_q, ctx)
+        if spec is not None:
+            out2["speculative"] = True
+    elif spec is not None:
+        out["speculative_discarded"] = True   # smart model ยังรัน/คิด token อยู่ แต่ไม่ได้ใช้
+    return _finish(out, out2, used)
+
+@tracing.traced("answer_with_llm", _llm_attrs)
+async def answer_with_llm_async(user_q: str, chunks: List[Dict]) -> Dict:
+    """async version ของ answer_with_llm (ผลลัพธ์ shape เดียวกัน)"""
+    ctx, used, pack = _pack_traced(chunks)
+    out, shared = await _asf.do(_flight_key(user_q, ctx),
+                                lambda: _answer_cached_async(user_q, ctx, used, pack, chunks))
+    return _coalesced(out) if shared else out
+
+async def _answer_cached_async(user_q: str, ctx: str, used: int, pack: Dict, chunks: List[Dict]) -> Dict:
+    # encode / sqlite เป็น blocking → ย้ายไป thread ไม่ให้ block event loop
+    key = await asyncio.to_thread(_cache_key, user_q, ctx) if ANSWER_CACHE and used else None
+    if key is not None:
+        with tracing.span("answer_cache") as sp:
+            hit = await asyncio.to_thread(_cache_get, key, used)
+            sp.set(hit=hit is not None)
+        if hit is not None:
+            return hit
+
+    out = await _answer_async(user_q, ctx, used, chunks)
+    out["cache_hit"] = False
+    out.update(pack)
+    if key is not None:
+        await asyncio.to_thread(_cache_put, key, out)
+    return out
+
+async def _answer_async(user_q: str, ctx: str, used: int, chunks: List[Dict]) -> Dict:
+    spec = asyncio.ensure_future(_call_async(SMART_MODEL, user_q, ctx)) if _predict_escalate(chunks) else None
+    try:
+        if STREAM_ESCALATE and _can_escalate(chunks):
+            out = await _stream_call_async(MODEL, user_q, ctx)
+        else:
+            out = await _call_async(MODEL, user_q, ctx)
+        out2 = None
+        escalate = _need_escalate(out, chunks)
+        _trace_escalate(out, chunks, escalate, spec is not None)
+        if escalate:
+            out2 = await spec if spec is not None else await _call_async(SMART_MODEL, user_q, ctx)
+            if spec is not None:
+                out2["speculative"] = True
+        elif spec is not None:
+            spec.cancel()   # async ยกเลิกได้จริง
+            out["speculative_discarded"] = True
+        return _finish(out, out2, used)
+    except BaseException:
+        if spec is not None:
+            spec.cancel()
+        raise
+
+
+# ---- extractive fast path ----
+_exact = ExactIndex(INDEX_PATH)
+_route_counts = {"exact": 0, "near_exact": 0, "llm": 0}
+
+def _ensure_exact() -> None:
+    """exact.json ของ index version เดียวกับที่ retrieval ใช้อยู่ (directory เปลี่ยนทุก build)"""
+    try:
+        import retrieval
+        _exact.ensure(retrieval.index_version(), str(retrieval.index_dir()))
+    except Exception:
+        _exact.ensure("")
+
+def _extractive_result(question: str, answer: str, kind: str, t0: float) -> Dict:
+    return {
+        "text": f"{answer} [Q1]",
+        "usage": dict(_ZERO_USAGE),
+        "latency": time.time() - t0,
+        "model_used": "extractive",
+        "extractive": kind,
+        "citations": [question],
+        "ctx_used": 1,
+        "chunks_used": 1,
+    }
+
+def exact_answer(user_q: str) -> Optional[Dict]:
+    """
+    lookup คำถาม (normalize แล้ว) ใน exact index — เรียกได้ก่อน retrieve() เลย
+    คืน None ถ้าไม่ตรงกับคำถามใน FAQ
+    """
+    if not EXTRACTIVE:
+        return None
+    t0 = time.time()
+    _ensure_exact()
+    hit = _exact.lookup(user_q)
+    if hit is None:
+        return None
+    _route_counts["exact"] += 1
+    return _extractive_result(hit["question"], hit["answer"], "exact", t0)
+
+def extractive_answer(user_q: str, chunks: List[Dict]) -> Optional[Dict]:
+    """exact match ก่อน แล้วค่อยดู score/margin ของ chunk อันดับ 1 (near-exact)"""
+    if not EXTRACTIVE:
+        return None
+    out = exact_answer(user_q)
+    if out is not None or not chunks:
+        return out
+
+    t0 = time.time()
+    ranked = sorted(chunks, key=lambda x: x.get("score", 0), reverse=True)
+    if _cosine(ranked[0]) is None:
+        return None   # near-exact ต้องใช้ cosine; BM25 (fast path) ไม่มี
+    top = float(ranked[0].get("score", 0) or 0)
+    second = float(ranked[1].get("score", 0) or 0) if len(ranked) > 1 else 0.0
+    if top < EXTRACTIVE_MIN_SIM or top - second < EXTRACTIVE_MARGIN:
+        return None
+    q = _clean(ranked[0].get("meta", {}).get("question", ""))
+    _route_counts["near_exact"] += 1
+    return _extractive_result(q, split_doc(ranked[0].get("text", "")), "near_exact", t0)
+
+@tracing.traced("answer", _llm_attrs)
+def answer(user_q: str, chunks: List[Dict]) -> Dict:
+    """entry point: extractive ถ้าทำได้ ไม่งั้น answer_with_llm"""
+    out = extractive_answer(user_q, chunks)
+    if out is not None:
+        return out
+    _route_counts["llm"] += 1
+    return answer_with_llm(user_q, chunks)
+
+@tracing.traced("answer", _llm_attrs)
+async def answer_async(user_q: str, chunks: List[Dict]) -> Dict:
+    out = extractive_answer(user_q, chunks)
+    if out is not None:
+        return out
+    _route_counts["llm"] += 1
+    return await answer_with_llm_async(user_q, chunks)
+
+# ---- streaming entry point (UI) ----
+_CTX_Q_RE = re.compile(r"^\[Q(\d+)\] (.*)$", re.M)
+
+def ctx_sources(ctx: str) -> List[str]:
+    """คำถามของแต่ละ block ใน context ตามลำดับ [Q1], [Q2], ... (ใช้ทำลิงก์ citation)"""
+    return [q for _, q in _CTX_Q_RE.findall(ctx)]
+
+@tracing.traced("answer_stream", _llm_attrs)
+def answer_stream(user_q: str, chunks: List[Dict], on_token: Callable[[str, str], None]) -> Dict:
+    """
+    เหมือน answer() แต่ส่ง text ออกทีละชิ้นผ่าน on_token(piece, model) ระหว่างที่ Mistral ยังตอบอยู่
+    - extractive / cache hit → on_token ครั้งเดียวด้วยคำตอบทั้งก้อน
+    - small model ถูก probe: ถ้า refusal ก็ไม่ถูกส่งออก แล้ว stream ของ smart model ตามมา
+      (model ใน on_token เปลี่ยน = ให้ UI ล้างข้อความเดิม)
+    - out["ttft"] = วินาทีจนถึง token แรกที่ส่งให้ on_token, out["sources"] = คำถามของ [Q1], [Q2], ...
+    ไม่ผ่าน single-flight / speculative escalation: แต่ละผู้ใช้ต้องเห็น stream ของตัวเอง
+    """
+    t0 = time.time()
+    first: List[float] = []
+    shown: List[str] = []   # model ของ text ที่ผู้ใช้เห็นล่าสุด
+
+    def emit(piece: str, model: str) -> None:
+        if not first:
+            first.append(time.time() - t0)
+        shown[:] = [model]
+        on_token(piece, model)
+
+    out = extractive_answer(user_q, chunks)
+    if out is not None:
+        emit(out["text"], out["model_used"])
+        return dict(out, ttft=first[0], sources=out["citations"])
+    _route_counts["llm"] += 1
+
+    ctx, used, pack = _pack_traced(chunks)
+    key = _cache_key(user_q, ctx) if ANSWER_CACHE and used else None
+    if key is not None:
+        with tracing.span("answer_cache") as sp:
+            hit = _cache_get(key, used)
+            sp.set(hit=hit is not None)
+        if hit is not None:
+            emit(hit["text"], hit["model_used"])
+            return dict(hit, ttft=first[0], sources=ctx_sources(ctx))
+
+    can = STREAM_ESCALATE and _can_escalate(chunks)
+    out = _stream_call(MODEL, user_q, ctx, probe=can, on_token=emit)
+    out2 = None
+    escalate = _need_escalate(out, chunks)
+    _trace_escalate(out, chunks, escalate, False)
+    if escalate:
+        out2 = _stream_call(SMART_MODEL, user_q, ctx, probe=False, on_token=emit)
+    # UI ล้างข้อความเดิมเมื่อ smart model เริ่ม stream → คำตอบที่คืน (และเก็บ cache / history) ต้องเป็นตัวนั้น
+    # แม้จะสั้นกว่าของ small model ที่ "not sure" หลังพ้น probe window
+    out = _finish(out, out2, used, prefer_escalated=out2 is not None and shown == [out2["model_used"]])
+    out.update(pack, cache_hit=False, ttft=first[0] if first else None, sources=ctx_sources(ctx))
+    if key is not None:
+        _cache_put(key, out)
+    return out
+
+def extractive_report() -> Dict[str, Any]:
+    """สัดส่วน traffic ที่ตอบแบบ extractive (ผ่าน answer()/answer_async())"""
+    total = sum(_route_counts.values())
+    share = lambda n: (n / total) if total else 0.0
+    return {
+        **_route_counts,
+        "total": total,
+        "extractive_share": share(_route_counts["exact"] + _route_counts["near_exact"]),
+        "exact_share": share(_route_counts["exact"]),
+        "near_exact_share": share(_route_counts["near_exact"]),
+    }
+
+
+record("import:llm", time.perf_counter() - _T_IMPORT)
@@ -0,0 +1,152 @@
+# loadtest.py  (end-to-end load test: retrieve() + answer_with_llm() against fake_mistral)
+#   python loadtest.py [--scenario all] [--users 16] [--requests 20] [--async] [--with-caches]
+# ไม่ต้องใช้ network: Mistral ถูกแทนด้วย fake_mistral.py ที่รันใน process เดียวกัน
+import sys, json, time, random, asyncio, argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+import fake_mistral
+import tracing
+from fake_mistral import FakeConfig
+from bench_retrieval import build_queryset, pct, CSV_PATH
+
+SCENARIOS: Dict[str, FakeConfig] = {
+    "baseline": FakeConfig(latency_ms=400, latency_sigma=0.4),
+    "slow-upstream": FakeConfig(latency_ms=1500, latency_sigma=0.8),
+    "flaky-upstream": FakeConfig(latency_ms=400, latency_sigma=0.5, error_rate=0.15),
+    "refusals": FakeConfig(latency_ms=400, latency_sigma=0.4, refusal_rate=0.3),
+}
+
+
+def _setup(url: str, with_caches: bool):
+    """ชี้ llm ไปที่ fake server + รีเซ็ต state ที่ค้างจาก scenario ก่อน"""
+    import llm, retrieval
+    from resilience import Resilient
+    llm.MISTRAL_SERVER_URL = url
+    llm.MISTRAL_API_KEY = llm.MISTRAL_API_KEY or "fake-key"
+    llm._client.reset()
+    llm._upstream = Resilient("mistral")
+    llm.ANSWER_CACHE = with_caches
+    retrieval._qcache.maxsize = retrieval.QUERY_CACHE_SIZE if with_caches else 0
+    retrieval._qcache.clear()
+    return llm, retrieval
+
+
+@tracing.traced("loadtest")
+def _one(llm, retrieval, q: str) -> Dict:
+    t0 = time.perf_counter()
+    chunks = retrieval.retrieve(q, k=5)
+    t1 = time.perf_counter()
+    out = llm.answer_with_llm(q, chunks)
+    t2 = time.perf_counter()
+    return {"total": t2 - t0, "retrieve": t1 - t0, "llm": t2 - t1, "out": out}
+
+
+@tracing.traced("loadtest")
+async def _one_async(llm, retrieval, q: str) -> Dict:
+    t0 = time.perf_counter()
+    chunks = await asyncio.to_thread(retrieval.retrieve, q, 5)
+    t1 = time.perf_counter()
+    out = await llm.answer_with_llm_async(q, chunks)
+    t2 = time.perf_counter()
+    return {"total": t2 - t0, "retrieve": t1 - t0, "llm": t2 - t1, "out": out}
+
+
+def _summarize(name: str, cfg: FakeConfig, rows: List[Dict], wall: float, users: int, mode: str) -> Dict:
+    def ms(key):
+        xs = [r[key] * 1000 for r in rows]
+        return {"p50_ms": pct(xs, 50), "p95_ms": pct(xs, 95), "p99_ms": pct(xs, 99),
+                "mean_ms": float(np.mean(xs)) if xs else 0.0}
+
+    outs = [r["out"] for r in rows]
+    tokens = [o.get("usage", {}).get("total_tokens", 0) for o in outs]
+    n = len(rows) or 1
+    return {
+        "scenario": name,
+        "mode": mode,
+        "users": users,
+        "requests": len(rows),
+        "wall_s": wall,
+        "throughput_rps": len(rows) / wall if wall else 0.0,
+        "latency": ms("total"),
+        "retrieve": ms("retrieve"),
+        "llm": ms("llm"),
+        "escalation_rate": sum(1 for o in outs if o.get("escalated_from")) / n,
+        "error_rate": sum(1 for o in outs if o.get("error")) / n,
+        "cache_hit_rate": sum(1 for o in outs if o.get("cache_hit")) / n,
+        "coalesced_rate": sum(1 for o in outs if o.get("coalesced")) / n,
+        "tokens_total": int(sum(tokens)),
+        "tokens_per_request": float(np.mean(tokens)) if tokens else 0.0,
+        "models": {m: sum(1 for o in outs if o.get("model_used") == m) for m in {o.get("model_used") for o in outs}},
+        "fake_config": cfg.__dict__,
+    }
+
+
+def run_scenario(name: str, cfg: FakeConfig, queries: List[str], users: int, per_user: int,
+                 use_async: bool, with_caches: bool) -> Dict:
+    server, url = fake_mistral.start_server(cfg)
+    try:
+        llm, retrieval = _setup(url, with_caches)
+        retrieval.warmup()
+        rng = random.Random(42)
+        work = [[rng.choice(queries) for _ in range(per_user)] for _ in range(users)]
+
+        t0 = time.perf_counter()
+        if use_async:
+            async def user(qs):
+                return [await _one_async(llm, retrieval, q) for q in qs]
+            async def all_users():
+                return await asyncio.gather(*(user(qs) for qs in work))
+            rows = [r for u in asyncio.run(all_users()) for r in u]
+        else:
+            with ThreadPoolExecutor(max_workers=users, thread_name_prefix="user") as pool:
+                rows = [r for u in pool.map(lambda qs: [_one(llm, retrieval, q) for q in qs], work) for r in u]
+        wall = time.perf_counter() - t0
+
+        report = _summarize(name, cfg, rows, wall, users, "async" if use_async else "threads")
+        report["upstream"] = llm.upstream_stats()
+        tracing.flush()
+        report["tracing"] = tracing.stats()
+        return report
+    finally:
+        server.shutdown()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test retrieve() + answer_with_llm() against a local Mistral stub")
+    ap.add_argument("--scenario", default="all", help=f"one of {sorted(SCENARIOS)} or 'all'")
+    ap.add_argument("--users", type=int, default=16)
+    ap.add_argument("--requests", type=int, default=20, help="requests per user")
+    ap.add_argument("--async", dest="use_async", action="store_true", help="use answer_with_llm_async")
+    ap.add_argument("--with-caches", action="store_true", help="keep query / answer caches on")
+    ap.add_argument("--out", default="", help="JSON output (default: bench/loadtest-<timestamp>.json)")
+    args = ap.parse_args()
+
+    names = sorted(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    if any(n not in SCENARIOS for n in names):
+        sys.exit(f"Unknown scenario {args.scenario!r}; choose from {sorted(SCENARIOS)} or 'all'")
+
+    queries = [x["query"] for x in build_queryset(CSV_PATH)]
+    results = []
+    for name in names:
+        print(f"🚦 {name}: {args.users} users x {args.requests} requests ({'async' if args.use_async else 'threads'})")
+        r = run_scenario(name, SCENARIOS[name], queries, args.users, args.requests,
+                         args.use_async, args.with_caches)
+        lat = r["latency"]
+        print(f"   {r['throughput_rps']:.1f} req/s | p50 {lat['p50_ms']:.0f} ms | p95 {lat['p95_ms']:.0f} | "
+              f"p99 {lat['p99_ms']:.0f} | escalated {r['escalation_rate']:.1%} | errors {r['error_rate']:.1%} | "
+              f"{r['tokens_per_request']:.0f} tok/req")
+        results.append(r)
+
+    out = Path(args.out or f"bench/loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results},
+                              indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"💾 Saved {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# np_index.py  (exact / int8-quantized cosine search on memory-mapped matrices)
+from __future__ import annotations
+import os, json, threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+VECTORS_FILE = "vectors.npy"          # float32 (N, dim), row-normalized, C-contiguous
+META_FILE    = "vectors.meta.json"    # ids / documents / metadatas เรียงตรงกับแถวของ matrix
+QUANT_FILE   = "vectors.q8.npy"       # int8 (N, d) codes
+QUANT_PARAMS = "vectors.q8.npz"       # calibration: scale / offset (+ PCA mean / components)
+
+# build side
+QUANTIZE = os.getenv("QUANTIZE", "")                 # "" | int8
+PCA_DIM  = int(os.getenv("PCA_DIM", 0))              # 0 = ไม่ลดมิติ
+EXPORT_PAGE = int(os.getenv("EXPORT_PAGE", 2048))    # แถวต่อ coll.get ตอน export (RAM ไม่โตตาม N)
+QUANT_SAMPLE = int(os.getenv("QUANT_SAMPLE", 20000)) # แถวที่สุ่มมา fit PCA (mean / components) ตอน quantize
+# query side
+QUANT_SEARCH   = os.getenv("QUANT_SEARCH", "1") == "1"   # ใช้ int8 ถ้ามีไฟล์
+RESCORE        = os.getenv("RESCORE", "1") == "1"        # re-score candidate ด้วย float32
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", 4))     # candidate = k * factor
+QUANT_BLOCK    = int(os.getenv("QUANT_BLOCK", 512))      # แถวของ codes ต่อรอบ int8 → float32 (buffer อยู่ใน cache)
+
+
+def _l2_normalize(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+def _atomic_write_bytes(path: Path, writer) -> None:
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with tmp.open("wb") as f:
+        writer(f)
+    os.replace(tmp, path)
+
+
+def _topk(sims: np.ndarray, k: int) -> np.ndarray:
+    """index ของ top-k ต่อแถว เรียงมาก -> น้อย (argpartition แล้ว sort เฉพาะ k ตัว)"""
+    nq, n = sims.shape
+    k = min(max(1, k), n)
+    if k < n:
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(n), (nq, 1))
+    order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+class Int8Quant:
+    """
+    scalar quantization ต่อมิติ: x ≈ code * scale + offset  (code เป็น int8)
+    ถ้า pca_dim > 0 → project (x - mean) @ components.T ก่อนแล้ว normalize ใหม่
+    score(q, doc) = (q*scale) · code + q · offset  → ไม่ต้อง dequantize ทั้ง matrix
+    codes แปลงเป็น float32 ทีละ block ลง buffer เดิม (ต่อ thread) แทน copy ทั้ง corpus ทุก query:
+    อ่าน RAM 1 byte/ค่า → เร็วกว่า float32 เมื่อ N ใหญ่จน memory-bound
+    """
+
+    def __init__(self, codes: np.ndarray, scale: np.ndarray, offset: np.ndarray,
+                 mean: Optional[np.ndarray] = None, components: Optional[np.ndarray] = None):
+        self.codes = codes
+        self.scale = scale.astype(np.float32)
+        self.offset = offset.astype(np.float32)
+        self.mean = mean
+        self.components = components
+        self._local = threading.local()
+
+    @classmethod
+    def fit(cls, mat: np.ndarray, pca_dim: int = 0, codes_path: Optional[Path] = None,
+            block: int = EXPORT_PAGE, sample: int = QUANT_SAMPLE) -> "Int8Quant":
+        """
+        mat อาจเป็น mmap: อ่านทีละ block แถว ไม่ถือทั้ง matrix เป็น float32 ใน RAM
+        - PCA fit จากแถวที่สุ่มมาไม่เกิน sample แถว
+        - lo / hi ต่อมิติ: min / max แบบ streaming ทุกแถว (2 รอบ: หา range → encode)
+        codes_path → เขียน codes ลง int8 memmap ไฟล์นั้น (save() ย้ายไฟล์ไปแทน copy)
+        """
+        n, dim = mat.shape
+        block = max(1, block)
+        mean = components = None
+        if 0 < pca_dim < dim:
+            rows = slice(None)
+            if n > sample > 0:
+                rows = np.sort(np.random.default_rng(0).choice(n, sample, replace=False))
+            x = np.asarray(mat[rows], dtype=np.float32)
+            mean = x.mean(axis=0)
+            _, _, vt = np.linalg.svd(x - mean, full_matrices=False)
+            components = np.ascontiguousarray(vt[:pca_dim], dtype=np.float32)
+            del x
+
+        def rows_at(start: int) -> np.ndarray:
+            x = np.asarray(mat[start:start + block], dtype=np.float32)
+            return x if components is None else _l2_normalize((x - mean) @ components.T)
+
+        d = components.shape[0] if components is not None else dim
+        lo = np.full(d, np.inf, dtype=np.float32)
+        hi = np.full(d, -np.inf, dtype=np.float32)
+        for start in range(0, n, block):
+            x = rows_at(start)
+            np.minimum(lo, x.min(axis=0), out=lo)
+            np.maximum(hi, x.max(axis=0), out=hi)
+        scale = (hi - lo) / 255.0
+        scale[scale == 0] = 1e-12
+
+        if codes_path is not None:
+            codes = np.lib.format.open_memmap(codes_path, mode="w+", dtype=np.int8, shape=(n, d))
+        else:
+            codes = np.empty((n, d), dtype=np.int8)
+        for start in range(0, n, block):
+            x = rows_at(start)
+            codes[start:start + len(x)] = np.clip(np.round((x - lo) / scale) - 128, -128, 127)
+        offset = lo + 128.0 * scale
+        return cls(codes, scale, offset, mean, components)
+
+    def project(self, q: np.ndarray) -> np.ndarray:
+        q = np.asarray(q, dtype=np.float32)
+        if self.components is not None:
+            q = _l2_normalize((q - self.mean) @ self.components.T)
+        return q
+
+    def _buffer(self) -> np.ndarray:
+        buf = getattr(self._local, "buf", None)
+        if buf is None:
+            buf = self._local.buf = np.empty((QUANT_BLOCK, self.codes.shape[1]), dtype=np.float32)
+        return buf
+
+    def scores(self, q: np.ndarray) -> np.ndarray:
+        qp = self.project(q)
+        qs = qp * self.scale
+        n = self.codes.shape[0]
+        out = np.empty((qs.shape[0], n), dtype=np.float32)
+        buf = self._buffer()
+        for start in range(0, n, QUANT_BLOCK):
+            block = self.codes[start:start + QUANT_BLOCK]
+            b = buf[:block.shape[0]]
+            np.copyto(b, block, casting="unsafe")
+            np.matmul(qs, b.T, out=out[:, start:start + block.shape[0]])
+        out += (qp @ self.offset)[:, None]
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        n = self.codes.nbytes + self.scale.nbytes + self.offset.nbytes
+        if self.components is not None:
+            n += self.components.nbytes + self.mean.nbytes
+        return n
+
+    def save(self, out_dir: Path) -> None:
+        params = {"scale": self.scale, "offset": self.offset}
+        if self.components is not None:
+            params.update(mean=self.mean, components=self.components)
+        src = getattr(self.codes, "filename", None)   # codes ที่ fit ลง memmap แล้ว → flush แล้วย้ายไฟล์
+        if src is not None and Path(src).parent == out_dir.resolve() and Path(src).name != QUANT_FILE:
+            self.codes.flush()
+            os.replace(src, out_dir / QUANT_FILE)
+        else:
+            _atomic_write_bytes(out_dir / QUANT_FILE, lambda f: np.save(f, self.codes))
+        _atomic_write_bytes(out_dir / QUANT_PARAMS, lambda f: np.savez(f, **params))
+
+    @classmethod
+    def load(cls, in_dir: Path) -> Optional["Int8Quant"]:
+        codes_path, params_path = in_dir / QUANT_FILE, in_dir / QUANT_PARAMS
+        if not codes_path.exists() or not params_path.exists():
+            return None
+        codes = np.load(codes_path, mmap_mode="r")
+        with np.load(params_path) as p:
+            return cls(codes, p["scale"], p["offset"],
+                       p["mean"] if "mean" in p else None,
+                       p["components"] if "components" in p else None)
+
+
+def export_collection(coll, index_path: str, version: str = "",
+                      quantize: str = QUANTIZE, pca_dim: int = PCA_DIM) -> int:
+    """
+    dump ทั้ง collection ออกเป็น .npy + sidecar json (เรียกจาก build_index หลัง upsert เสร็จ)
+    quantize="int8" → เขียน vectors.q8.npy + calibration ด้วย
+    คืนจำนวนแถว
+    """
+    ids: List[str] = []
+    for offset in range(0, coll.count(), EXPORT_PAGE):
+        ids.extend(coll.get(include=[], limit=EXPORT_PAGE, offset=offset).get("ids") or [])
+    if not ids:
+        return 0
+    ids.sort()   # เรียงตาม id ให้ไฟล์ deterministic
+
+    # ดึงทีละหน้าตามลำดับ id แล้วเขียนลง .npy แบบ memmap ตรง ๆ (ไม่ถือทั้ง matrix เป็น list ใน RAM)
+    out_dir = Path(index_path)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp = out_dir / f"{VECTORS_FILE}.{os.getpid()}.tmp"
+    mat = None
+    documents: List[str] = []
+    metadatas: List[Dict] = []
+    for start in range(0, len(ids), EXPORT_PAGE):
+        page_ids = ids[start:start + EXPORT_PAGE]
+        got = coll.get(ids=page_ids, include=["embeddings", "documents", "metadatas"])
+        pos = {_id: i for i, _id in enumerate(got["ids"])}
+        order = [pos[_id] for _id in page_ids]
+        emb = np.asarray(got["embeddings"], dtype=np.float32)[order]
+        if mat is None:
+            mat = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(len(ids), emb.shape[1]))
+        mat[start:start + len(page_ids)] = _l2_normalize(emb)
+        documents.extend(got["documents"][i] for i in order)
+        metadatas.extend(got["metadatas"][i] or {} for i in order)
+    dim = int(mat.shape[1])
+    mat.flush()
+    del mat
+    os.replace(tmp, out_dir / VECTORS_FILE)
+
+    meta = {
+        "version": version,
+        "count": len(ids),
+        "dim": dim,
+        "quantize": quantize or None,
+        "pca_dim": pca_dim if quantize else 0,
+        "ids": ids,
+        "documents": documents,
+        "metadatas": metadatas,
+    }
+    if quantize == "int8":
+        Int8Quant.fit(np.load(out_dir / VECTORS_FILE, mmap_mode="r"), pca_dim,
+                      codes_path=out_dir / f"{QUANT_FILE}.{os.getpid()}.tmp").save(out_dir)
+    elif quantize:
+        raise ValueError(f"Unsupported QUANTIZE: {quantize!r} (expected 'int8')")
+    else:
+        for name in (QUANT_FILE, QUANT_PARAMS):
+            (out_dir / name).unlink(missing_ok=True)   # ไม่ให้ของเก่าค้างไม่ตรงกับ matrix ใหม่
+    _atomic_write_bytes(
+        out_dir / META_FILE,
+        lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode("utf-8")),
+    )
+    return len(ids)
+
+
+class NumpyIndex:
+    """
+    backend แบบ brute-force: sims = Q @ M.T แล้ว argpartition เอา top-k
+    matrix เปิดแบบ mmap_mode="r" → หลาย process (Streamlit / worker) แชร์ page cache เดียวกัน
+    ถ้ามี int8 codes → score กับ codes ก่อน แล้ว (option) re-score candidate ด้วย float32
+    vectors.npy (float32) ยังอยู่บน disk โดยตั้งใจ: rescore / cosine ของ lexical hit / related graph / quantize ใหม่
+    แต่เป็น mmap → ตอน quantized search มีแค่แถว candidate ที่ถูก page เข้า RAM (resident ≈ codes + candidate)
+    โหลดใหม่เองเมื่อ index version เปลี่ยน
+    """
+
+    def __init__(self, index_path: str, quant_search: bool = QUANT_SEARCH):
+        self.dir = Path(index_path)
+        self.quant_search = quant_search
+        self._lock = threading.Lock()
+        self._version = None
+        self._mat: np.ndarray = np.zeros((0, 0), dtype=np.float32)
+        self._quant: Optional[Int8Quant] = None
+        self._docs: List[str] = []
+        self._metas: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+
+    def _load(self) -> None:
+        vec_path, meta_path = self.dir / VECTORS_FILE, self.dir / META_FILE
+        if not vec_path.exists() or not meta_path.exists():
+            self._mat, self._quant, self._docs, self._metas = np.zeros((0, 0), dtype=np.float32), None, [], []
+            self._rows = {}
+            return
+        mat = np.load(vec_path, mmap_mode="r")
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if mat.shape[0] != meta.get("count"):
+            # build กำลังเขียนไฟล์อยู่ → ใช้ของเดิมไปก่อน รอบหน้าค่อยโหลดใหม่
+            raise RuntimeError("vectors.npy / meta out of sync")
+        quant = Int8Quant.load(self.dir) if (self.quant_search and meta.get("quantize")) else None
+        if quant is not None and quant.codes.shape[0] != mat.shape[0]:
+            quant = None
+        self._mat, self._quant, self._docs, self._metas = mat, quant, meta["documents"], meta["metadatas"]
+        self._rows = {_id: r for r, _id in enumerate(meta.get("ids") or [])}
+
+    def ensure(self, version: str) -> None:
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            try:
+                self._load()
+                self._version = version
+            except Exception:
+                pass
+
+    def count(self) -> int:
+        return int(self._mat.shape[0])
+
+    def similarity(self, q: np.ndarray, ids: List[str]) -> List[Optional[float]]:
+        """cosine ของ query vector (dim,) กับ document ตาม id (อ่านเฉพาะแถวนั้นจาก mmap); ไม่มีใน index → None"""
+        mat, rows = self._mat, self._rows
+        if not rows:
+            return [None] * len(ids)
+        q = _l2_normalize(np.asarray(q, dtype=np.float32).reshape(1, -1))[0]
+        found = [rows.get(_id) for _id in ids]
+        idx = [r for r in found if r is not None]
+        sims = iter((mat[idx] @ q).tolist() if idx else [])
+        return [None if r is None else float(next(sims)) for r in found]
+
+    def search(self, qv: np.ndarray, k: int) -> Tuple[List[List[str]], List[List[Dict]], List[List[float]]]:
+        """
+        qv: (nq, dim) float32 → คืน (documents, metadatas, distances) รูปแบบเดียวกับ Chroma query
+        distance = 1 - cosine similarity (เหมือน hnsw:space=cosine)
+        """
+        mat, quant, docs, metas = self._mat, self._quant, self._docs, self._metas   # snapshot กัน reload กลางทาง
+        n = mat.shape[0]
+        nq = qv.shape[0]
+        if n == 0 or nq == 0:
+            return [[] for _ in range(nq)], [[] for _ in range(nq)], [[] for _ in range(nq)]
+
+        q = _l2_normalize(np.asarray(qv, dtype=np.float32))
+        if quant is None:
+            sims = q @ mat.T                                   # (nq, N)
+            top = _topk(sims, k)
+            top_sims = np.take_along_axis(sims, top, axis=1)
+        else:
+            approx = quant.scores(q)
+            if RESCORE:
+                cand = _topk(approx, k * max(1, RESCORE_FACTOR))
+                # อ่านเฉพาะแถว candidate จาก float32 (mmap → page เฉพาะที่แตะ)
+                exact = np.einsum("qd,qcd->qc", q, mat[cand])
+                order = _topk(exact, k)
+                top = np.take_along_axis(cand, order, axis=1)
+                top_sims = np.take_along_axis(exact, order, axis=1)
+            else:
+                top = _topk(approx, k)
+                top_sims = np.take_along_axis(approx, top, axis=1)
+
+        out_docs, out_metas, out_dists = [], [], []
+        for r in range(nq):
+            out_docs.append([docs[i] for i in top[r]])
+            out_metas.append([metas[i] for i in top[r]])
+            out_dists.append([float(1.0 - s) for s in top_sims[r]])
+        return out_docs, out_metas, out_dists
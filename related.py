@@ -0,0 +1,104 @@
+# related.py  (precomputed "Related Questions": top-N nearest neighbours over the exported vectors)
+from __future__ import annotations
+import os, json
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from extractive import norm_question
+from np_index import VECTORS_FILE, META_FILE, _atomic_write_bytes, _topk
+
+RELATED_FILE    = "related.json"
+RELATED_N       = int(os.getenv("RELATED_N", 5))             # neighbour ต่อคำถาม
+RELATED_CROSS   = int(os.getenv("RELATED_CROSS", 2))         # ในนั้นมาจากหมวดอื่นได้สูงสุดกี่อัน (0 = หมวดเดียวกันเท่านั้น)
+RELATED_MIN_SIM = float(os.getenv("RELATED_MIN_SIM", 0.35))
+RELATED_BLOCK   = int(os.getenv("RELATED_BLOCK", 1024))      # แถว × คอลัมน์ต่อรอบของ Q @ M.T (คุม RAM ตอน N ใหญ่)
+
+Graph = Dict[str, List[Tuple[str, float]]]
+
+
+def build_graph(ids: List[str], mat: np.ndarray, categories: List[str], questions: List[str],
+                n: int = RELATED_N, cross: int = RELATED_CROSS, min_sim: float = RELATED_MIN_SIM,
+                rows: Optional[Sequence[int]] = None) -> Graph:
+    """
+    mat: (N, dim) row-normalized (ndarray หรือ mmap) → cosine = dot
+    rows: แถวของ mat ที่ตรงกับ ids (None = ทุกแถว) → อ่านจาก mmap ทีละ block ไม่ copy ทั้ง matrix
+    คำนวณทีละ block แถว × block คอลัมน์ เก็บแค่ candidate ต่อแถวไว้ระหว่างทาง → RAM ไม่โตตาม N
+    เลือกตามลำดับ similarity: หมวดเดียวกันได้ไม่จำกัด, หมวดอื่นไม่เกิน cross อัน, รวมไม่เกิน n
+    คำถามเดียวกัน (แถวซ้ำใน CSV) ไม่นับเป็น neighbour ของกันและกัน
+    """
+    total = len(ids)
+    if total < 2 or n <= 0:
+        return {}
+    norm = [norm_question(q) for q in questions]
+    n_cand = min(total, 4 * (n + cross) + 1)
+    idx = None if rows is None else np.asarray(rows, dtype=np.int64)
+
+    def block(start: int) -> np.ndarray:
+        part = mat[start:start + RELATED_BLOCK] if idx is None else mat[idx[start:start + RELATED_BLOCK]]
+        return np.asarray(part, dtype=np.float32)
+
+    graph: Graph = {}
+    for start in range(0, total, RELATED_BLOCK):
+        q = block(start)
+        cand_j = np.empty((len(q), 0), dtype=np.int64)
+        cand_s = np.empty((len(q), 0), dtype=np.float32)
+        for col in range(0, total, RELATED_BLOCK):
+            sims = q @ block(col).T
+            top = _topk(sims, n_cand)
+            cand_j = np.concatenate([cand_j, top + col], axis=1)
+            cand_s = np.concatenate([cand_s, np.take_along_axis(sims, top, axis=1)], axis=1)
+            best = _topk(cand_s, n_cand)   # เรียงมาก → น้อย
+            cand_j = np.take_along_axis(cand_j, best, axis=1)
+            cand_s = np.take_along_axis(cand_s, best, axis=1)
+        for r in range(len(q)):
+            i = start + r
+            picked: List[Tuple[str, float]] = []
+            n_cross = 0
+            for j, s in zip(cand_j[r].tolist(), cand_s[r].tolist()):
+                if s < min_sim or len(picked) >= n:
+                    break
+                if j == i or norm[j] == norm[i]:
+                    continue
+                if categories[j] != categories[i]:
+                    if n_cross >= cross:
+                        continue
+                    n_cross += 1
+                picked.append((ids[j], round(s, 4)))
+            graph[ids[i]] = picked
+    return graph
+
+
+def write_related(index_path: str, metas_by_id: Dict[str, Dict], version: str = "") -> Graph:
+    """
+    อ่าน vectors.npy ที่ export_collection เพิ่งเขียน แล้วเขียน related.json (atomic)
+    category มาจาก metas ของ CSV รอบนี้ (metadata ใน Chroma ของแถวที่ไม่เปลี่ยนอาจยังไม่มี category)
+    """
+    out_dir = Path(index_path)
+    try:
+        mat = np.load(out_dir / VECTORS_FILE, mmap_mode="r")
+        ids = json.loads((out_dir / META_FILE).read_text(encoding="utf-8"))["ids"]
+    except (OSError, ValueError, KeyError):
+        return {}
+    keep = [r for r, _id in enumerate(ids) if _id in metas_by_id]
+    rows = None if len(keep) == len(ids) else keep   # ปกติครบทุกแถว → อ่าน mmap เป็นช่วงต่อเนื่อง
+    ids = [ids[r] for r in keep]
+    metas = [metas_by_id[_id] for _id in ids]
+    graph = build_graph(ids, mat, [m.get("category", "") for m in metas],
+                        [m.get("question", "") for m in metas], rows=rows)
+
+    data = {"version": version, "n": RELATED_N, "cross": RELATED_CROSS, "min_sim": RELATED_MIN_SIM,
+            "neighbors": {k: [[j, s] for j, s in v] for k, v in graph.items()}}
+    _atomic_write_bytes(out_dir / RELATED_FILE,
+                        lambda f: f.write(json.dumps(data, ensure_ascii=False).encode("utf-8")))
+    return graph
+
+
+def load_related(index_path: str) -> Optional[Graph]:
+    """related.json → {id: [(id, sim), ...]}; ยังไม่เคย build → None"""
+    try:
+        data = json.loads((Path(index_path) / RELATED_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return {k: [(j, s) for j, s in v] for k, v in (data.get("neighbors") or {}).items()}
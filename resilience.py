@@ -0,0 +1,272 @@
+# resilience.py  (retry + hedging + circuit breaker for upstream LLM calls)
+from __future__ import annotations
+import os, time, random, asyncio, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+RETRY_MAX          = int(os.getenv("RETRY_MAX", 2))             # retry เพิ่มได้กี่ครั้ง (รวมเป็น 1 + N)
+RETRY_BASE_S       = float(os.getenv("RETRY_BASE_S", 0.25))
+RETRY_CAP_S        = float(os.getenv("RETRY_CAP_S", 4.0))
+HEDGE              = os.getenv("HEDGE", "0") == "1"
+HEDGE_PCT          = float(os.getenv("HEDGE_PCT", 95))          # ยิงซ้ำเมื่อช้ากว่า p95 ของที่ผ่านมา
+HEDGE_MIN_SAMPLES  = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+BREAKER_FAILURES   = int(os.getenv("BREAKER_FAILURES", 5))      # fail ติดกันกี่ครั้งถึงเปิดวงจร
+BREAKER_COOLDOWN_S = float(os.getenv("BREAKER_COOLDOWN_S", 30))
+
+_RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RuntimeError):
+    """upstream ถูกมองว่าล่มอยู่ → fail fast ไม่ยิงเพิ่ม"""
+
+
+def is_retryable(e: BaseException) -> bool:
+    """timeout / connection error / HTTP 429, 5xx (mistralai SDKError มี status_code)"""
+    if isinstance(e, CircuitOpenError):
+        return False
+    if isinstance(e, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    if status is not None:
+        try:
+            return int(status) in _RETRYABLE_STATUS
+        except (TypeError, ValueError):
+            return False
+    name = type(e).__name__
+    return "Timeout" in name or "Connect" in name   # httpx.ReadTimeout, httpx.ConnectError, ...
+
+
+class CircuitBreaker:
+    """
+    closed → (fail ติดกัน BREAKER_FAILURES ครั้ง) → open → (ครบ cooldown) → half-open
+    half-open ปล่อยให้ลอง 1 request: สำเร็จ → closed, พัง → open ใหม่
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown_s: float = BREAKER_COOLDOWN_S):
+        self.failures = failures
+        self.cooldown_s = cooldown_s
+        self.state = "closed"
+        self.opened = 0
+        self.rejected = 0
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe = False
+        self._lock = threading.Lock()
+
+    def before(self) -> None:
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.cooldown_s:
+                    self.rejected += 1
+                    raise CircuitOpenError("Upstream circuit open; failing fast")
+                self.state = "half-open"
+                self._probe = False
+            if self.state == "half-open":
+                if self._probe:
+                    self.rejected += 1
+                    raise CircuitOpenError("Upstream circuit half-open; probe in flight")
+                self._probe = True
+
+    def success(self) -> None:
+        with self._lock:
+            self._consecutive = 0
+            self.state = "closed"
+            self._probe = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._consecutive += 1
+            if self.state == "half-open" or self._consecutive >= self.failures:
+                if self.state != "open":
+                    self.opened += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe = False
+
+
+class Resilient:
+    """
+    ห่อการเรียก upstream: circuit breaker → (hedge) → retry แบบ exponential backoff + full jitter
+    ทั้งหมดอยู่ภายใต้ deadline เดียว (ไม่ retry ต่อถ้าเวลาไม่พอ)
+    fn / coro_fn รับเวลาที่เหลือ (วินาที, None = ไม่มี deadline) → ใช้เป็น timeout ของ attempt นั้น
+    """
+
+    def __init__(self, name: str, retry_max: int = RETRY_MAX, hedge: bool = HEDGE,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.retry_max = retry_max
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.counts = {"calls": 0, "retries": 0, "hedged": 0, "hedge_wins": 0, "failures": 0}
+        self._lat: deque = deque(maxlen=256)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    # ---- helpers ----
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(RETRY_CAP_S, RETRY_BASE_S * (2 ** attempt)))
+
+    def _hedge_after(self) -> Optional[float]:
+        if not self.hedge or len(self._lat) < HEDGE_MIN_SAMPLES:
+            return None
+        xs = sorted(self._lat)
+        return xs[min(len(xs) - 1, int(len(xs) * HEDGE_PCT / 100))]
+
+    def record_failure(self, e: BaseException) -> None:
+        """แจ้งผลของการเรียกที่ไม่ได้ผ่าน call() (เช่น stream พังกลางทาง) ให้ circuit breaker"""
+        # 4xx อื่น ๆ (เช่น 400) แปลว่า upstream ยังตอบได้ → ไม่นับเป็นความล่ม
+        if isinstance(e, CircuitOpenError):
+            return
+        if is_retryable(e):
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+    def _record(self, seconds: float) -> None:
+        self._lat.append(seconds)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix=f"{self.name}-hedge")
+            return self._pool
+
+    @staticmethod
+    def _left(t_end: Optional[float]) -> Optional[float]:
+        if t_end is None:
+            return None
+        left = t_end - time.monotonic()
+        if left <= 0:
+            raise TimeoutError("Upstream deadline exceeded")
+        return left
+
+    # ---- sync ----
+    def _attempt(self, fn: Callable[[], Any], hedge: bool) -> Any:
+        after = self._hedge_after() if hedge else None
+        if after is None:
+            return fn()
+        pool = self._executor()
+        first = pool.submit(fn)
+        done, _ = wait([first], timeout=after)
+        if done:
+            return first.result()
+        self.counts["hedged"] += 1
+        second = pool.submit(fn)
+        futs = [first, second]
+        while futs:
+            done, pending = wait(futs, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is second:
+                        self.counts["hedge_wins"] += 1
+                    return f.result()
+            futs = list(pending)
+        raise first.exception()
+
+    def call(self, fn: Callable[[Optional[float]], Any], deadline_s: Optional[float] = None,
+             hedge: Optional[bool] = None) -> Any:
+        """
+        hedge=None → ตาม self.hedge; hedge=False สำหรับงานที่ยิงซ้ำไม่ได้ (เช่นเปิด stream)
+        latency ที่ใช้คำนวณ hedge เก็บเฉพาะการเรียกแบบปกติ (hedge=None)
+        """
+        self.counts["calls"] += 1
+        t_end = time.monotonic() + deadline_s if deadline_s else None
+        attempt = 0
+        while True:
+            try:
+                left = self._left(t_end)
+            except TimeoutError:
+                self.counts["failures"] += 1
+                raise
+            self.breaker.before()
+            t0 = time.monotonic()
+            try:
+                out = self._attempt(lambda: fn(left), self.hedge if hedge is None else hedge)
+            except Exception as e:
+                self.record_failure(e)
+                delay = self._backoff(attempt)
+                out_of_time = t_end is not None and time.monotonic() + delay >= t_end
+                if attempt >= self.retry_max or not is_retryable(e) or out_of_time:
+                    self.counts["failures"] += 1
+                    raise
+                attempt += 1
+                self.counts["retries"] += 1
+                time.sleep(delay)
+                continue
+            self.breaker.success()
+            if hedge is None:
+                self._record(time.monotonic() - t0)
+            return out
+
+    # ---- async ----
+    async def _attempt_async(self, coro_fn: Callable[[], Awaitable[Any]], hedge: bool) -> Any:
+        after = self._hedge_after() if hedge else None
+        first = asyncio.ensure_future(coro_fn())
+        if after is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=after)
+        if done:
+            return first.result()
+        self.counts["hedged"] += 1
+        second = asyncio.ensure_future(coro_fn())
+        tasks = {first, second}
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        if t is second:
+                            self.counts["hedge_wins"] += 1
+                        return t.result()
+            raise first.exception()
+        finally:
+            for t in (first, second):
+                if not t.done():
+                    t.cancel()   # ตัวที่แพ้ยกเลิกได้จริงใน async
+
+    async def call_async(self, coro_fn: Callable[[Optional[float]], Awaitable[Any]],
+                         deadline_s: Optional[float] = None, hedge: Optional[bool] = None) -> Any:
+        """เหมือน call(); แต่ละ attempt ถูก cancel เมื่อครบเวลาที่เหลือของ deadline"""
+        self.counts["calls"] += 1
+        t_end = time.monotonic() + deadline_s if deadline_s else None
+        attempt = 0
+        while True:
+            try:
+                left = self._left(t_end)
+            except TimeoutError:
+                self.counts["failures"] += 1
+                raise
+            self.breaker.before()
+            t0 = time.monotonic()
+            try:
+                coro = self._attempt_async(lambda: coro_fn(left), self.hedge if hedge is None else hedge)
+                out = await (coro if left is None else asyncio.wait_for(coro, left))
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError) and not isinstance(e, TimeoutError):
+                    e = TimeoutError("Upstream deadline exceeded")   # Python < 3.11
+                self.record_failure(e)
+                delay = self._backoff(attempt)
+                out_of_time = t_end is not None and time.monotonic() + delay >= t_end
+                if attempt >= self.retry_max or not is_retryable(e) or out_of_time:
+                    self.counts["failures"] += 1
+                    raise e
+                attempt += 1
+                self.counts["retries"] += 1
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.success()
+            if hedge is None:
+                self._record(time.monotonic() - t0)
+            return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counts,
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.opened,
+            "breaker_rejected": self.breaker.rejected,
+            "hedge_after_s": self._hedge_after(),
+        }
@@ -1,56 +1,544 @@
-# retrieval.py  (cosine, robust)
+# retrieval.py  (cosine, robust, lazy init)
 from __future__ import annotations
-import os
-from typing import List, Dict, Any
+import time
+_T_IMPORT = time.perf_counter()
 
-import chromadb
-from sentence_transformers import SentenceTransformer
+import os, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from emb_cache import open_cache
+from lazy import Lazy, record, startup_report
+from singleflight import SingleFlight
+from np_index import NumpyIndex
+from bm25 import Bm25Index
+from index_store import active_dir, manifest_stamp
+import tracing
 
 INDEX_PATH  = os.getenv("INDEX_PATH", "index")
 COLL_NAME   = os.getenv("COLL_NAME", "fit_faq")
 EMB_MODEL   = os.getenv("EMB_MODEL") or os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
 NORMALIZE   = os.getenv("NORMALIZE_EMB", "1") == "1"
+VERSION_NAME = "VERSION"                      # เขียนโดย build_index ใน directory ของแต่ละ version
+RELOAD_RETRY_S = float(os.getenv("RELOAD_RETRY_S", 5))   # เปิด version ใหม่ไม่สำเร็จ → รอเท่านี้ก่อนลองใหม่
+RELEASE_GRACE_S = float(os.getenv("RELEASE_GRACE_S", 60))   # ปิด generation เก่าหลังสลับไปแล้วเท่านี้ (query ที่ค้างอยู่จบก่อน)
 
-_client   = chromadb.PersistentClient(path=INDEX_PATH)
-# ใช้ cosine ให้ตรงกับตอน build
-_coll     = _client.get_or_create_collection(name=COLL_NAME, metadata={"hnsw:space": "cosine"})
-_embedder = SentenceTransformer(EMB_MODEL)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "chroma")   # chroma | numpy
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")   # vector | hybrid (BM25 + vector)
 
-def _count() -> int:
+# hybrid: lexical fast path ตอบเลยโดยไม่ encode ถ้า BM25 ชัดเจนพอ
+LEX_MIN_SCORE  = float(os.getenv("LEX_MIN_SCORE", 3.0))   # bm25 ของอันดับ 1 ขั้นต่ำ
+LEX_MARGIN     = float(os.getenv("LEX_MARGIN", 1.4))      # อันดับ 1 / อันดับ 2
+LEX_MAX_TERMS  = int(os.getenv("LEX_MAX_TERMS", 4))       # เฉพาะ query สั้นแบบ keyword
+LEX_SCORE_SAT  = float(os.getenv("LEX_SCORE_SAT", 4.0))   # bm25 -> 0..1: s / (s + SAT)
+RRF_K          = int(os.getenv("RRF_K", 60))
+
+RETRIEVE_BATCH = int(os.getenv("RETRIEVE_BATCH", 64))   # batch size ของ encoder ใน retrieve_many
+
+QUERY_CACHE_SIZE  = int(os.getenv("QUERY_CACHE_SIZE", 1024))   # 0 = ปิด cache
+QUERY_CACHE_TTL_S = float(os.getenv("QUERY_CACHE_TTL_S", 600))
+
+# ---- lazy singletons: import retrieval ไม่เปิด Chroma / ไม่โหลด model จนกว่าจะใช้จริง ----
+def _make_client(path: Path):
+    import chromadb
+    return chromadb.PersistentClient(path=str(path))
+
+def _close_client(client) -> None:
+    """
+    ปล่อย PersistentClient (SQLite connection + cache ของ system ตาม path)
+    chromadb ใหม่มี close(); ตัวเก่า stop system แล้วเอาออกจาก cache ของ SharedSystemClient
+    ไม่ใช้ clear_system_cache() เพราะล้างของทุก path รวมถึง generation ใหม่ด้วย
+    """
+    close = getattr(client, "close", None)
+    if callable(close):
+        close()
+        return
+    system = getattr(client, "_system", None)
+    if system is not None:
+        system.stop()
+    ident = getattr(client, "_identifier", None)
+    cache = getattr(type(client), "_identifier_to_system", None)
+    if ident is not None and isinstance(cache, dict):
+        cache.pop(ident, None)
+
+def _make_embedder():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMB_MODEL)
+
+_embedder  = Lazy("retrieval.embedder", _make_embedder)
+_emb_cache = Lazy("retrieval.emb_cache", lambda: open_cache(EMB_MODEL, NORMALIZE))
+
+
+# ---- index generation: ทุกอย่างที่ผูกกับ index directory หนึ่ง (version ที่ publish ผ่าน MANIFEST) ----
+class _Generation:
+    """
+    Chroma client / collection + vectors.npy + bm25.json ของ directory เดียว, version คงที่ตลอดอายุ
+    build ใหม่ publish → สร้าง generation ใหม่ใน background แล้วสลับ reference ทีเดียว
+    query ที่ทำงานอยู่ถือ generation เดิมจนจบ (ไม่มีช่วงที่เห็น index ว่าง / ครึ่ง ๆ)
+    """
+
+    def __init__(self, path: Path, stamp: Optional[Tuple[int, int]]):
+        self.path = path
+        self.stamp = stamp
+        try:
+            self.version = (path / VERSION_NAME).read_text(encoding="utf-8").strip()
+        except OSError:
+            self.version = ""   # index ที่ build ด้วยเวอร์ชันเก่า
+        self.client = Lazy("retrieval.chroma_client", lambda: _make_client(path))
+        # ใช้ cosine ให้ตรงกับตอน build
+        self.coll = Lazy("retrieval.collection", lambda: self.client.get().get_or_create_collection(
+            name=COLL_NAME, metadata={"hnsw:space": "cosine"}))
+        self.vectors = NumpyIndex(str(path))
+        self.bm25 = Bm25Index(str(path))
+        self._coll_count: Optional[int] = None
+
+    def coll_count(self) -> int:
+        """จำนวนแถวใน collection: version คงที่ → นับ (SQLite) ครั้งเดียวต่อ generation"""
+        n = self._coll_count
+        if n is None:
+            n = self._coll_count = self.coll.get().count()
+        return n
+
+    def warm(self, prev: Optional["_Generation"]) -> None:
+        """โหลดให้ครบเท่าที่ generation เดิมใช้อยู่ ก่อนจะสลับมารับ traffic"""
+        if prev is None or prev.coll.loaded():
+            self.coll_count()
+        if _backend.name == "numpy":
+            self.vectors.ensure(self.version)
+            if self.vectors._version != self.version:
+                raise RuntimeError(f"could not load vectors from {self.path}")
+        if RETRIEVAL_MODE == "hybrid":
+            self.bm25.ensure(self.version)
+            if self.bm25._version != self.version:
+                raise RuntimeError(f"could not load BM25 index from {self.path}")
+            self.vectors.ensure(self.version)   # cosine ของ lexical-only hit ตอน fusion
+
+    def close(self) -> None:
+        """ปิด Chroma client ของ generation นี้ (เรียกหลังสลับไปตัวใหม่แล้ว + พ้น RELEASE_GRACE_S)"""
+        client = self.client.get() if self.client.loaded() else None
+        self.coll.reset()
+        self.client.reset()
+        if client is not None:
+            try:
+                _close_client(client)
+            except Exception:
+                pass   # ปิดไม่สำเร็จก็แค่รอ GC; ไม่กระทบ generation ปัจจุบัน
+
+
+_gen: Optional[_Generation] = None
+_gen_lock = threading.Lock()
+_reloading = False
+_reload_after = 0.0
+
+def _generation() -> _Generation:
+    """
+    generation ปัจจุบัน; stat MANIFEST ทุกครั้ง (ถูกมาก) — เปลี่ยนแล้วเริ่ม reload ใน background
+    แล้วคืนตัวเดิมไปก่อน → query ไม่ต้องรอเปิด index ใหม่
+    """
+    global _gen
+    g = _gen
+    stamp = manifest_stamp(INDEX_PATH)
+    if g is None:
+        with _gen_lock:
+            if _gen is None:
+                _gen = _Generation(active_dir(INDEX_PATH), stamp)
+            return _gen
+    if stamp != g.stamp and not _reloading and time.monotonic() >= _reload_after:
+        _start_reload(stamp)
+    return g
+
+def _start_reload(stamp: Optional[Tuple[int, int]]) -> None:
+    global _reloading
+    with _gen_lock:
+        if _reloading:
+            return
+        _reloading = True
+    threading.Thread(target=_reload, args=(stamp,), name="retrieval-reload", daemon=True).start()
+
+def _reload(stamp: Optional[Tuple[int, int]]) -> None:
+    global _gen, _reloading, _reload_after
+    t0 = time.perf_counter()
     try:
-        return _coll.count()
+        new = _Generation(active_dir(INDEX_PATH), stamp)
+        new.warm(_gen)
+        with _gen_lock:
+            old, _gen = _gen, new
+        if old is not None and old.path != new.path:
+            _release_later(old)
+        _stats["reloads"] += 1
+        record("retrieval.reload", time.perf_counter() - t0)
     except Exception:
-        return -1
+        # เปิด version ใหม่ไม่ได้ → ใช้ตัวเดิมต่อ แล้วลองใหม่ทีหลัง
+        _stats["reload_errors"] += 1
+        _reload_after = time.monotonic() + RELOAD_RETRY_S
+    finally:
+        _reloading = False
+
+def _release_later(old: _Generation) -> None:
+    """query ที่หยิบ generation เดิมไปก่อนสลับยังใช้ client ได้จนจบ → ปิดหลัง grace period"""
+    if RELEASE_GRACE_S <= 0:
+        old.close()
+        return
+    t = threading.Timer(RELEASE_GRACE_S, old.close)
+    t.name, t.daemon = "retrieval-release", True
+    t.start()
+
+def reload(wait: bool = True) -> str:
+    """บังคับเช็ค MANIFEST ตอนนี้เลย (wait=True → สลับเสร็จก่อน return); คืน index version"""
+    g = _generation()
+    stamp = manifest_stamp(INDEX_PATH)
+    if stamp != g.stamp:
+        if wait:
+            _reload(stamp)
+        else:
+            _start_reload(stamp)
+    return _generation().version
+
+def index_dir() -> Path:
+    """directory ของ index version ที่ใช้อยู่"""
+    return _generation().path
+
+def get_collection():
+    return _generation().coll.get()
+
+def get_embedder():
+    return _embedder.get()
+
+def embed_queries(texts: List[str]) -> np.ndarray:
+    """encode (ผ่าน embedding cache) → float32 (len(texts), dim)"""
+    return _emb_cache.get().encode(_embedder.get(), texts, batch_size=RETRIEVE_BATCH)
+
+def _count() -> int:
+    return _backend.count()
+
+# ---- index version (ไฟล์ VERSION ใน directory ของ version ที่ publish) ----
+def index_version() -> str:
+    """
+    version stamp ของ index ที่ใช้อยู่; stat() MANIFEST อย่างเดียวถ้าไม่เปลี่ยน (ถูกมาก)
+    ไม่มีไฟล์ → "" (index ที่ build ด้วยเวอร์ชันเก่า)
+    """
+    return _generation().version
+
+
+# ---- query cache (LRU + TTL) ----
+def normalize_query(query: str) -> str:
+    return " ".join((query or "").lower().split())
+
+
+class _QueryCache:
+    """
+    cache ผลของ retrieve() ต่อ process: key = (normalized query, k, min_sim)
+    ผูกกับ index version → build ใหม่แล้วล้างเองทั้งหมด ไม่มีผลเก่าค้าง
+    """
+
+    def __init__(self, maxsize: int, ttl_s: float):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._version = ""
+        self._data: "OrderedDict[tuple, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version: str) -> None:
+        if version != self._version:
+            self._data.clear()
+            self._version = version
+
+    def get(self, key: tuple, version: str) -> Optional[List[Dict[str, Any]]]:
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            self._check_version(version)
+            hit = self._data.get(key)
+            if hit is None or time.monotonic() - hit[0] > self.ttl_s:
+                if hit is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+        # copy dict ต่อชิ้น กันคนเรียกไปแก้ของใน cache
+        return [dict(r) for r in hit[1]]
+
+    def put(self, key: tuple, version: str, value: List[Dict[str, Any]]) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._check_version(version)
+            self._data[key] = (time.monotonic(), [dict(r) for r in value])
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "size": len(self._data),
+            "version": self._version,
+        }
+
+
+_qcache = _QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_S)
+
+def cache_stats() -> Dict[str, Any]:
+    return _qcache.stats()
+
+
+# นับว่า query ไหนต้องเรียก encoder จริง ๆ (ดูผลของ query cache / lexical fast path)
+_stats = {"queries": 0, "encoded": 0, "lexical_fastpath": 0, "reloads": 0, "reload_errors": 0}
+
+def stats() -> Dict[str, Any]:
+    emb = _emb_cache.get().stats() if _emb_cache.loaded() else {}
+    return {**_stats, "query_cache": _qcache.stats(), "embedding_cache": emb,
+            "coalesced": _sf.stats()["coalesced"], "index_dir": str(_gen.path) if _gen else None}
 
+
+# ---- search backends ----
+# ทุก backend คืน (documents, metadatas, distances) แบบ list-of-lists เหมือน Chroma query
+class _ChromaBackend:
+    name = "chroma"
+
+    def count(self, gen: Optional[_Generation] = None) -> int:
+        try:
+            return (gen or _generation()).coll_count()
+        except Exception:
+            return -1
+
+    def search(self, qv: np.ndarray, k: int, gen: Optional[_Generation] = None):
+        res = (gen or _generation()).coll.get().query(
+            query_embeddings=qv.tolist(),
+            n_results=max(1, k),
+            include=["documents", "metadatas", "distances"],   # ไม่ต้อง include 'ids'
+        )
+        if not res or not res.get("documents"):
+            return None
+        return res["documents"], res["metadatas"], res["distances"]
+
+
+class _NumpyBackend:
+    """exact search บน vectors.npy (mmap) ที่ build_index export ไว้ — ไม่ผ่าน SQLite/HNSW"""
+    name = "numpy"
+
+    def _index(self, gen: Optional[_Generation]) -> NumpyIndex:
+        g = gen or _generation()
+        g.vectors.ensure(g.version)
+        return g.vectors
+
+    def count(self, gen: Optional[_Generation] = None) -> int:
+        return self._index(gen).count()
+
+    def search(self, qv: np.ndarray, k: int, gen: Optional[_Generation] = None):
+        return self._index(gen).search(qv, k)
+
+
+# ---- hybrid (BM25 first stage) ----
+def _lex_score(s: float) -> float:
+    return s / (s + LEX_SCORE_SAT) if s > 0 else 0.0
+
+
+def _lexical_decisive(hits, n_terms: int) -> bool:
+    """ตัดสินว่า BM25 ชนะขาด: query สั้น, อันดับ 1 มีทุก term, คะแนนสูงและทิ้งห่างอันดับ 2"""
+    if not hits or n_terms == 0 or n_terms > LEX_MAX_TERMS:
+        return False
+    _, top, coverage = hits[0]
+    if coverage < 1.0 or top < LEX_MIN_SCORE:
+        return False
+    return len(hits) == 1 or top >= LEX_MARGIN * hits[1][1]
+
+
+def _lexical_results(bm: Bm25Index, hits, k: int) -> List[Dict[str, Any]]:
+    """
+    fast path ไม่ได้ encode query → ไม่มี cosine ให้เทียบ min_sim
+    match="fastpath" บอก consumer (llm gates) ว่า score เป็น bm25 ที่ map เป็น 0..1 ไม่ใช่ cosine
+    อันดับรองลงมาต้องผ่าน LEX_MIN_SCORE เหมือนอันดับ 1 (เกณฑ์เดียวกับ _lexical_decisive)
+    """
+    out: List[Dict[str, Any]] = []
+    for d, s, _ in hits[:k]:
+        if s >= LEX_MIN_SCORE:
+            doc, meta = bm.doc(d)
+            out.append({"text": doc, "meta": meta, "score": _lex_score(s), "match": "fastpath"})
+    return out
+
+
+def _fuse(vec_out: List[Dict[str, Any]], gen: "_Generation", hits, qv: np.ndarray, k: int,
+          min_sim: float) -> List[Dict[str, Any]]:
+    """
+    Reciprocal Rank Fusion ของ vector + BM25 (key = document text) → ลำดับตาม rrf
+    score เป็น cosine similarity เสมอ: hit ที่มาจาก BM25 อย่างเดียวคำนวณจาก vector ที่เก็บไว้ (vectors.npy)
+    → min_sim / threshold ใน llm ใช้สเกลเดียวกันทั้ง list; hit ที่ไม่มี vector ให้เทียบถูกตัดทิ้ง
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    for r, item in enumerate(vec_out):
+        fused[item["text"]] = dict(item, match="vector", rrf=1.0 / (RRF_K + r + 1))
+    lex_only = []
+    for r, (d, s, _) in enumerate(hits):
+        doc, meta = gen.bm25.doc(d)
+        rrf = 1.0 / (RRF_K + r + 1)
+        if doc in fused:
+            fused[doc]["rrf"] += rrf
+            fused[doc]["match"] = "hybrid"
+        else:
+            lex_only.append((doc, meta, gen.bm25.doc_id(d), rrf))
+    if lex_only:
+        sims = gen.vectors.similarity(qv, [_id for _, _, _id, _ in lex_only])
+        for (doc, meta, _, rrf), sim in zip(lex_only, sims):
+            if sim is not None and sim >= min_sim:
+                fused[doc] = {"text": doc, "meta": meta, "score": sim, "match": "lexical", "rrf": rrf}
+    return sorted(fused.values(), key=lambda x: x["rrf"], reverse=True)[:k]
+
+
+_BACKENDS = {"chroma": _ChromaBackend, "numpy": _NumpyBackend}
+_backend = _BACKENDS.get(SEARCH_BACKEND, _ChromaBackend)()
+
+def set_backend(name: str) -> None:
+    """สลับ backend ตอน runtime (ใช้ใน benchmark) — ล้าง query cache ด้วย"""
+    global _backend
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown SEARCH_BACKEND: {name!r} (expected one of {sorted(_BACKENDS)})")
+    _backend = _BACKENDS[name]()
+    _qcache.clear()
+
+
+def _to_results(docs, metas, dists, min_sim: float) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for doc, meta, dist in zip(docs or [], metas or [], dists or []):
+        sim = 1.0 - float(dist)   # cosine distance -> similarity
+        if sim >= min_sim:
+            out.append({"text": doc, "meta": meta or {}, "score": sim})
+    out.sort(key=lambda x: x["score"], reverse=True)
+    return out
+
+
+_sf = SingleFlight("retrieve")
+
+def _hits_attrs(out: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"hits": len(out), "top_score": round(out[0]["score"], 4) if out else None}
+
+@tracing.traced("retrieve", _hits_attrs)
 def retrieve(query: str, k: int = 5, min_sim: float = 0.20) -> List[Dict[str, Any]]:
     """
     คืนค่า: [{'text': str, 'meta': dict, 'score': float}, ...]  โดย score ~ similarity(0..1)
     - ใช้ embedding จาก SentenceTransformer (เหมือนตอน build)
     - query ผ่าน cosine distance -> แปลงเป็น similarity ด้วย 1 - dist
+    - query ซ้ำ (หลัง normalize) ตอบจาก cache จนกว่า index version จะเปลี่ยน
+    - query เดียวกันที่เข้ามาพร้อมกันหลาย thread → encode/search ครั้งเดียว (single-flight)
     """
     q = (query or "").strip()
-    if not q or _count() <= 0:
+    if not q:
         return []
+    key = (normalize_query(q), k, float(min_sim), index_version())
+    out, shared = _sf.do(key, lambda: retrieve_many([q], k=k, min_sim=min_sim)[0])
+    if shared:
+        tracing.annotate(coalesced=True)
+    return [dict(r) for r in out] if shared else out
 
-    qv = _embedder.encode([q], normalize_embeddings=NORMALIZE).tolist()
 
-    res = _coll.query(
-        query_embeddings=qv,
-        n_results=max(1, k),
-        include=["documents", "metadatas", "distances"],   # ไม่ต้อง include 'ids'
-    )
-    if not res or not res.get("documents"):
-        return []
+@tracing.traced("retrieve_many", lambda res: {"queries": len(res)})
+def retrieve_many(queries: List[str], k: int = 5, min_sim: float = 0.20) -> List[List[Dict[str, Any]]]:
+    """
+    เหมือน retrieve() แต่ทีละหลาย query: คืน list ของผลลัพธ์ เรียงตาม queries
+    - เช็ค query cache ก่อน
+    - ที่เหลือ (unique หลัง normalize) encode รวดเดียว 1 forward pass
+    - ส่ง Chroma query ครั้งเดียวด้วยหลาย embedding
+    - RETRIEVAL_MODE=hybrid: BM25 fast path / RRF fusion กับผล vector
+    """
+    results: List[List[Dict[str, Any]]] = [[] for _ in queries]
+    gen = _generation()   # ทั้ง batch ใช้ index version เดียวกันแม้จะมี publish ระหว่างทาง
+    version = gen.version
 
-    docs  = res["documents"][0] or []
-    metas = res["metadatas"][0] or []
-    dists = res["distances"][0] or []
+    # normalized query -> (ข้อความจริงตัวแรกที่เจอ, ตำแหน่งทั้งหมดใน queries)
+    pending: "OrderedDict[str, Tuple[str, List[int]]]" = OrderedDict()
+    with tracing.span("normalize") as sp:
+        cache_hits = 0
+        for i, query in enumerate(queries):
+            q = (query or "").strip()
+            if not q:
+                continue
+            nq = normalize_query(q)
+            if nq in pending:
+                pending[nq][1].append(i)
+                continue
+            cached = _qcache.get((nq, k, float(min_sim)), version)
+            if cached is not None:
+                results[i] = cached
+                cache_hits += 1
+                continue
+            pending[nq] = (q, [i])
+        sp.set(cache_hits=cache_hits, pending=len(pending))
 
-    out: List[Dict[str, Any]] = []
-    for doc, meta, dist in zip(docs, metas, dists):
-        sim = 1.0 - float(dist)   # cosine distance -> similarity
-        if sim >= min_sim:
-            out.append({"text": doc, "meta": meta or {}, "score": sim})
+    def _store(nq: str, idxs: List[int], out: List[Dict[str, Any]]) -> None:
+        _qcache.put((nq, k, float(min_sim)), version, out)
+        results[idxs[0]] = out
+        for i in idxs[1:]:
+            results[i] = [dict(r) for r in out]
 
-    out.sort(key=lambda x: x["score"], reverse=True)
-    return out
\ No newline at end of file
+    _stats["queries"] += len(pending)
+
+    # ---- hybrid: BM25 ก่อน; ถ้าชัดเจนตอบเลย ไม่ต้องเข้า encoder ----
+    lex: Dict[str, list] = {}
+    if RETRIEVAL_MODE == "hybrid" and pending:
+        with tracing.span("bm25", queries=len(pending)) as sp:
+            gen.bm25.ensure(version)
+            for nq, (q, idxs) in list(pending.items()):
+                hits, n_terms = gen.bm25.search(q, 2 * k)
+                if _lexical_decisive(hits, n_terms):
+                    _stats["lexical_fastpath"] += 1
+                    _store(nq, idxs, _lexical_results(gen.bm25, hits, k))
+                    del pending[nq]
+                else:
+                    lex[nq] = hits
+            sp.set(fastpath=sp.attrs["queries"] - len(pending))
+
+    if not pending or _backend.count(gen) <= 0:
+        return results
+
+    texts = [q for q, _ in pending.values()]
+    with tracing.span("embed", n=len(texts)):
+        qv = embed_queries(texts)
+    _stats["encoded"] += len(texts)
+
+    k_vec = 2 * k if lex else k   # hybrid: ขอ candidate เผื่อไว้ให้ fusion
+    with tracing.span("search", backend=_backend.name, n=len(texts), k=k_vec):
+        res = _backend.search(qv, k_vec, gen)
+    if not res:
+        return results
+    docs, metas, dists = res
+    if lex:
+        gen.vectors.ensure(version)
+
+    for j, (nq, (_, idxs)) in enumerate(pending.items()):
+        out = _to_results(docs[j], metas[j], dists[j], min_sim)
+        if nq in lex:
+            out = _fuse(out, gen, lex[nq], qv[j], k, min_sim)
+        _store(nq, idxs, out)
+    return results
+
+
+def warmup(query: str = "How do I add food waste data?") -> Dict[str, float]:
+    """
+    สร้าง client / collection / embedder ให้ครบ + encode/search 1 ครั้ง (ไม่เข้า query cache)
+    server ควรเรียกก่อนเปิดรับ traffic; คืน startup_report() (ms)
+    """
+    t0 = time.perf_counter()
+    gen = _generation()
+    gen.warm(None)
+    if _backend.count(gen) > 0:
+        _backend.search(embed_queries([query]), 1, gen)
+    else:
+        embed_queries([query])
+    record("retrieval.warmup", time.perf_counter() - t0)
+    return startup_report()
+
+
+record("import:retrieval", time.perf_counter() - _T_IMPORT)
@@ -0,0 +1,279 @@
+# serve.py  (ASGI service: /retrieve, /answer, /health, /ready with dynamic micro-batching of query embeddings)
+#   pip install uvicorn
+#   python serve.py [--host 127.0.0.1] [--port 8000] [--workers 2]
+#   uvicorn serve:app --workers 2        # ใช้ uvicorn ตรง ๆ ก็ได้
+from __future__ import annotations
+import os, sys, json, time, asyncio, argparse
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import retrieval
+import llm
+
+SERVE_HOST      = os.getenv("SERVE_HOST", "127.0.0.1")
+SERVE_PORT      = int(os.getenv("SERVE_PORT", 8000))
+SERVE_WORKERS   = int(os.getenv("SERVE_WORKERS", 1))
+BATCH_MAX       = int(os.getenv("BATCH_MAX", 32))          # query ต่อ forward pass สูงสุด
+BATCH_WAIT_MS   = float(os.getenv("BATCH_WAIT_MS", 5))     # รอ query อื่นมาร่วม batch นานสุดเท่านี้
+MAX_BODY_BYTES  = int(os.getenv("MAX_BODY_BYTES", 64 * 1024))
+MAX_QUERY_CHARS = int(os.getenv("MAX_QUERY_CHARS", 1000))
+MAX_K           = int(os.getenv("MAX_K", 20))
+
+
+class MicroBatcher:
+    """
+    request ที่เข้ามาใกล้ ๆ กันถูกรวมเป็น batch เดียว → retrieval.retrieve_many ครั้งเดียว (encode 1 forward pass)
+    - batch ปิดเมื่อครบ max_batch หรือครบ max_wait นับจาก query แรก
+    - ระหว่างที่ batch หนึ่งกำลัง encode อยู่ใน thread คิวถัดไปก็สะสมไปเรื่อย ๆ → ขนาด batch ปรับตามโหลดเอง
+    - query ต่าง (k, min_sim) แยก group กันภายใน batch
+    """
+
+    def __init__(self, fn: Callable[[List[str], int, float], List[Any]],
+                 max_batch: int = BATCH_MAX, max_wait_s: float = BATCH_WAIT_MS / 1000):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait_s = max(0.0, max_wait_s)
+        self.counts = {"requests": 0, "batches": 0, "largest_batch": 0, "errors": 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, query: str, k: int, min_sim: float) -> Any:
+        fut = asyncio.get_running_loop().create_future()
+        self.counts["requests"] += 1
+        await self._queue.put((query, k, min_sim, fut))
+        return await fut
+
+    async def _collect(self) -> List[Tuple[str, int, float, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait_s
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            self.counts["batches"] += 1
+            self.counts["largest_batch"] = max(self.counts["largest_batch"], len(batch))
+            groups: Dict[Tuple[int, float], list] = {}
+            for item in batch:
+                if not item[3].done():      # client ตัดไปแล้ว → ไม่ต้อง encode
+                    groups.setdefault((item[1], item[2]), []).append(item)
+            for (k, min_sim), items in groups.items():
+                try:
+                    results = await asyncio.to_thread(self.fn, [it[0] for it in items], k, min_sim)
+                except Exception as e:
+                    self.counts["errors"] += 1
+                    for it in items:
+                        if not it[3].done():
+                            it[3].set_exception(e)
+                    continue
+                for it, res in zip(items, results):
+                    if not it[3].done():
+                        it[3].set_result(res)
+
+    def stats(self) -> Dict[str, Any]:
+        avg = self.counts["requests"] / self.counts["batches"] if self.counts["batches"] else 0.0
+        return {**self.counts, "avg_batch": round(avg, 2), "queued": self._queue.qsize() if self._queue else 0,
+                "max_batch": self.max_batch, "max_wait_ms": self.max_wait_s * 1000}
+
+
+_batcher = MicroBatcher(lambda qs, k, min_sim: retrieval.retrieve_many(qs, k=k, min_sim=min_sim))
+_state: Dict[str, Any] = {"ready": False, "error": None, "started": time.time()}
+
+
+# ---- request parsing ----
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_query(body: Dict[str, Any]) -> Tuple[str, int, float]:
+    q = body.get("query")
+    if not isinstance(q, str) or not q.strip():
+        raise HttpError(400, "'query' must be a non-empty string")
+    if len(q) > MAX_QUERY_CHARS:
+        raise HttpError(400, f"'query' is longer than {MAX_QUERY_CHARS} characters")
+    try:
+        k = int(body.get("k", 5))
+        min_sim = float(body.get("min_sim", 0.20))
+    except (TypeError, ValueError):
+        raise HttpError(400, "'k' must be an integer and 'min_sim' a number")
+    if not 1 <= k <= MAX_K:
+        raise HttpError(400, f"'k' must be between 1 and {MAX_K}")
+    return q.strip(), k, min_sim
+
+
+def _hits(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # match: vector | hybrid | lexical (score = cosine) หรือ fastpath (score = BM25 ที่ map เป็น 0..1)
+    return [{"question": (c.get("meta") or {}).get("question", ""), "score": round(float(c["score"]), 4),
+             "match": c.get("match", "vector"), "text": c.get("text", "")} for c in chunks]
+
+
+# ---- handlers ----
+async def _retrieve(body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    q, k, min_sim = _parse_query(body)
+    t0 = time.perf_counter()
+    chunks = await _batcher.submit(q, k, min_sim)
+    return 200, {"query": q, "results": _hits(chunks), "latency": time.perf_counter() - t0,
+                 "index_version": retrieval.index_version()}
+
+
+async def _answer(body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    q, k, min_sim = _parse_query(body)
+    t0 = time.perf_counter()
+    chunks = await _batcher.submit(q, k, min_sim)
+    t_retrieve = time.perf_counter() - t0
+    out = await llm.answer_async(q, chunks)
+    return 200, {**out, "query": q, "sources": _hits(chunks), "retrieve_latency": t_retrieve,
+                 "latency": time.perf_counter() - t0}
+
+
+async def _health(_: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    # liveness: process ตอบได้ (ไม่แตะ model / index)
+    return 200, {"ok": True, "pid": os.getpid(), "uptime_s": round(time.time() - _state["started"], 1)}
+
+
+async def _ready(_: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    # readiness: warmup เสร็จแล้ว (embedder + index โหลดแล้ว) → พร้อมรับ traffic
+    body = {"ready": _state["ready"], "pid": os.getpid(), "index_version": retrieval.index_version(),
+            "backend": retrieval._backend.name, "batching": _batcher.stats()}
+    if _state["error"]:
+        body["error"] = _state["error"]
+    if _state["ready"]:
+        body["retrieval"] = retrieval.stats()
+        body["upstream"] = llm.upstream_stats()
+    return (200 if _state["ready"] else 503), body
+
+
+_ROUTES: Dict[Tuple[str, str], Callable[[Dict[str, Any]], Awaitable[Tuple[int, Dict[str, Any]]]]] = {
+    ("POST", "/retrieve"): _retrieve,
+    ("POST", "/answer"): _answer,
+    ("GET", "/health"): _health,
+    ("GET", "/ready"): _ready,
+}
+
+
+# ---- ASGI plumbing (ไม่ผูกกับ framework ใด ๆ) ----
+async def _send_json(send, status: int, obj: Dict[str, Any]) -> None:
+    body = json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _read_body(receive) -> bytes:
+    chunks, size = [], 0
+    while True:
+        msg = await receive()
+        if msg["type"] == "http.disconnect":
+            raise asyncio.CancelledError()
+        chunk = msg.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise HttpError(413, f"Request body larger than {MAX_BODY_BYTES} bytes")
+        chunks.append(chunk)
+        if not msg.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _warmup() -> None:
+    try:
+        await asyncio.to_thread(retrieval.warmup)
+        _state["ready"] = True
+    except Exception as e:
+        _state["error"] = f"warmup failed: {e}"
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        msg = await receive()
+        if msg["type"] == "lifespan.startup":
+            _batcher.start()
+            # warmup ใน background: /health ตอบได้ทันที, /ready เป็น 200 เมื่อโหลดเสร็จ
+            _state["warmup"] = asyncio.ensure_future(_warmup())
+            await send({"type": "lifespan.startup.complete"})
+        elif msg["type"] == "lifespan.shutdown":
+            await _batcher.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    handler = _ROUTES.get((scope["method"], scope["path"].rstrip("/") or "/"))
+    if handler is None:
+        allowed = [m for m, p in _ROUTES if p == scope["path"].rstrip("/")]
+        return await _send_json(send, 405 if allowed else 404,
+                                {"error": "method not allowed" if allowed else "not found"})
+    try:
+        raw = await _read_body(receive)
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            raise HttpError(400, "Body must be JSON")
+        if not isinstance(body, dict):
+            raise HttpError(400, "Body must be a JSON object")
+        if handler in (_retrieve, _answer) and not _state["ready"]:
+            raise HttpError(503, _state["error"] or "warming up")
+        status, out = await handler(body)
+    except HttpError as e:
+        status, out = e.status, {"error": str(e)}
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        status, out = 500, {"error": f"{type(e).__name__}: {e}"}
+    await _send_json(send, status, out)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="FAQ retrieval / answer HTTP service")
+    ap.add_argument("--host", default=SERVE_HOST)
+    ap.add_argument("--port", type=int, default=SERVE_PORT)
+    ap.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    args = ap.parse_args()
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("serve.py needs an ASGI server: pip install uvicorn")
+
+    if args.workers > 1:
+        # worker = process แยก: index ต้องเป็น read-only ที่แชร์กันได้ → numpy backend (mmap, page cache เดียวกัน)
+        # และแบ่ง CPU ให้ encoder ของแต่ละ worker ไม่แย่งกัน
+        if "SEARCH_BACKEND" not in os.environ:
+            os.environ["SEARCH_BACKEND"] = "numpy"
+        os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // args.workers)))
+        print(f"🧵 {args.workers} workers, SEARCH_BACKEND={os.environ['SEARCH_BACKEND']}, "
+              f"OMP_NUM_THREADS={os.environ['OMP_NUM_THREADS']}")
+    uvicorn.run("serve:app", host=args.host, port=args.port, workers=args.workers, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# singleflight.py  (coalesce concurrent identical calls: threaded + asyncio)
+from __future__ import annotations
+import asyncio, threading, weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+_groups: Dict[str, Any] = {}     # name -> SingleFlight / AsyncSingleFlight (ไว้ดู counter รวม)
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    return {name: g.stats() for name, g in _groups.items()}
+
+
+class _Call:
+    __slots__ = ("event", "result", "exc")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc = None
+
+
+class SingleFlight:
+    """
+    thread version: key เดียวกันที่เข้ามาพร้อมกัน → คนแรกทำงานจริง (leader) คนอื่นรอผลเดียวกัน
+    do() คืน (result, shared) — shared=True แปลว่าได้ผลของคนอื่นมา (ควร copy ก่อนแก้)
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, _Call] = {}
+        _groups[name] = self
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        with self._lock:
+            self.calls += 1
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.exc is not None:
+                raise call.exc
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.exc = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.event.set()
+        return call.result, False
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "coalesced": self.coalesced, "inflight": len(self._inflight)}
+
+
+class AsyncSingleFlight:
+    """
+    asyncio version: งานจริงรันเป็น Task แยก แล้วทุกคน await ผ่าน shield
+    → caller คนหนึ่งถูก cancel ไม่ทำให้คนอื่นพัง; ถ้า cancel ครบทุกคน ค่อย cancel งานจริง
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        # task ผูกกับ event loop → แยก in-flight ต่อ loop
+        self._loops: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = weakref.WeakKeyDictionary()
+        _groups[name] = self
+
+    async def do(self, key: Hashable, coro_fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        loop = asyncio.get_running_loop()
+        inflight = self._loops.setdefault(loop, {})
+        self.calls += 1
+
+        entry = inflight.get(key)
+        shared = entry is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(coro_fn())
+            entry = inflight[key] = [task, 0]
+            task.add_done_callback(lambda t, k=key: inflight.pop(k, None) if inflight.get(k, [None])[0] is t else None)
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            if not task.done() and entry[1] <= 1:
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "coalesced": self.coalesced,
+                "inflight": sum(len(d) for d in self._loops.values())}
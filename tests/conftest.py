@@ -0,0 +1,77 @@
+# tests/conftest.py  (module ของ repo อยู่ที่ root แบบ flat → เพิ่ม root เข้า sys.path + fake_mistral / client ปลอม)
+import os, sys
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import pytest
+
+from fake_mistral import FakeConfig, start_server
+
+
+@pytest.fixture
+def fake_mistral():
+    """เปิด fake_mistral บน port ว่าง → คืน (cfg, url, counts); แก้ cfg ระหว่าง test ได้ (handler อ่านทุก request)"""
+    cfg = FakeConfig(latency_ms=5, latency_sigma=0, completion_tokens=8)
+    server, url = start_server(cfg)
+    try:
+        yield cfg, url, server.RequestHandlerClass.counts
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# ---- client ปลอมของ llm (ไม่ต้องมี mistralai): stream ตาม script ----
+def _chunk(text, usage=None):
+    delta = SimpleNamespace(content=text)
+    return SimpleNamespace(data=SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=usage))
+
+
+class FakeStream:
+    def __init__(self, pieces, fail_after=None):
+        self.pieces, self.fail_after = pieces, fail_after
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+    def __iter__(self):
+        for i, p in enumerate(self.pieces):
+            if i == self.fail_after:
+                raise ConnectionError("stream reset")
+            yield _chunk(p)
+
+
+class FakeChat:
+    """client.chat ปลอม: แต่ละครั้งที่เปิด stream ใช้ของถัดไปใน script (Exception หรือ FakeStream)"""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.opened = []    # timeout_ms ของแต่ละครั้งที่เปิด
+        self.models = []
+
+    def stream(self, **kwargs):
+        self.opened.append(kwargs["timeout_ms"])
+        self.models.append(kwargs["model"])
+        item = self.script.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+@pytest.fixture
+def stub_client(monkeypatch):
+    """stub_client(*script) → แทน llm.get_client ด้วย FakeChat ของ script นั้น"""
+    import llm
+
+    def install(*script):
+        chat = FakeChat(script)
+        monkeypatch.setattr(llm, "get_client", lambda: SimpleNamespace(chat=chat))
+        return chat
+
+    return install
@@ -0,0 +1,54 @@
+# tests/test_answer_stream.py  (answer_stream: คำตอบที่คืนต้องตรงกับสิ่งที่ผู้ใช้เห็นใน stream)
+import pytest
+
+from conftest import FakeStream
+from resilience import Resilient
+
+CHUNKS = [{"text": "Covers are logged per shift.", "score": 0.8, "match": "vector",
+           "meta": {"question": "How do I log covers?"}}]
+
+# ยาวเกิน ESCALATE_PROBE_CHARS ก่อนจะ "not sure" → ข้อความถูกส่งถึงผู้ใช้ไปแล้วตอนเจอ refusal
+LATE_REFUSAL = ["Covers are logged from the shift screen in the FIT app, ",
+                "under the waste and covers section for each service period. ",
+                "However I'm not sure from the current docs about night shifts."]
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    import llm
+    monkeypatch.setattr(llm, "EXTRACTIVE", False)
+    monkeypatch.setattr(llm, "ANSWER_CACHE", False)
+    monkeypatch.setattr(llm, "STREAM_ESCALATE", True)
+    monkeypatch.setattr(llm, "_upstream", Resilient("mistral-test", hedge=False))
+    return llm
+
+
+def test_late_refusal_returns_the_escalated_stream(llm, stub_client):
+    chat = stub_client(FakeStream(LATE_REFUSAL), FakeStream(["Use Covers [Q1]."]))
+    seen = []
+    out = llm.answer_stream("How do I log covers?", CHUNKS, lambda piece, model: seen.append((model, piece)))
+
+    assert chat.models == [llm.MODEL, llm.SMART_MODEL]
+    assert seen[0][0] == llm.MODEL and seen[-1] == (llm.SMART_MODEL, "Use Covers [Q1].")
+    # smart model สั้นกว่า แต่เป็นสิ่งที่ผู้ใช้เห็นล่าสุด → ต้องคืนตัวนี้ ไม่ใช่ refusal
+    assert out["text"] == "Use Covers [Q1]."
+    assert out["model_used"] == llm.SMART_MODEL and out["escalated_from"] == llm.MODEL
+
+
+def test_escalated_stream_failing_before_output_keeps_what_was_shown(llm, stub_client):
+    stub_client(FakeStream(LATE_REFUSAL), ValueError("bad request"))
+    seen = []
+    out = llm.answer_stream("How do I log covers?", CHUNKS, lambda piece, model: seen.append(model))
+
+    assert set(seen) == {llm.MODEL}
+    assert out["model_used"] == llm.MODEL
+    assert out["text"].startswith("Covers are logged")
+
+
+def test_early_refusal_is_never_shown(llm, stub_client):
+    stub_client(FakeStream(["I'm not sure ", "from the current docs."]), FakeStream(["Use Covers [Q1]."]))
+    seen = []
+    out = llm.answer_stream("How do I log covers?", CHUNKS, lambda piece, model: seen.append((model, piece)))
+
+    assert seen == [(llm.SMART_MODEL, "Use Covers [Q1].")]
+    assert out["text"] == "Use Covers [Q1]."
@@ -0,0 +1,135 @@
+# tests/test_build_diff.py  (build_index: id คงที่ + incremental diff → encode เฉพาะแถวที่เปลี่ยน)
+import csv
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import build_index
+
+ROWS = [("How do I log covers?", "Open the Covers tab.", "Covers", "Daily"),
+        ("How do I record waste?", "Use the Waste screen.", "Waste", "Daily"),
+        ("How do I change shifts?", "Settings > Shifts.", "Settings", "Shifts")]
+
+
+def _write_csv(path, rows):
+    with path.open("w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["Category", "Subcategory", "Question", "Answer"])
+        for q, a, cat, sub in rows:
+            w.writerow([cat, sub, q, a])
+    return path
+
+
+class FakeCollection:
+    """พอสำหรับ existing_hashes / upsert_batches / relabel_rows (เก็บใน dict)"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def get(self, ids=None, include=(), limit=None, offset=0):
+        keys = ids if ids is not None else sorted(self.rows)[offset:offset + (limit or len(self.rows))]
+        got = {"ids": list(keys)}
+        if "metadatas" in include:
+            got["metadatas"] = [self.rows[k][1] for k in keys]
+        if "embeddings" in include:
+            got["embeddings"] = [self.rows[k][2] for k in keys]
+        return got
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        for _id, doc, meta, emb in zip(ids, documents, metadatas, embeddings):
+            self.rows[_id] = (doc, dict(meta), np.asarray(emb))
+
+
+class FakeCache:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, model, docs, batch_size):
+        self.encoded.extend(docs)
+        return np.array([[float(len(d)), 1.0] for d in docs], dtype=np.float32)
+
+    def save(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def build(monkeypatch, tmp_path):
+    cache = FakeCache()
+    monkeypatch.setattr(build_index, "embedder", SimpleNamespace(get=lambda: object()))
+    monkeypatch.setattr(build_index, "emb_cache", SimpleNamespace(get=lambda: cache))
+    monkeypatch.setattr(build_index, "_max_add_batch", lambda: 2)
+    monkeypatch.setattr(build_index, "ENCODE_WORKERS", 0)
+    monkeypatch.setattr(build_index, "READ_CHUNK", 2)
+    coll = FakeCollection()
+
+    def run(rows):
+        cache.encoded.clear()
+        path = _write_csv(tmp_path / "faq.csv", rows)
+        progress = build_index.Progress()
+        ids, _, metas = build_index.stream_rows(coll, build_index.existing_hashes(coll), [path], progress)
+        return ids, metas, list(cache.encoded), progress
+
+    return run, coll
+
+
+def test_ids_follow_the_question_not_the_row():
+    metas = [{"question": q} for q, *_ in ROWS]
+    ids = build_index.stable_ids(metas)
+    assert build_index.stable_ids(list(reversed(metas))) == list(reversed(ids))
+    dup = build_index.stable_ids(metas + [metas[0]])
+    assert dup[:3] == ids and dup[3] == ids[0] + "-2"
+
+
+def test_unchanged_rebuild_encodes_nothing(build):
+    run, _ = build
+    ids, _, encoded, _ = run(ROWS)
+    assert len(encoded) == 3
+    ids2, _, encoded2, progress = run(ROWS)
+    assert ids2 == ids and encoded2 == [] and progress.embedded == 0
+
+
+def test_only_edited_and_inserted_rows_are_encoded(build):
+    run, coll = build
+    ids, _, _, _ = run(ROWS)
+    edited = [("How do I reset my PIN?", "Ask a manager.", "Settings", "Account"),   # แทรกบนสุด
+              (ROWS[0][0], "Open the Covers tab and tap +.", *ROWS[0][2:]),          # แก้ Answer
+              ROWS[1], ROWS[2]]
+    ids2, _, encoded, progress = run(edited)
+    assert ids2[1:] == ids   # แถวเดิม id ไม่ขยับ
+    assert sorted(encoded) == sorted(["How do I reset my PIN?\n\nAsk a manager.",
+                                      "How do I log covers?\n\nOpen the Covers tab and tap +."])
+    assert progress.embedded == 2 and progress.relabeled == 0
+    assert coll.rows[ids[0]][0].endswith("tap +.")
+
+
+def test_metadata_only_change_is_upserted_without_encoding(build):
+    run, coll = build
+    ids, _, _, _ = run(ROWS)
+    emb_before = coll.rows[ids[1]][2].copy()
+    moved = [ROWS[0], (ROWS[1][0], ROWS[1][1], "Kitchen", "Waste"), ROWS[2]]
+    ids2, metas, encoded, progress = run(moved)
+
+    assert ids2 == ids and encoded == []
+    assert progress.relabeled == 1 and progress.embedded == 0
+    _, meta, emb = coll.rows[ids[1]]
+    assert (meta["category"], meta["subcategory"]) == ("Kitchen", "Waste")
+    assert meta["meta_hash"] == metas[1]["meta_hash"]
+    np.testing.assert_array_equal(emb, emb_before)   # embedding เดิม
+    # version เปลี่ยน → artifact (vectors.meta.json / catalog) ถูกเขียนใหม่
+    assert build_index.new_index_version(ids, metas).split("-")[1] != \
+        build_index.new_index_version(ids, [dict(m, meta_hash="") for m in metas]).split("-")[1]
+
+
+def test_rows_from_an_index_without_meta_hash_are_relabelled_once(build):
+    run, coll = build
+    ids, _, _, _ = run(ROWS)
+    for _id, (doc, meta, emb) in coll.rows.items():
+        meta.pop("meta_hash")
+    _, _, encoded, progress = run(ROWS)
+    assert encoded == [] and progress.relabeled == 3
+    _, _, _, progress = run(ROWS)
+    assert progress.relabeled == 0
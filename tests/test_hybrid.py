@@ -0,0 +1,80 @@
+# tests/test_hybrid.py  (hybrid retrieval: score เป็น cosine เสมอ, fast path ผ่าน LEX_MIN_SCORE, RRF fusion)
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import bm25
+import retrieval
+from np_index import META_FILE, VECTORS_FILE, NumpyIndex
+
+IDS = ["d0", "d1", "d2", "d3"]
+DOCS = ["How do I log covers for lunch service",
+        "Where do I record food waste at the end of a shift",
+        "Defrost freezer schedule and temperature checks",
+        "Covers and waste reports by shift"]          # d3 มีใน bm25 แต่ไม่มี vector
+VECS = np.array([[1, 0, 0, 0], [0.6, 0.8, 0, 0], [0, 0, 1, 0]], dtype=np.float32)
+
+
+@pytest.fixture
+def gen(tmp_path):
+    metas = [{"question": d} for d in DOCS]
+    bm25.write_index(IDS, DOCS, metas, str(tmp_path), "v1")
+    np.save(tmp_path / VECTORS_FILE, VECS)
+    (tmp_path / META_FILE).write_text(json.dumps({
+        "version": "v1", "count": len(VECS), "dim": 4, "ids": IDS[:3],
+        "documents": DOCS[:3], "metadatas": metas[:3]}), encoding="utf-8")
+    (tmp_path / retrieval.VERSION_NAME).write_text("v1", encoding="utf-8")
+    g = SimpleNamespace(path=tmp_path, bm25=bm25.Bm25Index(str(tmp_path)), vectors=NumpyIndex(str(tmp_path)))
+    g.bm25.ensure("v1")
+    g.vectors.ensure("v1")
+    return g
+
+
+QV = np.array([1, 0, 0, 0], dtype=np.float32)
+
+
+def test_fused_hit_keeps_cosine_score(gen):
+    vec_out = [{"text": DOCS[0], "meta": {}, "score": 0.91}]
+    hits = [(0, 6.0, 1.0), (1, 2.0, 0.5)]
+    out = retrieval._fuse(vec_out, gen, hits, QV, k=5, min_sim=0.2)
+
+    by_text = {r["text"]: r for r in out}
+    both = by_text[DOCS[0]]
+    assert both["match"] == "hybrid" and both["score"] == 0.91
+    assert both["rrf"] == pytest.approx(2 / (retrieval.RRF_K + 1))
+    lexical = by_text[DOCS[1]]
+    assert lexical["match"] == "lexical"
+    assert lexical["score"] == pytest.approx(0.6)       # cosine จาก vectors.npy ไม่ใช่ rrf / bm25
+    assert [r["text"] for r in out] == [DOCS[0], DOCS[1]]   # เรียงตาม rrf
+
+
+def test_lexical_only_hits_without_vector_or_below_min_sim_are_dropped(gen):
+    hits = [(3, 5.0, 1.0), (2, 4.0, 1.0), (1, 3.0, 1.0)]
+    out = retrieval._fuse([], gen, hits, QV, k=5, min_sim=0.5)
+    assert [r["text"] for r in out] == [DOCS[1]]   # d3 ไม่มี vector, d2 cosine = 0
+    assert all(0 <= r["score"] <= 1 for r in out)
+
+
+def test_fastpath_results_gated_by_lex_min_score(gen, monkeypatch):
+    monkeypatch.setattr(retrieval, "LEX_MIN_SCORE", 3.0)
+    hits = [(2, 7.5, 1.0), (0, 3.2, 0.5), (1, 2.9, 0.5)]
+    out = retrieval._lexical_results(gen.bm25, hits, k=5)
+    assert [r["text"] for r in out] == [DOCS[2], DOCS[0]]
+    assert all(r["match"] == "fastpath" for r in out)
+    assert out[0]["score"] == pytest.approx(retrieval._lex_score(7.5))
+    assert 0 < out[1]["score"] < out[0]["score"] < 1
+
+
+def test_decisive_keyword_query_skips_the_encoder(gen, monkeypatch):
+    monkeypatch.setattr(retrieval, "INDEX_PATH", str(gen.path))
+    monkeypatch.setattr(retrieval, "_gen", None)
+    monkeypatch.setattr(retrieval, "RETRIEVAL_MODE", "hybrid")
+    monkeypatch.setattr(retrieval, "LEX_MIN_SCORE", 1.0)
+    monkeypatch.setattr(retrieval, "embed_queries", lambda texts: pytest.fail("encoder should not run"))
+    retrieval._qcache.clear()
+
+    out = retrieval.retrieve_many(["defrost freezer schedule"], k=3)[0]
+    assert out and out[0]["text"] == DOCS[2]
+    assert {r["match"] for r in out} == {"fastpath"}
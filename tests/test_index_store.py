@@ -0,0 +1,99 @@
+# tests/test_index_store.py  (publish / active_dir / gc + hot reload ของ retrieval)
+import os, time
+
+import pytest
+
+import index_store
+import retrieval
+
+
+def _build(root, version):
+    path = index_store.new_build_dir(root)
+    (path / retrieval.VERSION_NAME).write_text(version, encoding="utf-8")
+    return path
+
+
+def _publish(root, path, version):
+    manifest = index_store.publish(root, path, version)
+    # กัน mtime ชนกันบน filesystem ที่ timestamp หยาบ (stamp = mtime_ns + size)
+    st = (root / index_store.MANIFEST_FILE).stat()
+    os.utime(root / index_store.MANIFEST_FILE, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000 * len(version)))
+    return manifest
+
+
+def test_unversioned_index_uses_root(tmp_path):
+    assert index_store.read_manifest(tmp_path) is None
+    assert index_store.active_dir(tmp_path) == tmp_path
+
+
+def test_publish_switches_active_dir(tmp_path):
+    v1 = _build(tmp_path, "v1")
+    _publish(tmp_path, v1, "v1")
+    assert index_store.active_dir(tmp_path) == v1
+
+    v2 = _build(tmp_path, "v2")
+    assert index_store.active_dir(tmp_path) == v1   # ยังไม่ publish → ไม่มีใครเห็น
+    manifest = _publish(tmp_path, v2, "v2")
+    assert index_store.active_dir(tmp_path) == v2
+    assert manifest["history"][:2] == [v2.relative_to(tmp_path).as_posix(), v1.relative_to(tmp_path).as_posix()]
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_seed_copies_live_version(tmp_path):
+    v1 = _build(tmp_path, "v1")
+    (v1 / "bm25.json").write_text("{}", encoding="utf-8")
+    _publish(tmp_path, v1, "v1")
+    v2 = index_store.new_build_dir(tmp_path)
+    assert index_store.seed_build_dir(tmp_path, v2) == v1
+    assert (v2 / "bm25.json").read_text(encoding="utf-8") == "{}"
+
+
+def test_gc_keeps_recent_and_in_progress_builds(tmp_path):
+    built = []
+    for n in range(4):
+        path = _build(tmp_path, f"v{n}")
+        _publish(tmp_path, path, f"v{n}")
+        built.append(path)
+    in_progress = _build(tmp_path, "next")   # build อื่นที่ยังไม่ publish
+
+    removed = index_store.gc(tmp_path, keep=2)
+    assert sorted(removed) == sorted(p.relative_to(tmp_path).as_posix() for p in built[:2])
+    assert all(p.is_dir() for p in built[2:]) and in_progress.is_dir()
+
+
+@pytest.fixture
+def live_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieval, "INDEX_PATH", str(tmp_path))
+    monkeypatch.setattr(retrieval, "_gen", None)
+    monkeypatch.setattr(retrieval, "_reload_after", 0.0)
+    monkeypatch.setattr(retrieval, "RELEASE_GRACE_S", 0)
+    return tmp_path
+
+
+def test_retrieval_reload_swaps_generation(live_index, monkeypatch):
+    v1 = _build(live_index, "v1")
+    _publish(live_index, v1, "v1")
+    old = retrieval._generation()
+    assert old.version == "v1" and retrieval.index_dir() == v1
+
+    closed = []
+    monkeypatch.setattr(old, "close", lambda: closed.append(True))
+    v2 = _build(live_index, "v2")
+    _publish(live_index, v2, "v2")
+    assert retrieval.reload(wait=True) == "v2"
+    assert retrieval.index_dir() == v2
+    assert closed == [True]   # generation เดิมถูกปิด (RELEASE_GRACE_S=0)
+
+
+def test_retrieval_background_reload(live_index):
+    v1 = _build(live_index, "v1")
+    _publish(live_index, v1, "v1")
+    assert retrieval._generation().version == "v1"
+
+    v2 = _build(live_index, "v2")
+    _publish(live_index, v2, "v2")
+    assert retrieval._generation().version == "v1"   # query นี้ยังได้ตัวเดิม ไม่ต้องรอ
+    deadline = time.monotonic() + 2
+    while retrieval._generation().version != "v2" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert retrieval._generation().version == "v2"
@@ -0,0 +1,81 @@
+# tests/test_pack_context.py  (_pack_context: budget / dedup / ไม่ใส่คำถามซ้ำ)
+import pytest
+
+import llm
+
+
+def _chunk(question, answer, score):
+    return {"text": f"{question}\n\n{answer}", "score": score, "meta": {"question": question}}
+
+
+def _words(n, tag):
+    return " ".join(f"{tag}{i}" for i in range(n))
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    def set_budget(tokens):
+        monkeypatch.setattr(llm, "MAX_CTX_TOKENS", tokens)
+    return set_budget
+
+
+def test_top_chunk_kept_even_when_others_score_more_together(budget):
+    # กรณีที่ knapsack เดิมทิ้ง chunk 0.80 แล้วเลือก 0.50 + 0.45 แทน
+    budget(424)
+    top = _chunk("How do I log covers?", _words(360, "c"), 0.80)
+    a = _chunk("How do I log waste?", _words(150, "w"), 0.50)
+    b = _chunk("How do I change shifts?", _words(150, "s"), 0.45)
+    ctx, used, stats = llm._pack_context([a, b, top])
+    assert ctx.startswith("[Q1] How do I log covers?\n")
+    assert used == 1
+
+
+def test_chunks_that_do_not_fit_are_skipped_not_stopped_at(budget):
+    budget(200)
+    chunks = [_chunk("Q one?", _words(40, "a"), 0.9),
+              _chunk("Q two?", _words(400, "b"), 0.8),   # ไม่พอดี → ข้าม
+              _chunk("Q three?", _words(40, "c"), 0.7)]
+    ctx, used, _ = llm._pack_context(chunks)
+    assert used == 2
+    assert "[Q1] Q one?" in ctx and "[Q2] Q three?" in ctx and "Q two?" not in ctx
+
+
+def test_ctx_tokens_respect_budget(budget):
+    budget(300)
+    chunks = [_chunk(f"Question {i}?", _words(60, f"t{i}_"), 1 - i / 10) for i in range(8)]
+    ctx, used, stats = llm._pack_context(chunks)
+    assert 1 < used < 8
+    assert stats["ctx_tokens"] == llm._estimate_tokens(ctx) <= 300
+
+
+def test_near_duplicates_are_dropped(budget, monkeypatch):
+    budget(2000)
+    monkeypatch.setattr(llm, "DEDUP_JACCARD", 0.85)
+    body = _words(50, "x")
+    chunks = [_chunk("How do I log covers?", body, 0.9),
+              _chunk("How do I log covers?", body + " x0", 0.85),
+              _chunk("How do I log waste?", _words(50, "y"), 0.8)]
+    ctx, used, stats = llm._pack_context(chunks)
+    assert used == 2 and stats["dropped_duplicates"] == 1
+    assert ctx.count("How do I log covers?") == 1
+
+
+def test_question_line_is_not_repeated(budget):
+    budget(2000)
+    ctx, used, _ = llm._pack_context([_chunk("How do I log covers?", "Open the Covers tab.", 0.9)])
+    assert ctx == "[Q1] How do I log covers?\nOpen the Covers tab.\n\n"
+
+
+def test_saved_tokens_measured_against_token_budget(budget):
+    budget(424)
+    chunks = [_chunk(f"Question {i}?", _words(30, f"t{i}_"), 1 - i / 10) for i in range(3)]
+    _, _, stats = llm._pack_context(chunks)
+    naive = sum(llm._estimate_tokens(f"[Q{i}] {c['meta']['question']}\n{c['text']}\n\n")
+                for i, c in enumerate(chunks, 1))
+    assert naive <= 424   # ทุก chunk พอดี budget → packer เดิมก็ส่งครบ
+    assert stats["ctx_tokens_saved"] == naive - stats["ctx_tokens"] > 0
+
+
+def test_empty_context():
+    assert llm._pack_context([]) == ("NO_CONTEXT", 0, {"ctx_tokens": 0, "ctx_tokens_saved": 0,
+                                                       "dropped_duplicates": 0})
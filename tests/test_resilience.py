@@ -0,0 +1,237 @@
+# tests/test_resilience.py  (Resilient: retry / timeout / circuit breaker กับ fake_mistral + stream abort ตอน escalate)
+import asyncio, json, time, urllib.error, urllib.request
+
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, Resilient
+from conftest import FakeStream
+
+
+class UpstreamError(Exception):
+    """HTTP error ที่มี status_code แบบเดียวกับ SDKError ของ mistralai"""
+
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+
+
+def _chat(url: str, timeout: float = 2.0) -> dict:
+    body = json.dumps({"model": "mistral-small-latest",
+                       "messages": [{"role": "user", "content": "hi"}]}).encode("utf-8")
+    req = urllib.request.Request(url + "/v1/chat/completions", data=body,
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        raise UpstreamError(e.code) from None
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_BASE_S", 0.01)
+    monkeypatch.setattr(resilience, "RETRY_CAP_S", 0.05)
+
+
+def test_retry_recovers_from_transient_error(fake_mistral):
+    cfg, url, counts = fake_mistral
+    cfg.error_rate = 1.0
+    r = Resilient("test", retry_max=2, hedge=False)
+
+    def call(left):
+        try:
+            return _chat(url)
+        finally:
+            cfg.error_rate = 0.0   # พังแค่ครั้งแรก
+
+    out = r.call(call)
+    assert out["choices"][0]["message"]["content"].startswith("FIT")
+    assert counts["requests"] == 2
+    assert r.counts["retries"] == 1 and r.counts["failures"] == 0
+    assert r.breaker.state == "closed"
+
+
+def test_retry_gives_up_after_retry_max(fake_mistral):
+    cfg, url, counts = fake_mistral
+    cfg.error_rate = 1.0
+    r = Resilient("test", retry_max=2, hedge=False, breaker=CircuitBreaker(failures=10))
+    with pytest.raises(UpstreamError):
+        r.call(lambda left: _chat(url))
+    assert counts["requests"] == 3
+    assert r.counts["retries"] == 2 and r.counts["failures"] == 1
+
+
+def test_client_error_is_not_retried(fake_mistral):
+    cfg, url, counts = fake_mistral
+    cfg.error_rate, cfg.error_status = 1.0, 400
+    r = Resilient("test", retry_max=3, hedge=False, breaker=CircuitBreaker(failures=1))
+    with pytest.raises(UpstreamError):
+        r.call(lambda left: _chat(url))
+    assert counts["requests"] == 1
+    assert r.breaker.state == "closed"   # 4xx = upstream ยังตอบได้
+
+
+def test_attempts_get_remaining_deadline(fake_mistral):
+    cfg, url, counts = fake_mistral
+    cfg.timeout_rate, cfg.hang_s = 1.0, 1.0
+    r = Resilient("test", retry_max=10, hedge=False, breaker=CircuitBreaker(failures=100))
+    seen = []
+
+    def call(left):
+        seen.append(left)
+        return _chat(url, timeout=left)
+
+    t0 = time.monotonic()
+    with pytest.raises(TimeoutError):
+        r.call(call, deadline_s=0.35)
+    assert time.monotonic() - t0 < 0.5
+    assert seen[0] == pytest.approx(0.35, abs=0.02)
+    assert all(b < a for a, b in zip(seen, seen[1:]))   # retry ได้แค่เวลาที่เหลือ
+    assert r.counts["failures"] == 1
+
+
+def test_attempt_as_long_as_deadline_is_not_retried(fake_mistral):
+    cfg, url, counts = fake_mistral
+    cfg.timeout_rate, cfg.hang_s = 1.0, 1.0
+    r = Resilient("test", retry_max=10, hedge=False, breaker=CircuitBreaker(failures=100))
+    t0 = time.monotonic()
+    with pytest.raises(TimeoutError):
+        r.call(lambda left: _chat(url, timeout=0.3), deadline_s=0.3)
+    assert time.monotonic() - t0 < 0.45
+    assert counts["requests"] == 1 and r.counts["retries"] == 0
+
+
+def test_call_async_cancels_attempt_at_deadline():
+    r = Resilient("test", retry_max=10, hedge=False, breaker=CircuitBreaker(failures=100))
+    seen = []
+
+    async def hang(left):
+        seen.append(left)
+        await asyncio.sleep(10)
+
+    t0 = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(r.call_async(hang, deadline_s=0.2))
+    assert time.monotonic() - t0 < 0.35
+    assert len(seen) == 1 and seen[0] == pytest.approx(0.2, abs=0.02)
+
+
+def test_call_async_retries_within_deadline():
+    r = Resilient("test", retry_max=2, hedge=False)
+    attempts = []
+
+    async def flaky(left):
+        attempts.append(left)
+        if len(attempts) == 1:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert asyncio.run(r.call_async(flaky, deadline_s=1.0)) == "ok"
+    assert len(attempts) == 2 and attempts[1] < attempts[0]
+
+
+def test_breaker_opens_then_recovers_through_half_open(fake_mistral):
+    cfg, url, counts = fake_mistral
+    cfg.error_rate = 1.0
+    breaker = CircuitBreaker(failures=2, cooldown_s=0.2)
+    r = Resilient("test", retry_max=0, hedge=False, breaker=breaker)
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            r.call(lambda left: _chat(url))
+    assert breaker.state == "open" and breaker.opened == 1
+
+    with pytest.raises(CircuitOpenError):
+        r.call(lambda left: _chat(url))
+    assert counts["requests"] == 2   # fail fast: ไม่ยิงไป upstream
+    assert breaker.rejected == 1
+
+    time.sleep(0.25)
+    cfg.error_rate = 0.0
+    r.call(lambda left: _chat(url))   # probe ตอน half-open สำเร็จ → ปิดวงจร
+    assert breaker.state == "closed"
+
+
+def test_half_open_probe_failure_reopens(fake_mistral):
+    cfg, url, _ = fake_mistral
+    cfg.error_rate = 1.0
+    breaker = CircuitBreaker(failures=1, cooldown_s=0.1)
+    r = Resilient("test", retry_max=0, hedge=False, breaker=breaker)
+    with pytest.raises(UpstreamError):
+        r.call(lambda left: _chat(url))
+    time.sleep(0.15)
+    with pytest.raises(UpstreamError):
+        r.call(lambda left: _chat(url))
+    assert breaker.state == "open" and breaker.opened == 2
+
+
+# ---- escalation: small model ตอบ "not sure" → ตัด stream แล้วใช้ smart model ----
+@pytest.fixture
+def llm_fake(fake_mistral, monkeypatch):
+    pytest.importorskip("mistralai")
+    import llm
+    cfg, url, counts = fake_mistral
+    monkeypatch.setattr(llm, "MISTRAL_SERVER_URL", url)
+    monkeypatch.setattr(llm, "MISTRAL_API_KEY", "fake")
+    monkeypatch.setattr(llm, "ANSWER_CACHE", False)
+    monkeypatch.setattr(llm, "STREAM_ESCALATE", True)
+    monkeypatch.setattr(llm, "SPECULATIVE_ESCALATE", False)
+    monkeypatch.setattr(llm, "_upstream", Resilient("mistral-test", hedge=False))
+    llm._client.reset()
+    yield llm, cfg, counts
+    llm._client.reset()
+
+
+CHUNKS = [{"text": "Covers are logged per shift.", "score": 0.8, "match": "vector",
+           "meta": {"question": "How do I log covers?"}}]
+
+
+def test_stream_aborts_on_early_refusal(llm_fake):
+    llm, cfg, _ = llm_fake
+    cfg.refusal_rate, cfg.completion_tokens, cfg.latency_ms = 1.0, 200, 400
+    t0 = time.monotonic()
+    out = llm._stream_call(llm.MODEL, "How do I log covers?", "[Q1] How do I log covers?\n...")
+    assert out.get("aborted") is True
+    assert "not sure" in out["text"].lower()
+    assert time.monotonic() - t0 < 0.4   # ไม่รอให้ small model ตอบจบ
+
+
+def test_escalates_to_smart_model_after_abort(llm_fake):
+    llm, cfg, counts = llm_fake
+    cfg.refusal_rate = 1.0
+    out = llm.answer_with_llm("How do I log covers?", CHUNKS)
+    assert out["model_used"] == llm.SMART_MODEL
+    assert "not sure" not in out["text"].lower()
+    assert counts["refusals"] == 1 and counts["requests"] == 2
+
+
+# ---- stream: ช่วงก่อน chunk แรก retry ได้, หลังจากนั้นไม่ (ใช้ client ปลอม ไม่ต้องมี mistralai) ----
+@pytest.fixture
+def llm_stub(monkeypatch, stub_client):
+    import llm
+    monkeypatch.setattr(llm, "_upstream", Resilient("mistral-test", retry_max=2, hedge=False,
+                                                    breaker=CircuitBreaker(failures=2)))
+    return llm, stub_client
+
+
+def test_stream_open_failure_is_retried(llm_stub):
+    llm, install = llm_stub
+    stream = FakeStream(["FIT ", "answer ", "[Q1]"])
+    chat = install(ConnectionError("refused"), stream)
+    emitted = []
+    out = llm._stream_call(llm.MODEL, "q", "ctx", probe=True, on_token=lambda p, m: emitted.append(p))
+    assert "error" not in out and out["text"] == "FIT answer [Q1]"
+    assert len(chat.opened) == 2 and chat.opened[1] <= chat.opened[0]
+    assert "".join(emitted) == "FIT answer [Q1]" and stream.closed
+    assert llm._upstream.counts["retries"] == 1
+
+
+def test_stream_failure_after_first_chunk_is_not_retried(llm_stub):
+    llm, install = llm_stub
+    stream = FakeStream(["FIT ", "answer"], fail_after=1)
+    chat = install(stream, FakeStream(["unused"]))
+    llm._upstream.breaker.failures = 1
+    out = llm._stream_call(llm.MODEL, "q", "ctx", probe=False)
+    assert out["error"] == "stream reset"
+    assert len(chat.opened) == 1 and stream.closed
+    assert llm._upstream.breaker.state == "open"   # พังกลาง stream ยังนับเป็นความล่ม
@@ -0,0 +1,91 @@
+# tests/test_singleflight.py
+import asyncio, threading
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def _run_threads(sf, key, fn, n):
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(sf.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    sf = SingleFlight("test-share")
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(2)
+        return {"answer": 42}
+
+    threads, results, errors = _run_threads(sf, "q", fn, 5)
+    while sf.stats()["calls"] < 5:
+        pass
+    release.set()
+    for t in threads:
+        t.join(2)
+    assert not errors and len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(r == {"answer": 42} for r, _ in results)
+    assert sf.stats() == {"calls": 5, "coalesced": 4, "inflight": 0}
+
+
+def test_leader_error_reaches_followers_and_is_not_cached():
+    sf = SingleFlight("test-error")
+    release = threading.Event()
+
+    def boom():
+        release.wait(2)
+        raise ValueError("upstream down")
+
+    threads, results, errors = _run_threads(sf, "q", boom, 3)
+    while sf.stats()["calls"] < 3:
+        pass
+    release.set()
+    for t in threads:
+        t.join(2)
+    assert not results and len(errors) == 3
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert sf.do("q", lambda: "ok") == ("ok", False)   # รอบถัดไปเรียกใหม่
+
+
+def test_different_keys_do_not_coalesce():
+    sf = SingleFlight("test-keys")
+    assert sf.do("a", lambda: 1) == (1, False)
+    assert sf.do("b", lambda: 2) == (2, False)
+    assert sf.stats()["coalesced"] == 0
+
+
+def test_async_cancelled_caller_does_not_cancel_others():
+    sf = AsyncSingleFlight("test-async")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        a = asyncio.ensure_future(sf.do("q", work))
+        b = asyncio.ensure_future(sf.do("q", work))
+        await asyncio.sleep(0.01)
+        a.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await a
+        return await b
+
+    assert asyncio.run(main()) == ("done", True)
+    assert len(calls) == 1
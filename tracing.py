@@ -0,0 +1,367 @@
+# tracing.py  (per-request spans → JSON lines, written by a background thread)
+#   python tracing.py [logs/requests.jsonl] [--name answer] [--json]   → latency percentiles ต่อ stage
+from __future__ import annotations
+import os, sys, json, time, uuid, queue, atexit, random, asyncio, argparse, functools, threading
+from contextvars import ContextVar, copy_context
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from lazy import Lazy
+
+TRACE            = os.getenv("TRACE", "1") == "1"
+TRACE_PATH       = Path(os.getenv("TRACE_PATH", "logs/requests.jsonl"))
+TRACE_SAMPLE     = float(os.getenv("TRACE_SAMPLE", 1.0))          # สัดส่วน request ที่เขียนลงไฟล์
+TRACE_KEEP_ERRORS = os.getenv("TRACE_KEEP_ERRORS", "1") == "1"    # request ที่มี error เขียนเสมอ
+TRACE_MAX_BYTES  = int(os.getenv("TRACE_MAX_BYTES", 20 * 1024 * 1024))
+TRACE_BACKUPS    = int(os.getenv("TRACE_BACKUPS", 3))             # requests.jsonl.1 .. .N
+TRACE_QUEUE      = int(os.getenv("TRACE_QUEUE", 10000))           # เต็ม → ทิ้ง (ไม่ block hot path)
+TRACE_FLUSH_S    = float(os.getenv("TRACE_FLUSH_S", 1.0))
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+
+
+class Trace:
+    """1 request = 1 บรรทัด JSON: attrs ของ request + list ของ span (start/ms นับจากต้น request)"""
+
+    __slots__ = ("id", "name", "ts", "t0", "attrs", "spans")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.ts = time.time()
+        self.t0 = time.perf_counter()
+        self.attrs = attrs
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, name: str, t_start: float, t_end: float, attrs: Dict[str, Any]) -> None:
+        # list.append atomic ภายใต้ GIL → span จาก thread/task ลูกต่อท้ายได้เลย
+        self.spans.append({"name": name, "start_ms": round((t_start - self.t0) * 1000, 3),
+                           "ms": round((t_end - t_start) * 1000, 3), **attrs})
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def has_error(self) -> bool:
+        return "error" in self.attrs or any("error" in s for s in self.spans)
+
+    def record(self, t_end: float) -> Dict[str, Any]:
+        # copy spans ตอนปิด: งานที่ยังวิ่งอยู่ (เช่น speculative call) ต่อท้ายทีหลังได้โดยไม่ชนกับ writer
+        return {"ts": round(self.ts, 3), "id": self.id, "name": self.name,
+                "ms": round((t_end - self.t0) * 1000, 3), **self.attrs, "spans": list(self.spans)}
+
+
+class _Span:
+    """context manager ของ span; ไม่มี trace อยู่ (หรือ TRACE=0) → no-op ราคาถูก"""
+
+    __slots__ = ("trace", "name", "attrs", "t0")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.trace = _current.get()
+        self.name = name
+        self.attrs = attrs
+        self.t0 = 0.0
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "_Span":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, et, e, tb) -> bool:
+        if self.trace is not None:
+            if e is not None:
+                self.attrs["error"] = type(e).__name__
+            self.trace.add(self.name, self.t0, time.perf_counter(), self.attrs)
+        return False
+
+
+class _Request:
+    """
+    root ของ trace: ถ้ามี trace อยู่แล้ว (เรียกซ้อน เช่น answer() → answer_with_llm()) กลายเป็น span ธรรมดา
+    ตอนออก: ตัดสิน sampling แล้วส่งให้ writer (serialize / I/O ทำใน background thread)
+    """
+
+    __slots__ = ("name", "attrs", "trace", "span", "token")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.trace: Optional[Trace] = None
+        self.span: Optional[_Span] = None
+        self.token = None
+
+    def set(self, **attrs) -> None:
+        (self.trace or self.span).set(**attrs)
+
+    def __enter__(self) -> "_Request":
+        if TRACE and _current.get() is None:
+            self.trace = Trace(self.name, self.attrs)
+            self.token = _current.set(self.trace)
+        else:
+            self.span = _Span(self.name, self.attrs).__enter__()
+        return self
+
+    def __exit__(self, et, e, tb) -> bool:
+        if self.span is not None:
+            return self.span.__exit__(et, e, tb)
+        _current.reset(self.token)
+        tr = self.trace
+        if e is not None:
+            tr.attrs["error"] = type(e).__name__
+        if random.random() < TRACE_SAMPLE or (TRACE_KEEP_ERRORS and tr.has_error()):
+            _writer.get().put(tr.record(time.perf_counter()))
+        else:
+            _writer_stats["sampled_out"] += 1
+        return False
+
+
+# ---- public API ----
+def request(name: str, **attrs) -> _Request:
+    return _Request(name, attrs)
+
+def span(name: str, **attrs) -> _Span:
+    return _Span(name, attrs)
+
+def event(name: str, **attrs) -> None:
+    """span ความยาว 0 (เช่น ผลการตัดสินใจ escalate)"""
+    tr = _current.get()
+    if tr is not None:
+        now = time.perf_counter()
+        tr.add(name, now, now, attrs)
+
+def annotate(**attrs) -> None:
+    """เพิ่ม attrs ให้ root ของ request ปัจจุบัน"""
+    tr = _current.get()
+    if tr is not None:
+        tr.attrs.update(attrs)
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+def bind(fn: Callable) -> Callable:
+    """ส่ง trace ปัจจุบันไปกับงานที่ submit เข้า thread pool (contextvars ไม่ตามไปเอง)"""
+    ctx = copy_context()
+    return functools.partial(ctx.run, fn)
+
+def traced(name: str, result_attrs: Optional[Callable[[Any], Dict[str, Any]]] = None) -> Callable:
+    """
+    decorator: ครอบ function (sync หรือ async) ด้วย request(name)
+    result_attrs(result) → attrs ที่จะติดไว้กับ span/trace หลังได้ผล
+    """
+    def deco(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                if not TRACE:
+                    return await fn(*args, **kwargs)
+                with request(name) as r:
+                    out = await fn(*args, **kwargs)
+                    if result_attrs is not None:
+                        r.set(**result_attrs(out))
+                    return out
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACE:
+                return fn(*args, **kwargs)
+            with request(name) as r:
+                out = fn(*args, **kwargs)
+                if result_attrs is not None:
+                    r.set(**result_attrs(out))
+                return out
+        return wrapper
+    return deco
+
+
+# ---- background writer: queue → buffer → append + rotate ----
+_STOP = object()
+_writer_stats = {"written": 0, "dropped": 0, "sampled_out": 0, "rotations": 0, "write_errors": 0}
+
+
+class _Writer:
+    def __init__(self, path: Path, max_bytes: int, backups: int, maxsize: int, flush_s: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_s = flush_s
+        self.q: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, item) -> None:
+        try:
+            self.q.put_nowait(item)
+        except queue.Full:
+            _writer_stats["dropped"] += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """รอจนของที่อยู่ในคิวตอนนี้ถูกเขียนลงไฟล์ (ใช้ใน CLI / ก่อนปิด process)"""
+        done = threading.Event()
+        try:
+            self.q.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        try:
+            self.q.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        buf: List[Dict[str, Any]] = []
+        last = time.monotonic()
+        while True:
+            try:
+                item = self.q.get(timeout=self.flush_s)
+            except queue.Empty:
+                item = None
+            waiters = []
+            stop = item is _STOP
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not None and not stop:
+                buf.append(item)
+            # ดึงที่ค้างในคิวมาเขียนรวดเดียว
+            while len(buf) < 1000 and not stop:
+                try:
+                    more = self.q.get_nowait()
+                except queue.Empty:
+                    break
+                if more is _STOP:
+                    stop = True
+                elif isinstance(more, threading.Event):
+                    waiters.append(more)
+                else:
+                    buf.append(more)
+            if buf and (stop or waiters or item is None or len(buf) >= 256
+                        or time.monotonic() - last >= self.flush_s):
+                self._write(buf)
+                buf = []
+                last = time.monotonic()
+            for w in waiters:
+                w.set()
+            if stop:
+                return
+
+    def _write(self, buf: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in buf).encode("utf-8")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                size = self.path.stat().st_size
+            except OSError:
+                size = 0
+            if self.max_bytes > 0 and size and size + len(data) > self.max_bytes:
+                self._rotate()
+            with self.path.open("ab") as f:
+                f.write(data)
+            _writer_stats["written"] += len(buf)
+        except OSError:
+            _writer_stats["write_errors"] += 1
+
+    def _rotate(self) -> None:
+        if self.backups <= 0:
+            self.path.unlink(missing_ok=True)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        _writer_stats["rotations"] += 1
+
+
+def _make_writer() -> _Writer:
+    w = _Writer(TRACE_PATH, TRACE_MAX_BYTES, TRACE_BACKUPS, TRACE_QUEUE, TRACE_FLUSH_S)
+    atexit.register(w.close)
+    return w
+
+_writer = Lazy("tracing.writer", _make_writer)
+
+def flush(timeout: float = 5.0) -> bool:
+    return _writer.get().flush(timeout) if _writer.loaded() else True
+
+def stats() -> Dict[str, Any]:
+    queued = _writer.get().q.qsize() if _writer.loaded() else 0
+    return {**_writer_stats, "queued": queued, "enabled": TRACE, "sample": TRACE_SAMPLE, "path": str(TRACE_PATH)}
+
+
+# ---- summary CLI ----
+def _log_files(path: Path) -> List[Path]:
+    """ไฟล์ backup ที่เก่ากว่ามาก่อน (.N ... .1) แล้วตามด้วยไฟล์ปัจจุบัน"""
+    backups = sorted(path.parent.glob(path.name + ".*"),
+                     key=lambda p: -int(p.suffix[1:]) if p.suffix[1:].isdigit() else 0)
+    return [p for p in backups if p.suffix[1:].isdigit()] + ([path] if path.exists() else [])
+
+
+def load(path: Path = TRACE_PATH) -> List[Dict[str, Any]]:
+    out = []
+    for p in _log_files(path):
+        with p.open("r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    out.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue   # บรรทัดสุดท้ายที่เขียนไม่ครบ (process ถูก kill)
+    return out
+
+
+def _pcts(xs: List[float]) -> Dict[str, float]:
+    xs = sorted(xs)
+    at = lambda p: xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+    return {"count": len(xs), "mean_ms": sum(xs) / len(xs),
+            "p50_ms": at(50), "p95_ms": at(95), "p99_ms": at(99), "max_ms": xs[-1]}
+
+
+def summarize(records: List[Dict[str, Any]], name: str = "") -> Dict[str, Any]:
+    """latency ต่อ stage (ชื่อ span) + ทั้ง request; span ที่ซ้ำใน request เดียว (เช่น llm 2 ครั้ง) นับแยก"""
+    if name:
+        records = [r for r in records if r.get("name") == name]
+    total: Dict[str, List[float]] = {}
+    stages: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    for r in records:
+        total.setdefault(r.get("name", "?"), []).append(float(r.get("ms", 0.0)))
+        if "error" in r:
+            errors[r.get("name", "?")] = errors.get(r.get("name", "?"), 0) + 1
+        for s in r.get("spans") or []:
+            stages.setdefault(s.get("name", "?"), []).append(float(s.get("ms", 0.0)))
+    return {
+        "requests": {k: {**_pcts(v), "errors": errors.get(k, 0)} for k, v in sorted(total.items())},
+        "stages": {k: _pcts(v) for k, v in sorted(stages.items())},
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Summarize trace log into per-stage latency percentiles")
+    ap.add_argument("path", nargs="?", default=str(TRACE_PATH))
+    ap.add_argument("--name", default="", help="เฉพาะ request ชื่อนี้ (เช่น answer, retrieve)")
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    records = load(Path(args.path))
+    if not records:
+        sys.exit(f"No trace records in {args.path}")
+    summary = summarize(records, args.name)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"📈 {len(records)} records from {args.path}")
+    for title, rows in (("request", summary["requests"]), ("stage", summary["stages"])):
+        print(f"\n{title:<22}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+        for k, v in rows.items():
+            print(f"{k:<22}{v['count']:>8}{v['mean_ms']:>10.1f}{v['p50_ms']:>10.1f}"
+                  f"{v['p95_ms']:>10.1f}{v['p99_ms']:>10.1f}{v['max_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()